@@ -1,16 +1,46 @@
 """Prompt Enhancement Tool — Streamlit app."""
 
+import hmac
+import os
+import sqlite3
+import threading
 import time
 
 import streamlit as st
 import streamlit.components.v1 as components
 
+from tools import metrics, profiling
 from tools.enhance_prompt import (
     LLM_PROFILES,
-    analyze_prompt_components,
-    build_enhanced_prompt,
-    generate_clarifying_questions,
+    MAX_ANSWER_CHARS,
+    MAX_DOCUMENT_CHARS,
+    add_refinement,
+    estimate_refine_tokens,
+    estimate_stage_tokens,
+    is_long_prompt,
+    refine_conversation,
+    safe_error_message,
+    stream_inferred_example,
+    stream_refined_prompt,
+    usage_listener,
+    warmup,
 )
+from tools.deadline import Deadline, DeadlineExceeded
+from tools.enhance_sections import estimate_sections_tokens
+from tools.detect_components import detect_components
+from tools.job_queue import cancel_job, get_job, submit_job
+from tools.lint_prompt import repair_prompt
+from tools.prompt_gallery import gallery_enabled, load_gallery, lookup_gallery
+from tools.prompt_history import (
+    history_enabled,
+    record_enhancement,
+    search_history,
+    similar_prompts,
+)
+from tools.quota import QuotaExceeded, account_for, charged_to, remaining_tokens
+from tools.render_prompt import render_instant_prompt
+from tools.request_log import RunRecord
+from tools.token_budget import TokenLedger, daily_tokens_used
 
 # ---------------------------------------------------------------------------
 # Page config
@@ -22,7 +52,20 @@ st.set_page_config(
     layout="centered",
 )
 
-st.markdown("""
+# Profiling: PROFILE=on, or ?profile=on|off&token=<PROFILE_ADMIN_TOKEN> to
+# switch it for the whole process. Output goes to .tmp/profiles/.
+_PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+_PROFILE_PANEL_RUNS = 20
+if (
+    _PROFILE_ADMIN_TOKEN
+    and "profile" in st.query_params
+    and hmac.compare_digest(st.query_params.get("token", ""), _PROFILE_ADMIN_TOKEN)
+):
+    profiling.set_enabled(st.query_params["profile"] == "on")
+_profile_run = profiling.start_run("rerun", state=st.session_state)
+
+with profiling.section("css"):
+    st.markdown("""
 <style>
 /* ── Base ──────────────────────────────── */
 .stApp { background: #f5f6ff; }
@@ -75,42 +118,6 @@ st.markdown("""
     border-color: #764ba2 !important; color: #764ba2 !important;
 }
 
-/* ── LLM Dropdown (replaces button selector) ───────── */
-[data-testid="stRadio"] [role="radiogroup"] {
-    position: absolute !important; opacity: 0 !important;
-    pointer-events: none !important; height: 0 !important; overflow: hidden !important;
-}
-[data-testid="stRadio"] > div { margin: 0 !important; padding: 0 !important; }
-.llm-dd-container {
-    position: relative; width: 280px; user-select: none; margin: 4px 0 10px 0;
-}
-.llm-dd-trigger {
-    display: flex; align-items: center; gap: 10px; padding: 9px 14px;
-    background: white; border: 2px solid #667eea; border-radius: 10px;
-    cursor: pointer; font-weight: 600; font-size: 0.93rem; color: #1a1a2e;
-    box-shadow: 0 2px 8px rgba(102,126,234,0.12); transition: all 0.18s;
-}
-.llm-dd-trigger:hover { border-color: #764ba2; box-shadow: 0 4px 14px rgba(102,126,234,0.25); }
-.llm-dd-trigger img { width: 22px; height: 22px; object-fit: contain; }
-.llm-dd-arrow { margin-left: auto; color: #667eea; transition: transform 0.18s; font-size: 0.8rem; }
-.llm-dd-container.open .llm-dd-arrow { transform: rotate(180deg); }
-.llm-dd-options {
-    display: none; position: absolute; top: calc(100% + 4px); left: 0; right: 0;
-    background: white; border: 2px solid rgba(102,126,234,0.22); border-radius: 10px;
-    box-shadow: 0 8px 24px rgba(102,126,234,0.18); z-index: 99999; overflow: hidden;
-}
-.llm-dd-container.open .llm-dd-options { display: block; }
-.llm-dd-option {
-    display: flex; align-items: center; gap: 10px; padding: 10px 14px;
-    cursor: pointer; font-size: 0.9rem; font-weight: 500; color: #1a1a2e;
-    transition: background 0.12s; border-bottom: 1px solid rgba(102,126,234,0.07);
-}
-.llm-dd-option:last-child { border-bottom: none; }
-.llm-dd-option:hover { background: rgba(102,126,234,0.06); }
-.llm-dd-option.active { background: rgba(102,126,234,0.1); color: #667eea; font-weight: 700; }
-.llm-dd-option img { width: 20px; height: 20px; object-fit: contain; }
-.llm-dd-check { margin-left: auto; color: #667eea; font-size: 0.85rem; }
-
 /* ── Progress bar ──────────────────────── */
 div[data-testid="stProgress"] > div {
     background: rgba(102,126,234,0.15); border-radius: 10px; height: 8px !important;
@@ -198,23 +205,78 @@ _DEFAULTS = {
     "answers": {},
     "current_q": 0,
     "enhanced_prompt": "",
+    "sections": {},           # per-component enhance output (sectioned mode)
+    "lint_report": {},        # rules the linter flagged and repaired on the result
+    "degraded_notice": "",    # why the result was rendered locally instead of by the API
+    "refine_conversation": [],  # enhance exchange + refinement turns behind the current result
+    "job_id": "",             # background API job this session is waiting on
+    "job_error": "",          # user-safe error from the last failed analysis/questions job
+    "gallery_questions": [],  # precomputed questions for a gallery prompt (skips the questions job)
+    "example_jobs": {},       # question index -> prefetch job id (lazy questions mode)
+    "spec_job_id": "",        # speculative enhance job built from all suggested answers
+    "cancelled_jobs": [],     # cancelled jobs whose usage is merged once their workers stop
+    "live_key": ("", ""),     # (prompt, LLM) last seen by the live analysis
+    "live_changed_at": 0.0,   # when live_key last changed
+    "live_job_id": "",        # live analysis job of the latest settled text
+    "live_result": {},        # finished live analysis: raw_prompt, target_llm, components
     "draft": "",              # holds the text area value for the current question
     "use_suggestion": False,
     "last_request_time": 0,   # unix timestamp of last API call
-    "request_count": 0,       # total API calls this session
 }
 
-# Input limits
-_MAX_PROMPT_CHARS = 6000
-_MAX_ANSWER_CHARS = 1000
+# Input limits (defined with the shared validation in tools/enhance_prompt.py)
+_MAX_PROMPT_CHARS = MAX_DOCUMENT_CHARS
+_MAX_ANSWER_CHARS = MAX_ANSWER_CHARS
+
+# "single" builds the enhanced prompt in one call; "sectioned" builds one
+# section per component and only regenerates sections whose inputs changed;
+# "parallel" is sectioned with all stale sections generated concurrently.
+_ENHANCE_MODE = os.getenv("ENHANCE_MODE", "single")
+_SECTIONED_MODES = ("sectioned", "parallel")
+
+# "full" asks for every question's inferred example up front; "lazy" fetches
+# questions first in a small call, then each example when its question shows.
+_QUESTIONS_MODE = os.getenv("QUESTIONS_MODE", "full")
+
+# API stages run as background jobs; the page polls for the result this often.
+_JOB_POLL_SECONDS = 1.0
+_JOB_MESSAGES = {
+    "analysis": "Analyzing your prompt...",
+    "questions": "Identifying what we need from you...",
+    "example": "Drafting a suggested answer...",
+    "enhance": "Building your enhanced prompt...",
+}
+
+# Speculative build: as soon as questions arrive, build the prompt in the
+# background as if every suggestion will be accepted. Capped per session by
+# estimated worst-case tokens spent on speculation.
+_SPECULATE = os.getenv("SPECULATIVE_BUILD", "on") != "off"
+_MAX_SPECULATION_TOKENS_PER_SESSION = 30_000
 
-# Rate limiting — no enforced wait between requests; just a per-session cap
-_MIN_SECONDS_BETWEEN_REQUESTS = 0   # no cooldown
-_MAX_REQUESTS_PER_SESSION = 60      # ~20 full enhance flows per browser session
+# Live analysis: while the user edits the prompt, a local component check
+# updates on every committed edit, and once the text has settled for the
+# debounce an analysis job starts in the background, superseding the one for
+# older text. "Analyze" then renders from the finished job. Off by default —
+# each settled edit can cost one analysis call.
+_LIVE_ANALYSIS = os.getenv("LIVE_ANALYSIS", "off") == "on"
+_LIVE_DEBOUNCE_SECONDS = int(os.getenv("LIVE_ANALYSIS_DEBOUNCE_MS", "800")) / 1000
+_LIVE_POLL_SECONDS = 0.5
+_LIVE_MIN_CHARS = 20
 
+# Rate limiting — no enforced wait between requests; token budgets instead.
+# Each stage is checked against its estimated worst case (input + max_tokens)
+# before the call, and the ledger records the actual usage afterwards.
+_MIN_SECONDS_BETWEEN_REQUESTS = 0       # no cooldown
+_MAX_TOKENS_PER_SESSION = 150_000       # ~20 full enhance flows per browser session
+_MAX_TOKENS_PER_DAY = 5_000_000         # shared by every session in this process
 
 
-def _check_rate_limit() -> str | None:
+def _user_id() -> str | None:
+    """The user this session's API calls are charged to (tools/quota.py)."""
+    return account_for(st.context.headers)
+
+
+def _check_rate_limit(estimated_tokens: int = 0) -> str | None:
     """Return an error message string if rate limited, else None."""
     now = time.time()
     if _MIN_SECONDS_BETWEEN_REQUESTS > 0:
@@ -222,41 +284,373 @@ def _check_rate_limit() -> str | None:
         if elapsed < _MIN_SECONDS_BETWEEN_REQUESTS:
             wait = int(_MIN_SECONDS_BETWEEN_REQUESTS - elapsed) + 1
             return f"Please wait {wait} seconds before submitting again."
-    if st.session_state.request_count >= _MAX_REQUESTS_PER_SESSION:
-        return "Session limit reached. Please refresh the page to start a new session."
+    if st.session_state.token_ledger.remaining(_MAX_TOKENS_PER_SESSION) < estimated_tokens:
+        return "Session token budget reached. Please come back later to start a new session."
+    if _MAX_TOKENS_PER_DAY - daily_tokens_used() < estimated_tokens:
+        return "The daily usage limit for this tool has been reached. Please try again tomorrow."
+    remaining = remaining_tokens(_user_id())
+    if remaining is not None and remaining < estimated_tokens:
+        return "Your daily token quota has been reached. It resets at midnight."
     return None
 
 
+def _stage_estimate(stage: str) -> int:
+    """Worst-case token cost of running stage on the current session inputs."""
+    return estimate_stage_tokens(
+        stage,
+        st.session_state.raw_prompt,
+        st.session_state.target_llm,
+        st.session_state.components,
+        st.session_state.answers,
+    )
+
+
+def _enhance_estimate(answers: dict | None = None) -> int:
+    """Estimated tokens of an enhance with answers (default: the session's)."""
+    if _ENHANCE_MODE in _SECTIONED_MODES:
+        return estimate_sections_tokens(
+            st.session_state.raw_prompt,
+            st.session_state.target_llm,
+            st.session_state.components,
+            st.session_state.answers if answers is None else answers,
+            st.session_state.sections,
+        )
+    return _stage_estimate("enhance")
+
+
+def _submit_job(kind: str, **payload):
+    """Queue an API stage in the background; the router shows progress until it finishes."""
+    _record_request()
+    job_id = submit_job(kind, {**payload, "user": _user_id()})
+    st.session_state.job_id = job_id
+    st.session_state.job_error = ""
+    # Kept in the URL so a refreshed page can pick the result up again.
+    st.query_params["job"] = job_id
+
+
+def _submit_enhance():
+    _submit_job(
+        "enhance",
+        raw_prompt=st.session_state.raw_prompt,
+        target_llm=st.session_state.target_llm,
+        components=st.session_state.components,
+        answers=st.session_state.answers,
+        mode=_ENHANCE_MODE,
+        sections=st.session_state.sections,
+    )
+
+
+def _speculate():
+    """Start a background build assuming every inferred example gets accepted."""
+    questions = st.session_state.questions
+    if not (_SPECULATE and questions and all(q.get("inferred_example") for q in questions)):
+        return
+    answers = {q["component"]: q["inferred_example"] for q in questions}
+    estimate = estimate_stage_tokens(
+        "enhance",
+        st.session_state.raw_prompt,
+        st.session_state.target_llm,
+        st.session_state.components,
+        answers,
+    )
+    spent = st.session_state.speculation_tokens
+    if spent + estimate > _MAX_SPECULATION_TOKENS_PER_SESSION or _check_rate_limit(estimate):
+        metrics.increment("speculation.skipped")
+        return
+    st.session_state.speculation_tokens = spent + estimate
+    st.session_state.spec_job_id = submit_job("enhance", {
+        "raw_prompt": st.session_state.raw_prompt,
+        "target_llm": st.session_state.target_llm,
+        "components": st.session_state.components,
+        "answers": answers,
+        "mode": _ENHANCE_MODE,
+        "sections": st.session_state.sections,
+        "record_history": False,
+        "user": _user_id(),
+    })
+    metrics.increment("speculation.started")
+
+
+def _use_speculation() -> bool:
+    """
+    Adopt the speculative build as the session's job if it used exactly the
+    final inputs — the router applies it at once when it has already finished,
+    otherwise shows progress for the remainder. Returns False on a miss.
+    """
+    spec_id = st.session_state.spec_job_id
+    if not spec_id:
+        return False
+    job = get_job(spec_id)
+    payload = job["payload"] if job else {}
+    hit = (
+        job is not None
+        and job["status"] != "failed"
+        and payload["answers"] == st.session_state.answers
+        and payload["components"] == st.session_state.components
+        and payload["raw_prompt"] == st.session_state.raw_prompt
+        and payload["target_llm"] == st.session_state.target_llm
+    )
+    metrics.increment("speculation.hit" if hit else "speculation.miss")
+    if not hit:
+        _drop_speculation()
+        return False
+    st.session_state.spec_job_id = ""
+    st.session_state.job_id = spec_id
+    st.query_params["job"] = spec_id
+    return True
+
+
+def _drop_speculation():
+    """Discard the speculative build, cancelling it if it is still running; tokens it spent still count."""
+    spec_id = st.session_state.spec_job_id
+    st.session_state.spec_job_id = ""
+    if spec_id:
+        _cancel_background_job(spec_id)
+
+
+def _cancel_background_job(job_id: str):
+    """Cancel a job the session no longer needs; its usage is merged now or once its worker stops."""
+    if cancel_job(job_id):
+        st.session_state.cancelled_jobs = [*st.session_state.cancelled_jobs, job_id]
+        return
+    job = get_job(job_id)
+    if job and job["finished"]:
+        st.session_state.token_ledger.merge(job["usage"] or [])
+
+
+def _settle_cancelled_jobs():
+    """Merge the usage of cancelled jobs whose workers have stopped (see _cancel_background_job())."""
+    pending = []
+    for job_id in st.session_state.cancelled_jobs:
+        job = get_job(job_id)
+        if job is None or job["started_at"] is None:
+            continue   # gone, or cancelled before a worker picked it up
+        if job["usage"] is None:
+            pending.append(job_id)
+        else:
+            st.session_state.token_ledger.merge(job["usage"])
+    st.session_state.cancelled_jobs = pending
+
+
+def _forget_job():
+    st.session_state.job_id = ""
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+
+def _apply_job(job: dict):
+    """Move a finished job's result into session state and advance the stage."""
+    st.session_state.token_ledger.merge(job["usage"] or [])
+    _forget_job()
+    kind = job["kind"]
+
+    if job["status"] == "failed":
+        if kind == "enhance":
+            _run_instant(job["error"])
+            st.session_state.stage = "result"
+        else:
+            st.session_state.job_error = job["error"]
+            st.session_state.stage = "analysis"
+        return
+
+    result = job["result"]
+    if kind == "analysis":
+        st.session_state.components = result["components"]
+        st.session_state.stage = "analysis"
+    elif kind == "questions":
+        _start_questions(result["questions"])
+    else:
+        payload = job["payload"]
+        if payload.get("record_history") is False and history_enabled():
+            # An adopted speculative build — the worker left history to us.
+            usage = job["usage"] or []
+            try:
+                record_enhancement(
+                    payload["raw_prompt"], payload["target_llm"], payload["components"], payload["answers"],
+                    result["enhanced_prompt"],
+                    input_tokens=sum(e["input_tokens"] for e in usage),
+                    output_tokens=sum(e["output_tokens"] for e in usage),
+                    latency_ms=(job["finished_at"] - job["started_at"]) * 1000,
+                )
+            except sqlite3.Error:
+                metrics.increment("history.errors")
+        st.session_state.enhanced_prompt = result["enhanced_prompt"]
+        st.session_state.sections = result["sections"]
+        st.session_state.lint_report = result.get("lint", {})
+        st.session_state.degraded_notice = result.get("degraded", "")
+        st.session_state.stage = "result"
+
+
+def _start_questions(questions: list):
+    st.session_state.questions = questions
+    _drop_example_jobs()
+    st.session_state.current_q = 0
+    st.session_state.answers = {}
+    st.session_state.draft = ""
+    st.session_state.stage = "questions"
+    _speculate()
+
+
+def _collect_job() -> dict | None:
+    """
+    Apply the session's job if it has finished and return None, or return the
+    job while it is still running. A fresh session (e.g. after a browser
+    refresh) adopts the job named in the URL and restores its inputs.
+    """
+    job_id = st.session_state.job_id or st.query_params.get("job", "")
+    if not job_id:
+        return None
+    job = get_job(job_id)
+    if job is None:
+        _forget_job()
+        return None
+    if not st.session_state.job_id:
+        st.session_state.job_id = job_id
+        payload = job["payload"]
+        st.session_state.raw_prompt = payload["raw_prompt"]
+        st.session_state.target_llm = payload["target_llm"]
+        st.session_state.components = payload.get("components", {})
+        st.session_state.answers = payload.get("answers", {})
+        st.session_state.sections = payload.get("sections", {})
+    if job["status"] == "cancelled":
+        _forget_job()
+        return None
+    if not job["finished"]:
+        return job
+    _apply_job(job)
+    return None
+
+
+def _reuse_history(entry: dict):
+    """Button callback — load a past enhancement and jump straight to the result."""
+    st.session_state.raw_prompt = entry["raw_prompt"]
+    st.session_state.target_llm = entry["target_llm"]
+    st.session_state.components = entry["components"]
+    st.session_state.answers = entry["answers"]
+    st.session_state.enhanced_prompt = entry["enhanced_prompt"]
+    st.session_state.sections = {}
+    st.session_state.lint_report = {}
+    st.session_state.degraded_notice = ""
+    st.session_state.stage = "result"
+
+
+def _use_gallery(entry: dict):
+    """Button callback — serve a precomputed gallery enhancement with no API calls."""
+    st.session_state.raw_prompt = entry["raw_prompt"]
+    st.session_state.components = entry["components"]
+    st.session_state.questions = entry["questions"]
+    st.session_state.answers = {}
+    st.session_state.enhanced_prompt = entry["enhanced_prompt"]
+    st.session_state.sections = {}
+    st.session_state.lint_report = {}
+    st.session_state.degraded_notice = ""
+    st.session_state.stage = "result"
+
+
+def _history_lookup(lookup, *args) -> list:
+    """A history query, or [] when the store is unavailable — the input page never depends on it."""
+    try:
+        return lookup(*args)
+    except sqlite3.Error:
+        metrics.increment("history.errors")
+        return []
+
+
+def _history_entry(entry: dict, key: str):
+    """One past enhancement with a reuse button."""
+    preview = entry["raw_prompt"][:160] + ("…" if len(entry["raw_prompt"]) > 160 else "")
+    col_text, col_btn = st.columns([4, 1])
+    with col_text:
+        st.caption(f"**{entry['target_llm']}** · {preview}")
+    with col_btn:
+        st.button("Reuse", key=key, on_click=_reuse_history, args=(entry,), use_container_width=True)
+
+
+def _run_instant(notice: str = ""):
+    """Render the enhanced prompt locally (no API call) and store it."""
+    st.session_state.enhanced_prompt = render_instant_prompt(
+        st.session_state.raw_prompt,
+        st.session_state.target_llm,
+        st.session_state.components,
+        st.session_state.answers,
+    )
+    st.session_state.sections = {}
+    st.session_state.lint_report = {}
+    st.session_state.degraded_notice = notice
+
+
+def _instant_fallback():
+    """Button callback — render locally instead of retrying the failed analysis."""
+    _run_instant("The AI service was unavailable.")
+    st.session_state.job_error = ""
+    st.session_state.stage = "result"
+
+
 def _record_request():
     st.session_state.last_request_time = time.time()
-    st.session_state.request_count += 1
 
 
-def _safe_api_error(e: Exception) -> str:
-    """Return a user-safe error message that doesn't expose internal details."""
-    msg = str(e)
-    if "api_key" in msg.lower() or "ANTHROPIC_API_KEY" in msg:
-        return "API key not configured. Contact the administrator."
-    if "rate_limit" in msg.lower() or "429" in msg:
-        return "The AI service is busy. Please try again in a few seconds."
-    if "overloaded" in msg.lower() or "529" in msg:
-        return "The AI service is temporarily overloaded. Please try again shortly."
-    return "Something went wrong while processing your request. Please try again."
+def _app_run(kind: str) -> RunRecord:
+    """A request-log record for a stage the page streams itself (jobs and API requests log their own)."""
+    return RunRecord("app", kind, st.session_state.target_llm)
+
+
+def _failed_outcome(e: Exception) -> str:
+    return "timeout" if isinstance(e, DeadlineExceeded) else "quota" if isinstance(e, QuotaExceeded) else "error"
+
+
+def _budget_caption():
+    remaining = st.session_state.token_ledger.remaining(_MAX_TOKENS_PER_SESSION)
+    today = remaining_tokens(_user_id())
+    daily = f" · {today:,} left today" if today is not None else ""
+    st.caption(f"Token budget: {remaining:,} of {_MAX_TOKENS_PER_SESSION:,} left this session{daily}")
 
 
 def _init_state():
     for key, val in _DEFAULTS.items():
         if key not in st.session_state:
             st.session_state[key] = val
+    if "token_ledger" not in st.session_state:
+        st.session_state.token_ledger = TokenLedger()
+    if "speculation_tokens" not in st.session_state:
+        st.session_state.speculation_tokens = 0
+
+
+# Budget state survives "start over" so the session caps hold.
+_PERSISTENT_KEYS = ("token_ledger", "speculation_tokens", "cancelled_jobs")
 
 
 def _reset():
+    _drop_example_jobs()
+    kept = {k: st.session_state[k] for k in _PERSISTENT_KEYS if k in st.session_state}
     for key in list(st.session_state.keys()):
         del st.session_state[key]
+    for key, val in kept.items():
+        st.session_state[key] = val
     _init_state()
 
 
-_init_state()
+@st.cache_resource
+def _start_warmup() -> dict:
+    """
+    Once per process: warm the API client, templates and connections on a
+    background thread, while the first user is still typing.
+    """
+    status = {"done": threading.Event(), "result": None}
+
+    def run():
+        if gallery_enabled():
+            load_gallery()
+        status["result"] = warmup()
+        status["done"].set()
+
+    threading.Thread(target=run, name="warmup", daemon=True).start()
+    return status
+
+
+with profiling.section("init_state"):
+    _start_warmup()
+    _init_state()
 
 
 def _hero(title: str, subtitle: str, badge: str = "", show_share: bool = False):
@@ -328,130 +722,39 @@ def _llm_badge():
 
 
 # ---------------------------------------------------------------------------
-# Dropdown injection — JavaScript via component iframe
+# LLM selector — custom component (components/llm_selector/index.html)
 # ---------------------------------------------------------------------------
 
-_LLM_DROPDOWN_JS = """
-<style>html,body{margin:0;padding:0;height:0;overflow:hidden}</style>
-<script>
-(function() {
-    var LOGOS = {
-        'Claude':     'https://cdn.simpleicons.org/anthropic/CC785C',
-        'ChatGPT':    'https://cdn.simpleicons.org/chatgpt/74AA9C',
-        'Gemini':     'https://upload.wikimedia.org/wikipedia/commons/8/8a/Google_Gemini_logo.svg',
-        'Perplexity': 'https://cdn.simpleicons.org/perplexity/5436DA'
-    };
-    var buildTimer = null;
-
-    function buildDropdown() {
-        try {
-            var doc = window.parent.document;
-            var stRadio = doc.querySelector('[data-testid="stRadio"]');
-            if (!stRadio) return;
-            var radioGroup = stRadio.querySelector('[role="radiogroup"]');
-            if (!radioGroup) return;
-
-            // Already built and current?
-            var next = radioGroup.nextElementSibling;
-            if (next && next.classList.contains('llm-dd-container')) return;
-
-            // Remove stale dropdowns
-            doc.querySelectorAll('.llm-dd-container').forEach(function(d) { d.remove(); });
-
-            // Gather options from radio inputs
-            var items = [];
-            radioGroup.querySelectorAll('input[type="radio"]').forEach(function(inp) {
-                var label = inp.closest('label');
-                var text = label ? label.textContent.trim() : '';
-                items.push({ input: inp, text: text, checked: inp.checked });
-            });
-            if (!items.length) return;
-
-            var sel = items.find(function(i) { return i.checked; }) || items[0];
-
-            // Build container
-            var dd = doc.createElement('div');
-            dd.className = 'llm-dd-container';
-
-            // Trigger
-            var trigger = doc.createElement('div');
-            trigger.className = 'llm-dd-trigger';
-            trigger.innerHTML =
-                '<img class="llm-dd-logo" src="' + (LOGOS[sel.text]||'') + '" alt=""/>' +
-                '<span class="llm-dd-name">' + sel.text + '</span>' +
-                '<span class="llm-dd-arrow">&#9660;</span>';
-
-            // Options list
-            var optsList = doc.createElement('div');
-            optsList.className = 'llm-dd-options';
-
-            items.forEach(function(item) {
-                var opt = doc.createElement('div');
-                opt.className = 'llm-dd-option' + (item.checked ? ' active' : '');
-                opt.innerHTML =
-                    '<img src="' + (LOGOS[item.text]||'') + '" alt="' + item.text + '"/>' +
-                    '<span>' + item.text + '</span>' +
-                    (item.checked ? '<span class="llm-dd-check">&#10003;</span>' : '');
-
-                opt.addEventListener('click', function(e) {
-                    e.stopPropagation();
-                    item.input.click();
-                    item.input.dispatchEvent(new Event('change', { bubbles: true }));
-                    dd.querySelector('.llm-dd-logo').src = LOGOS[item.text] || '';
-                    dd.querySelector('.llm-dd-name').textContent = item.text;
-                    optsList.querySelectorAll('.llm-dd-option').forEach(function(o) {
-                        o.classList.remove('active');
-                        var chk = o.querySelector('.llm-dd-check');
-                        if (chk) chk.remove();
-                    });
-                    opt.classList.add('active');
-                    var chk = doc.createElement('span');
-                    chk.className = 'llm-dd-check'; chk.innerHTML = '&#10003;';
-                    opt.appendChild(chk);
-                    dd.classList.remove('open');
-                });
-                optsList.appendChild(opt);
-            });
-
-            dd.appendChild(trigger);
-            dd.appendChild(optsList);
-
-            trigger.addEventListener('click', function(e) {
-                e.stopPropagation();
-                dd.classList.toggle('open');
-            });
-
-            // Close on outside click — add listener only once per document
-            if (!doc._llmDdListener) {
-                doc._llmDdListener = true;
-                doc.addEventListener('click', function() {
-                    var d = doc.querySelector('.llm-dd-container');
-                    if (d) d.classList.remove('open');
-                });
-            }
-
-            radioGroup.parentNode.insertBefore(dd, radioGroup.nextSibling);
-        } catch(e) {}
-    }
-
-    function schedule() {
-        clearTimeout(buildTimer);
-        buildTimer = setTimeout(buildDropdown, 80);
-    }
-
-    schedule();
-    new MutationObserver(schedule).observe(
-        window.parent.document.body,
-        { childList: true, subtree: true }
-    );
-})();
-</script>
-"""
-
-
-def _inject_llm_dropdown():
-    """Transform the hidden st.radio into a custom logo+name dropdown via JS."""
-    components.html(_LLM_DROPDOWN_JS, height=0, scrolling=False)
+_LLM_DROPDOWN_LOGOS = {
+    "Claude":     _llm_logo_url("Claude"),
+    "ChatGPT":    _llm_logo_url("ChatGPT"),
+    "Gemini":     "https://upload.wikimedia.org/wikipedia/commons/8/8a/Google_Gemini_logo.svg",
+    "Perplexity": _llm_logo_url("Perplexity"),
+}
+
+# A static page served by Streamlit (and cached by the browser); the keyed
+# iframe persists across reruns and only sends a value when the user picks one.
+_llm_selector = components.declare_component(
+    "llm_selector", path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "components", "llm_selector"),
+)
+
+
+def _select_llm():
+    """on_change callback — the selector's value becomes the target LLM."""
+    if st.session_state.llm_selector in LLM_PROFILES:
+        st.session_state.target_llm = st.session_state.llm_selector
+
+
+def _render_llm_selector():
+    """Logo + name dropdown for the target LLM."""
+    with profiling.section("llm_dropdown"):
+        _llm_selector(
+            options=[{"name": llm, "logo": _LLM_DROPDOWN_LOGOS[llm]} for llm in LLM_PROFILES],
+            value=st.session_state.target_llm,
+            default=st.session_state.target_llm,
+            key="llm_selector",
+            on_change=_select_llm,
+        )
 
 
 # ---------------------------------------------------------------------------
@@ -469,6 +772,104 @@ _COMPONENT_ICONS = {
 }
 
 
+def _live_matches(raw_prompt: str, target_llm: str, entry: dict) -> bool:
+    return entry.get("raw_prompt") == raw_prompt and entry.get("target_llm") == target_llm
+
+
+def _supersede_live_job():
+    """Cancel the live analysis job; its usage is merged once the worker stops."""
+    job_id = st.session_state.live_job_id
+    st.session_state.live_job_id = ""
+    if job_id:
+        _cancel_background_job(job_id)
+
+
+def _settle_live_jobs():
+    """Merge the usage of finished live jobs; keep a finished analysis as the live result."""
+    _settle_cancelled_jobs()
+    job = get_job(st.session_state.live_job_id) if st.session_state.live_job_id else None
+    if job and job["finished"]:
+        st.session_state.live_job_id = ""
+        st.session_state.token_ledger.merge(job["usage"] or [])
+        if job["status"] == "done":
+            st.session_state.live_result = {**job["payload"], "components": job["result"]["components"]}
+    return job if job and not job["finished"] else None
+
+
+@st.fragment(run_every=_LIVE_POLL_SECONDS)
+def _live_analysis(raw_prompt: str, target_llm: str):
+    """
+    Live mode panel under the text area: the local component check for the
+    current text, and the background analysis of the text once it settles.
+    """
+    if (raw_prompt, target_llm) != tuple(st.session_state.live_key):
+        st.session_state.live_key = (raw_prompt, target_llm)
+        st.session_state.live_changed_at = time.time()
+    running = _settle_live_jobs()
+    if len(raw_prompt) < _LIVE_MIN_CHARS:
+        return
+
+    result = st.session_state.live_result
+    ready = _live_matches(raw_prompt, target_llm, result)
+    components = result["components"] if ready else detect_components(raw_prompt, target_llm)
+    labels = LLM_PROFILES[target_llm]["component_labels"]
+    found = " · ".join(
+        f"{_COMPONENT_ICONS.get(k, '•')} {labels.get(k, k.replace('_', ' ').title())}"
+        for k, v in components.items() if v
+    ) or "nothing yet"
+    status = "analysis ready" if ready else "analyzing…" if running else "quick check"
+    st.caption(f"**Found** ({status}): {found}")
+
+    current = running and _live_matches(raw_prompt, target_llm, running["payload"])
+    if running and not current:
+        _supersede_live_job()   # the text it analyses is gone
+    settled = time.time() - st.session_state.live_changed_at >= _LIVE_DEBOUNCE_SECONDS
+    if ready or current or not settled:
+        return
+    if _check_rate_limit(estimate_stage_tokens("analysis", raw_prompt, target_llm)):
+        return
+    _record_request()
+    st.session_state.live_job_id = submit_job(
+        "analysis", {"raw_prompt": raw_prompt, "target_llm": target_llm, "user": _user_id()},
+    )
+    metrics.increment("live_analysis.started")
+
+
+def _live_covers(raw_prompt: str, target_llm: str) -> bool:
+    """True if the live analysis of this text has finished or is running (submitting it costs no new call)."""
+    if not _LIVE_ANALYSIS:
+        return False
+    job = get_job(st.session_state.live_job_id) if st.session_state.live_job_id else None
+    return _live_matches(raw_prompt, target_llm, st.session_state.live_result) or bool(
+        job and not job["finished"] and _live_matches(raw_prompt, target_llm, job["payload"])
+    )
+
+
+def _take_live_analysis() -> dict:
+    """
+    Components for the prompt being submitted from the live analysis: returned
+    at once if it has finished, or its job adopted as the session's job if it
+    is still running (the router shows its progress). {} otherwise.
+    """
+    if not _LIVE_ANALYSIS:
+        return {}
+    raw_prompt, target_llm = st.session_state.raw_prompt, st.session_state.target_llm
+    running = _settle_live_jobs()
+    result = st.session_state.live_result
+    if _live_matches(raw_prompt, target_llm, result):
+        metrics.increment("live_analysis.hit")
+        return result["components"]
+    if running and _live_matches(raw_prompt, target_llm, running["payload"]):
+        metrics.increment("live_analysis.adopted")
+        st.session_state.live_job_id = ""
+        st.session_state.job_id = running["id"]
+        st.query_params["job"] = running["id"]
+        return {}
+    metrics.increment("live_analysis.miss")
+    _supersede_live_job()
+    return {}
+
+
 def render_input():
     _hero(
         "✦ Prompt Enhancement Tool",
@@ -492,18 +893,7 @@ def render_input():
     )
 
     st.markdown("**Select your target LLM**")
-    llm_keys = list(LLM_PROFILES.keys())
-    selected_llm = st.radio(
-        "Target LLM",
-        options=llm_keys,
-        index=llm_keys.index(st.session_state.target_llm),
-        horizontal=True,
-        label_visibility="collapsed",
-        key="llm_radio",
-    )
-    if selected_llm:
-        st.session_state.target_llm = selected_llm
-    _inject_llm_dropdown()
+    _render_llm_selector()
     st.caption(f"**Style:** {LLM_PROFILES[st.session_state.target_llm]['style_hint']}")
 
     st.divider()
@@ -519,19 +909,57 @@ def render_input():
         max_chars=_MAX_PROMPT_CHARS,
     )
     if raw_prompt:
-        st.caption(f"{len(raw_prompt):,} / {_MAX_PROMPT_CHARS:,} characters")
+        note = " · long document: analysed in parts, then condensed" if is_long_prompt(raw_prompt) else ""
+        st.caption(f"{len(raw_prompt):,} / {_MAX_PROMPT_CHARS:,} characters{note}")
+    _budget_caption()
+    if _LIVE_ANALYSIS:
+        _live_analysis(raw_prompt.strip(), st.session_state.target_llm)
+
+    gallery_entry = lookup_gallery(raw_prompt.strip(), st.session_state.target_llm)
+    if gallery_entry:
+        col_text, col_btn = st.columns([4, 1])
+        with col_text:
+            st.success("⚡ A ready-made enhancement exists for this prompt — no AI call needed.")
+        with col_btn:
+            st.button(
+                "Use it instantly",
+                key="use_gallery",
+                on_click=_use_gallery,
+                args=(gallery_entry,),
+                use_container_width=True,
+            )
+
+    if history_enabled():
+        similar = _history_lookup(similar_prompts, raw_prompt, st.session_state.target_llm) if raw_prompt.strip() else []
+        if similar:
+            with st.expander(f"✦ {len(similar)} similar past prompt(s) — reuse one and skip the AI", expanded=True):
+                for entry in similar:
+                    _history_entry(entry, key=f"similar_{entry['id']}")
+        with st.expander("Search past enhancements"):
+            query = st.text_input("Search", placeholder="e.g. cold email", label_visibility="collapsed")
+            if query.strip():
+                results = _history_lookup(search_history, query)
+                if not results:
+                    st.caption("No matches.")
+                for entry in results:
+                    _history_entry(entry, key=f"search_{entry['id']}")
 
     if st.button("Analyze & Enhance →", type="primary", use_container_width=True):
         if not raw_prompt.strip():
             st.error("Please enter a prompt before continuing.")
         else:
-            err = _check_rate_limit()
+            # A live analysis already charged for this text; submitting it adds no call.
+            err = None if _live_covers(raw_prompt.strip(), st.session_state.target_llm) else _check_rate_limit(
+                estimate_stage_tokens("analysis", raw_prompt.strip(), st.session_state.target_llm)
+            )
             if err:
                 st.error(err)
             else:
                 st.session_state.raw_prompt = raw_prompt.strip()
                 st.session_state.stage = "analysis"
-                st.session_state.components = {}
+                # A gallery prompt already has its analysis and questions.
+                st.session_state.components = gallery_entry["components"] if gallery_entry else _take_live_analysis()
+                st.session_state.gallery_questions = gallery_entry["questions"] if gallery_entry else []
                 st.rerun()
 
 
@@ -551,23 +979,37 @@ def render_analysis():
     if st.button("← Back", key="back_analysis"):
         st.session_state.stage = "input"
         st.session_state.components = {}
+        st.session_state.job_error = ""
         st.rerun()
 
     _llm_badge()
 
-    # Run analysis once and cache in session state
+    # Run analysis once (as a background job) and cache in session state
     if not st.session_state.components:
-        with st.spinner("Analyzing your prompt..."):
-            try:
-                _record_request()
-                components = analyze_prompt_components(
-                    st.session_state.raw_prompt,
-                    st.session_state.target_llm,
+        if st.session_state.job_error:
+            st.error(st.session_state.job_error)
+            col_retry, col_instant = st.columns(2)
+            with col_retry:
+                if st.button("↻ Try again", use_container_width=True):
+                    st.session_state.job_error = ""
+                    st.rerun()
+            with col_instant:
+                st.button(
+                    "⚡ Apply the structure instantly (no AI)",
+                    use_container_width=True,
+                    on_click=_instant_fallback,
                 )
-                st.session_state.components = components
-            except Exception as e:
-                st.error(_safe_api_error(e))
-                st.stop()
+            st.stop()
+        _submit_job(
+            "analysis",
+            raw_prompt=st.session_state.raw_prompt,
+            target_llm=st.session_state.target_llm,
+        )
+        st.rerun()
+
+    if st.session_state.job_error:
+        st.error(st.session_state.job_error)
+        st.session_state.job_error = ""
 
     components = st.session_state.components
     profile = LLM_PROFILES[st.session_state.target_llm]
@@ -615,24 +1057,11 @@ def render_analysis():
             use_container_width=True,
             help="Apply the LLM-specific format to what we already have.",
         ):
-            err = _check_rate_limit()
+            err = _check_rate_limit(_enhance_estimate())
             if err:
                 st.error(err)
             else:
-                with st.spinner("Building your enhanced prompt..."):
-                    try:
-                        _record_request()
-                        enhanced = build_enhanced_prompt(
-                            st.session_state.raw_prompt,
-                            st.session_state.target_llm,
-                            st.session_state.components,
-                            st.session_state.answers,
-                        )
-                        st.session_state.enhanced_prompt = enhanced
-                    except Exception as e:
-                        st.error(_safe_api_error(e))
-                        st.stop()
-                st.session_state.stage = "result"
+                _submit_enhance()
                 st.rerun()
 
     with col_b:
@@ -642,28 +1071,32 @@ def render_analysis():
             use_container_width=True,
             help="We'll ask targeted questions — including about your desired output format.",
         ):
-            err = _check_rate_limit()
+            if st.session_state.gallery_questions:
+                _start_questions(st.session_state.gallery_questions)
+                st.rerun()
+            lazy = _QUESTIONS_MODE == "lazy"
+            err = _check_rate_limit(_stage_estimate("questions_lazy" if lazy else "questions"))
             if err:
                 st.error(err)
             else:
-                with st.spinner("Identifying what we need from you..."):
-                    try:
-                        _record_request()
-                        questions = generate_clarifying_questions(
-                            st.session_state.raw_prompt,
-                            st.session_state.target_llm,
-                            st.session_state.components,
-                        )
-                    except Exception as e:
-                        st.error(_safe_api_error(e))
-                        st.stop()
-                st.session_state.questions = questions
-                st.session_state.current_q = 0
-                st.session_state.answers = {}
-                st.session_state.draft = ""
-                st.session_state.stage = "questions"
+                _submit_job(
+                    "questions",
+                    raw_prompt=st.session_state.raw_prompt,
+                    target_llm=st.session_state.target_llm,
+                    components=st.session_state.components,
+                    lazy_examples=lazy,
+                )
                 st.rerun()
 
+    if st.button(
+        "⚡ Instant mode (no AI)",
+        use_container_width=True,
+        help="Apply the LLM-specific structure locally right away — no API call, no token cost.",
+    ):
+        _run_instant()
+        st.session_state.stage = "result"
+        st.rerun()
+
     if st.button("← Start over", use_container_width=True):
         _reset()
         st.rerun()
@@ -674,6 +1107,82 @@ def render_analysis():
 # ---------------------------------------------------------------------------
 
 
+def _example_estimate(q: dict) -> int:
+    return estimate_stage_tokens(
+        "example", st.session_state.raw_prompt, st.session_state.target_llm, question=q,
+    )
+
+
+def _prefetch_example(idx: int):
+    """Start generating question idx's inferred example in the background (lazy mode)."""
+    questions = st.session_state.questions
+    if idx >= len(questions) or idx in st.session_state.example_jobs:
+        return
+    q = questions[idx]
+    if q.get("inferred_example") or _check_rate_limit(_example_estimate(q)):
+        return
+    st.session_state.example_jobs[idx] = submit_job("example", {
+        "raw_prompt": st.session_state.raw_prompt,
+        "target_llm": st.session_state.target_llm,
+        "question": {"component": q["component"], "question": q["question"]},
+        "user": _user_id(),
+    })
+
+
+def _drop_example_jobs():
+    """Cancel prefetched examples that were never shown; tokens they spent still count."""
+    for job_id in st.session_state.example_jobs.values():
+        _cancel_background_job(job_id)
+    st.session_state.example_jobs = {}
+
+
+def _ensure_example(idx: int) -> bool:
+    """
+    Fill question idx's inferred example (lazy mode): take a finished prefetch,
+    wait on one still running, or stream a fresh one into the page.
+    Returns False while a prefetch is still running.
+    """
+    q = st.session_state.questions[idx]
+    if q.get("inferred_example") or q.get("example_failed"):
+        return True
+
+    job_id = st.session_state.example_jobs.get(idx)
+    job = get_job(job_id) if job_id else None
+    if job and not job["finished"]:
+        _job_progress(job_id)
+        return False
+    if job:
+        # Finished: its tokens count whether or not it produced an example.
+        del st.session_state.example_jobs[idx]
+        st.session_state.token_ledger.merge(job["usage"] or [])
+        if job["status"] == "done":
+            q["inferred_example"] = job["result"]["inferred_example"]
+            return True
+
+    if _check_rate_limit(_example_estimate(q)):
+        q["example_failed"] = True
+        return True
+    st.markdown("💡 **Based on your prompt, we suggest:**")
+    run = _app_run("example")
+    deadline = Deadline.for_stage("example")
+    try:
+        with usage_listener(run.ledger.record), run.capturing(), charged_to(_user_id()):
+            text = st.write_stream(stream_inferred_example(
+                st.session_state.raw_prompt, st.session_state.target_llm, q, deadline,
+            ))
+        q["inferred_example"] = text.strip()
+        if deadline.expired():
+            run.outcome = "partial"
+    except Exception as e:
+        q["example_failed"] = True
+        run.outcome = _failed_outcome(e)
+    finally:
+        st.session_state.token_ledger.merge(run.ledger.entries)
+        run.finish()
+    # Re-render as the copyable block with the accept button.
+    st.rerun()
+
+
 def render_questions():
     questions = st.session_state.questions
     idx = st.session_state.current_q
@@ -681,20 +1190,13 @@ def render_questions():
 
     # All questions answered — build the enhanced prompt
     if idx >= total:
-        with st.spinner("Building your enhanced prompt..."):
-            try:
-                _record_request()
-                enhanced = build_enhanced_prompt(
-                    st.session_state.raw_prompt,
-                    st.session_state.target_llm,
-                    st.session_state.components,
-                    st.session_state.answers,
-                )
-                st.session_state.enhanced_prompt = enhanced
-            except Exception as e:
-                st.error(_safe_api_error(e))
+        _drop_example_jobs()
+        if not _use_speculation():
+            err = _check_rate_limit(_enhance_estimate())
+            if err:
+                st.error(err)
                 st.stop()
-        st.session_state.stage = "result"
+            _submit_enhance()
         st.rerun()
         return
 
@@ -711,6 +1213,8 @@ def render_questions():
     )
 
     if st.button("← Back", key="back_questions"):
+        _drop_speculation()
+        _drop_example_jobs()
         st.session_state.stage = "analysis"
         st.session_state.questions = []
         st.session_state.answers = {}
@@ -727,6 +1231,10 @@ def render_questions():
     st.caption(f"Improving: {icon} **{component_label}**")
     st.subheader(q["question"])
 
+    if _QUESTIONS_MODE == "lazy":
+        _prefetch_example(idx + 1)
+        _ensure_example(idx)
+
     if q.get("inferred_example"):
         st.markdown("💡 **Based on your prompt, we suggest** *(click the copy icon to copy, or accept below):*")
         st.code(q["inferred_example"], language="text", wrap_lines=True)
@@ -776,6 +1284,59 @@ def render_questions():
 # ---------------------------------------------------------------------------
 
 
+def _refine_result(instruction: str):
+    """Stream a revision of the result by a follow-up instruction and make it the result."""
+    conversation = st.session_state.refine_conversation
+    if not conversation or conversation[-1]["content"] != st.session_state.enhanced_prompt:
+        # A new result (rebuild, reuse, gallery) starts a new conversation.
+        conversation = refine_conversation(
+            st.session_state.raw_prompt,
+            st.session_state.target_llm,
+            st.session_state.components,
+            st.session_state.answers,
+            st.session_state.enhanced_prompt,
+        )
+    err = _check_rate_limit(estimate_refine_tokens(st.session_state.target_llm, conversation, instruction))
+    if err:
+        st.error(err)
+        return
+    _record_request()
+    run = _app_run("refine")
+    deadline = Deadline.for_stage("refine")
+    try:
+        with usage_listener(run.ledger.record), run.capturing(), charged_to(_user_id()):
+            revised = st.write_stream(stream_refined_prompt(
+                st.session_state.target_llm, conversation, instruction, deadline=deadline,
+            ))
+            # The stream stops quietly when the budget runs out; a cut-off
+            # revision must not replace the full prompt.
+            if deadline.expired():
+                run.outcome = "partial"
+                st.warning("The revision took too long and was cut off — your previous prompt is unchanged.")
+                return
+            revised, lint = repair_prompt(
+                revised.strip(),
+                st.session_state.target_llm,
+                st.session_state.components,
+                st.session_state.answers,
+                deadline=Deadline.for_stage("lint_fix"),
+            )
+    except Exception as e:
+        run.outcome = _failed_outcome(e)
+        st.error(safe_error_message(e))
+        return
+    finally:
+        st.session_state.token_ledger.merge(run.ledger.entries)
+        run.finish()
+    if not revised.strip():
+        return
+    st.session_state.refine_conversation = add_refinement(conversation, instruction, revised)
+    st.session_state.enhanced_prompt = revised
+    st.session_state.lint_report = lint
+    st.session_state.degraded_notice = ""
+    st.rerun()
+
+
 def render_result():
     _hero(
         "Your Enhanced Prompt",
@@ -791,8 +1352,30 @@ def render_result():
 
     _llm_badge()
 
+    if st.session_state.degraded_notice:
+        st.warning(
+            f"{st.session_state.degraded_notice} "
+            "This prompt was formatted locally from your inputs, without AI rewriting."
+        )
+
     enhanced = st.session_state.enhanced_prompt
     st.code(enhanced, language="text", wrap_lines=True)
+    repaired = st.session_state.lint_report.get("repaired", [])
+    if repaired:
+        st.caption(f"Auto-fixed for {st.session_state.target_llm}'s rules: {', '.join(r.replace('_', ' ') for r in repaired)}.")
+
+    with st.form("refine_form", clear_on_submit=True, border=False):
+        instruction = st.text_input(
+            "Refine this prompt",
+            placeholder='e.g. "make it shorter", "add two examples", "more formal tone"',
+            max_chars=_MAX_ANSWER_CHARS,
+        )
+        refine = st.form_submit_button("Refine →", use_container_width=True)
+    if refine:
+        if instruction.strip():
+            _refine_result(instruction.strip())
+        else:
+            st.error("Please describe how to refine the prompt.")
 
     st.divider()
 
@@ -814,6 +1397,29 @@ def render_result():
                     label = labels.get(comp, comp.replace("_", " ").title())
                     st.markdown(f"**{label}:** {ans}")
 
+    if st.session_state.questions:
+        with st.expander("Edit your answers"):
+            edited = {}
+            for i, q in enumerate(st.session_state.questions):
+                edited[q["component"]] = st.text_area(
+                    q["question"],
+                    value=st.session_state.answers.get(q["component"], ""),
+                    height=100,
+                    key=f"edit_{i}",
+                    max_chars=_MAX_ANSWER_CHARS,
+                )
+            if st.button("Rebuild with edited answers", use_container_width=True):
+                answers = {c: a.strip() for c, a in edited.items() if a.strip()}
+                if answers != st.session_state.answers:
+                    # Checked first, so a refused rebuild leaves the shown result's answers intact.
+                    err = _check_rate_limit(_enhance_estimate(answers))
+                    if err:
+                        st.error(err)
+                        st.stop()
+                    st.session_state.answers = answers
+                    _submit_enhance()
+                    st.rerun()
+
     st.button(
         "← Start over with a new prompt",
         type="primary",
@@ -822,20 +1428,86 @@ def render_result():
     )
 
 
+# ---------------------------------------------------------------------------
+# Waiting on a background job
+# ---------------------------------------------------------------------------
+
+
+@st.fragment(run_every=_JOB_POLL_SECONDS)
+def _job_progress(job_id: str):
+    """Re-runs on its own every poll interval; triggers a full rerun once the job is done."""
+    job = get_job(job_id)
+    if job is None or job["finished"]:
+        st.rerun(scope="app")
+    elapsed = time.time() - job["created_at"]
+    st.info(f"⏳ {_JOB_MESSAGES[job['kind']]} ({elapsed:.0f}s)")
+
+
+def render_pending(job: dict):
+    _hero(
+        "Working on it",
+        "This runs in the background — you can safely refresh this page and the result will be waiting.",
+        badge="In progress",
+    )
+    _llm_badge()
+    _job_progress(job["id"])
+    if st.button("Cancel", key="cancel_job"):
+        _cancel_background_job(job["id"])
+        _forget_job()
+        # Step back to a page that won't immediately resubmit the same job.
+        if job["kind"] == "analysis":
+            st.session_state.stage = "input"
+        elif job["kind"] == "questions" or st.session_state.stage == "questions":
+            st.session_state.stage = "analysis"
+        st.rerun()
+
+
 # ---------------------------------------------------------------------------
 # Router
 # ---------------------------------------------------------------------------
 
-stage = st.session_state.stage
+def _render_profile_panel():
+    runs = profiling.recent_runs(_PROFILE_PANEL_RUNS)
+    with st.expander(f"⏱ Profiling — last {len(runs)} reruns"):
+        st.caption("Per-section timings (ms). Collapsed stacks for flamegraphs are in `.tmp/profiles/`.")
+        st.dataframe(
+            [
+                {
+                    "page": r["label"],
+                    "total": r["total_ms"],
+                    **r["sections"],
+                    "state changed": ", ".join(r.get("state_changed", [])),
+                }
+                for r in runs
+            ],
+            use_container_width=True,
+        )
+
 
-if stage == "input":
-    render_input()
-elif stage == "analysis":
-    render_analysis()
-elif stage == "questions":
-    render_questions()
-elif stage == "result":
-    render_result()
+_profile_label = st.session_state.stage
+try:
+    with profiling.section("collect_job"):
+        _settle_cancelled_jobs()
+        pending_job = _collect_job()
+    stage = st.session_state.stage
+    if pending_job:
+        _profile_label = "pending"
+    with profiling.section(f"page.{_profile_label}"):
+        if pending_job:
+            render_pending(pending_job)
+        elif stage == "input":
+            render_input()
+        elif stage == "analysis":
+            render_analysis()
+        elif stage == "questions":
+            render_questions()
+        elif stage == "result":
+            render_result()
+    if profiling.enabled():
+        _render_profile_panel()
+finally:
+    # Also runs when a page calls st.rerun() / st.stop().
+    profiling.finish_run(_profile_run, label=_profile_label, state=st.session_state)
 
 # ---------------------------------------------------------------------------
 # Footer — shown on every page
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from tools import enhance_prompt, metrics
+
+
+class _Delta:
+    def __init__(self, text):
+        self.type = "content_block_delta"
+        self.delta = type("D", (), {"text": text})()
+
+
+class _Usage:
+    input_tokens, output_tokens = 10, 3
+
+
+class _Stream:
+    def __init__(self, delay, texts):
+        self.delay, self.texts, self.closed = delay, texts, threading.Event()
+        self.current_message_snapshot = type("M", (), {"usage": _Usage()})()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __iter__(self):
+        if self.closed.wait(self.delay):
+            return
+        for text in self.texts:
+            yield _Delta(text)
+
+    def get_final_message(self):
+        return type("M", (), {"usage": _Usage(), "content": []})()
+
+    def close(self):
+        self.closed.set()
+
+
+class _Client:
+    """Answers the first request after 2 s and every later one at once."""
+
+    def __init__(self):
+        self.streams = []
+        self.messages = self
+
+    def stream(self, **kwargs):
+        stream = _Stream(2.0 if not self.streams else 0.0, [f"reply {len(self.streams)}", "."])
+        self.streams.append(stream)
+        return stream
+
+
+@pytest.fixture
+def hedged(monkeypatch):
+    monkeypatch.setattr(enhance_prompt, "_hedge_delay_ms", lambda stage: 50.0)
+    monkeypatch.setattr(enhance_prompt, "_hedge_allowed", lambda: True)
+
+
+def test_a_slow_stream_is_hedged_and_the_first_to_produce_text_wins(hedged):
+    client = _Client()
+    wins = metrics.counter("upstream.hedge_wins", stage="test")
+    started = time.perf_counter()
+    winner = enhance_prompt._hedged_stream_start(client, "system", "user", 50, "test", None, None)
+    assert "".join(iter(winner.chunks.get, None)) == "reply 1."
+    assert time.perf_counter() - started < 1.0
+    assert len(client.streams) == 2
+    assert client.streams[0].closed.is_set()
+    assert metrics.counter("upstream.hedge_wins", stage="test") == wins + 1
@@ -0,0 +1,89 @@
+import json
+import time
+
+import pytest
+
+from tools import job_queue
+
+
+@pytest.fixture
+def queue(monkeypatch, tmp_path):
+    monkeypatch.setenv("JOB_QUEUE_DB", str(tmp_path / "jobs.db"))
+    monkeypatch.setenv("REQUEST_LOG_DIR", "off")
+    monkeypatch.setattr(job_queue, "_pool", None)
+    return job_queue
+
+
+def _wait(queue, job_id, timeout=5.0):
+    stop = time.time() + timeout
+    while time.time() < stop:
+        job = queue.get_job(job_id)
+        if job["finished"] and (job["status"] != "cancelled" or job["usage"] is not None):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_runs_to_done(queue, monkeypatch):
+    monkeypatch.setitem(queue._HANDLERS, "analysis", lambda raw_prompt, target_llm, deadline: {"components": {}})
+    job = _wait(queue, queue.submit_job("analysis", {"raw_prompt": "x", "target_llm": "Claude"}))
+    assert job["status"] == "done"
+    assert job["result"] == {"components": {}}
+
+
+def test_deadline_starts_when_claimed(queue, monkeypatch):
+    seen = []
+
+    def handler(raw_prompt, target_llm, deadline):
+        seen.append(deadline.remaining())
+        return {"components": {}}
+
+    monkeypatch.setitem(queue._HANDLERS, "analysis", handler)
+    job_id = queue.submit_job("analysis", {"raw_prompt": "x", "target_llm": "Claude"})
+    assert "deadline_at" not in queue.get_job(job_id)["payload"]
+    _wait(queue, job_id)
+    assert seen and seen[0] > 0
+
+
+def test_cancel_stops_a_running_job(queue, monkeypatch):
+    def slow(raw_prompt, target_llm, deadline):
+        for _ in range(200):
+            deadline.check("analysis")
+            time.sleep(0.01)
+        return {"components": {}}
+
+    monkeypatch.setitem(queue._HANDLERS, "analysis", slow)
+    job_id = queue.submit_job("analysis", {"raw_prompt": "x", "target_llm": "Claude"})
+    while queue.get_job(job_id)["status"] == "queued":
+        time.sleep(0.01)
+    assert queue.cancel_job(job_id)
+    job = _wait(queue, job_id)
+    assert job["status"] == "cancelled"
+    assert job["result"] is None
+    assert job["usage"] == []
+    assert not queue.cancel_job(job_id)
+
+
+def test_orphans_are_requeued_with_a_fresh_deadline(queue, monkeypatch):
+    seen = []
+
+    def handler(raw_prompt, target_llm, deadline):
+        seen.append(deadline.remaining())
+        return {"components": {}}
+
+    monkeypatch.setitem(queue._HANDLERS, "analysis", handler)
+    queue._start()   # creates the schema
+    payload = {"raw_prompt": "x", "target_llm": "Claude", "deadline_at": time.time() - 3600}
+    conn = queue._connect()
+    with conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, payload, owner_pid, created_at) VALUES (?, ?, 'running', ?, ?, ?)",
+            ("orphan", "analysis", json.dumps(payload), 2**22 + 12345, time.time() - 3600),
+        )
+    conn.close()
+
+    monkeypatch.setattr(queue, "_pool", None)   # a restart
+    queue._start()
+    job = _wait(queue, "orphan")
+    assert job["status"] == "done"
+    assert seen and seen[0] > 0
@@ -0,0 +1,71 @@
+import pytest
+
+from tools.lint_prompt import _TIME_SCOPE, lint_prompt, repair_prompt
+
+_CLAUDE_TRAILER = "Think through this carefully before responding."
+
+
+def _claude(task: str) -> str:
+    return f"<task>\n{task}\n</task>\n\n{_CLAUDE_TRAILER}"
+
+
+def test_clean_prompt_passes():
+    assert lint_prompt(_claude("Summarize the report in five bullets."), "Claude") == []
+
+
+def test_avoided_word_is_removed_where_safe():
+    text, report = repair_prompt(_claude("Read the report carefully and list the risks."), "Claude", allow_requests=False)
+    assert "Read the report and list the risks." in text
+    assert text.endswith(_CLAUDE_TRAILER)
+    assert report["repaired"] == ["avoid"]
+
+
+def test_avoided_word_after_a_modifier_is_left_unresolved():
+    original = _claude("Analyze the data very carefully and really identify trends.")
+    text, report = repair_prompt(original, "Claude", allow_requests=False)
+    assert text == original
+    assert report["unresolved"] == ["avoid"]
+
+
+def test_avoided_phrase_at_sentence_start():
+    text, _ = repair_prompt(
+        "## Task\nPlease summarize the article.\n\nBased on the information above, summarize the article.",
+        "Gemini", allow_requests=False,
+    )
+    assert "Summarize the article." in text
+    assert "lease" not in text
+
+
+@pytest.mark.parametrize("task, repaired", [
+    ("Summarize it, please.", "Summarize it."),
+    ("Please summarize the report. Could you list risks?", "Summarize the report. List risks?"),
+])
+def test_avoided_phrase_removal_keeps_punctuation_and_capitals(task, repaired):
+    text, report = repair_prompt(
+        f"## Task\n{task}\n\nBased on the information above, summarize the report.", "Gemini", allow_requests=False,
+    )
+    assert text.split("\n")[1] == repaired
+    assert report["repaired"] == ["avoid"]
+
+
+def test_url_request_repair_keeps_sentences_apart():
+    text, report = repair_prompt(
+        "Find reviews of EV batteries published since 2024. Include links to every source. Cite sources for each claim.",
+        "Perplexity", allow_requests=False,
+    )
+    assert "batteries published since 2024. Cite sources" in text
+    assert "no_url_requests" in report["repaired"]
+
+
+@pytest.mark.parametrize("text, scoped", [
+    ("Research the current state of solid-state batteries.", False),
+    ("What are the latest EV battery trends?", False),
+    ("Think before responding.", False),
+    ("Work in marketing teams.", False),
+    ("Studies from the past 5 years.", True),
+    ("Published after January 2025.", True),
+    ("Changes this quarter.", True),
+    ("Time scope: 2020s", True),
+])
+def test_time_scope_needs_a_real_bound(text, scoped):
+    assert bool(_TIME_SCOPE.search(text)) is scoped
@@ -0,0 +1,25 @@
+import pytest
+
+from tools.enhance_prompt import warmup
+from tools.llm_backends import backend_name, parse_routes
+
+
+def test_routes_ignore_spaces_and_empty_entries():
+    assert parse_routes(" analysis = openai , example=fake,, enhance=") == {"analysis": "openai", "example": "fake"}
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError, match="opneai"):
+        parse_routes("analysis=opneai")
+
+
+def test_routing_is_read_when_used(monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("LLM_BACKEND_ROUTES", "analysis = openai")
+    assert backend_name("analysis") == "openai"
+    assert backend_name("enhance") == "fake"
+
+
+def test_warmup_reports_an_unknown_backend(monkeypatch):
+    monkeypatch.setenv("LLM_BACKEND", "fkae")
+    assert "fkae" in warmup()["errors"][0]
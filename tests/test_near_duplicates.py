@@ -0,0 +1,40 @@
+import pytest
+
+from tools import near_duplicates
+from tools.near_duplicates import NearDuplicateIndex
+
+_CTO = "Write a short memo for our CTO about the migration to the new billing platform next quarter"
+_COMPONENTS = {"task": "Write a short memo", "context": "audience: CTO"}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return NearDuplicateIndex(str(tmp_path / "index"), "Claude")
+
+
+def test_reuse_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("ANALYSIS_REUSE_DIR", raising=False)
+    assert not near_duplicates.reuse_enabled()
+    near_duplicates.remember_components(_CTO, "Claude", _COMPONENTS)
+    assert near_duplicates.reusable_components(_CTO, "Claude") is None
+
+
+def test_formatting_and_filler_changes_reuse(index):
+    index.add(_CTO, _COMPONENTS)
+    assert index.lookup(_CTO.upper() + "!!") == _COMPONENTS
+    assert index.lookup(_CTO.replace("for our CTO", "for the CTO")) == _COMPONENTS
+
+
+def test_a_changed_content_word_does_not_reuse(index):
+    index.add(_CTO, _COMPONENTS)
+    assert index.lookup(_CTO.replace("CTO", "CFO")) is None
+    assert index.lookup(_CTO.replace("next quarter", "next year")) is None
+
+
+def test_threshold_is_read_when_used(index, monkeypatch):
+    index.add(_CTO, _COMPONENTS)
+    filler = _CTO.replace("for our CTO", "for the CTO")
+    monkeypatch.setenv("ANALYSIS_REUSE_MIN_SIMILARITY", "0.99")
+    assert index.lookup(filler) is None
+    monkeypatch.setenv("ANALYSIS_REUSE_MIN_SIMILARITY", "0.75")
+    assert index.lookup(filler) == _COMPONENTS
@@ -0,0 +1,11 @@
+from tools import profiling
+
+
+def test_profile_setting_is_read_on_first_check(monkeypatch):
+    monkeypatch.setattr(profiling, "_enabled", None)
+    monkeypatch.setenv("PROFILE", "on")
+    assert profiling.enabled()
+    monkeypatch.setenv("PROFILE", "off")
+    assert profiling.enabled()   # decided once per process, then only set_enabled() changes it
+    profiling.set_enabled(False)
+    assert not profiling.enabled()
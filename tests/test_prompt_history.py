@@ -0,0 +1,28 @@
+import sqlite3
+
+import pytest
+
+from tools import prompt_history
+
+
+def _has_fts5() -> bool:
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE t USING fts5(x)")
+    except sqlite3.Error:
+        return False
+    return True
+
+
+def test_history_is_opt_in(monkeypatch):
+    monkeypatch.delenv("PROMPT_HISTORY_DB", raising=False)
+    assert not prompt_history.history_enabled()
+
+
+@pytest.mark.skipif(not _has_fts5(), reason="sqlite built without FTS5")
+def test_record_and_search(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMPT_HISTORY_DB", str(tmp_path / "history.db"))
+    prompt_history.record_enhancement("write a cold email", "Claude", {"task": "email"}, {}, "<task>Email</task>")
+    [entry] = prompt_history.search_history("cold email")
+    assert entry["components"] == {"task": "email"}
+    assert prompt_history.similar_prompts("a cold email please", "Claude")[0]["id"] == entry["id"]
+    assert prompt_history.similar_prompts("a cold email please", "Gemini") == []
@@ -0,0 +1,79 @@
+import pytest
+from dotenv import load_dotenv
+
+from tools import quota
+from tools.quota import QuotaEngine, QuotaExceeded
+
+
+@pytest.fixture
+def engine(tmp_path):
+    quotas = QuotaEngine(str(tmp_path / "quota.db"))
+    yield quotas
+    quotas.close()
+
+
+def test_parse_limit():
+    assert quota._parse_limit("") is None
+    assert quota._parse_limit("None") is None
+    assert quota._parse_limit("0") == 0
+    assert quota._parse_limit(" 500 ") == 500
+    with pytest.raises(ValueError):
+        quota._parse_limit("-1")
+
+
+def test_zero_limit_blocks(engine):
+    engine.set_limit("user", "carol", 0)
+    with pytest.raises(QuotaExceeded):
+        engine.reserve("carol", 10)
+    assert engine.remaining("carol") == 0
+
+
+def test_reservations_stop_at_the_limit(engine):
+    engine.set_limit("user", "alice", 1000)
+    engine.reserve("alice", 600).settle(400, 100)
+    engine.flush()
+    assert engine.remaining("alice") == 500
+    with pytest.raises(QuotaExceeded):
+        engine.reserve("alice", 600)
+    engine.reserve("alice", 500).release()
+
+
+def test_team_limit_applies_to_members(engine):
+    engine.set_limit("team", "research", 100)
+    engine.set_team("bob", "research")
+    with pytest.raises(QuotaExceeded) as e:
+        engine.reserve("bob", 200)
+    assert e.value.scope == "team"
+
+
+def test_cli_zero_limit_is_stored_as_blocked(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "cli.db")
+    monkeypatch.setenv("QUOTA_DB", path)
+    monkeypatch.setattr("sys.argv", ["quota", "set-limit", "user", "carol", "0"])
+    quota.main()
+    assert "daily limit 0" in capsys.readouterr().out
+    fresh = QuotaEngine(path)
+    try:
+        with pytest.raises(QuotaExceeded):
+            fresh.reserve("carol", 10_000_000)
+    finally:
+        fresh.close()
+
+
+def test_only_identified_requests_are_metered(monkeypatch):
+    monkeypatch.setenv("QUOTA_USER_HEADER", "")
+    assert quota.account_for({"X-User": "alice"}) is None
+    monkeypatch.setenv("QUOTA_USER_HEADER", "X-User")
+    assert quota.account_for({"X-User": " alice "}) == "alice"
+    assert quota.account_for({}) is None
+    assert quota.remaining_tokens(None) is None
+
+
+def test_user_header_set_in_dotenv_is_seen(tmp_path, monkeypatch):
+    # Set (then removed) so monkeypatch restores the variable's absence afterwards.
+    monkeypatch.setenv("QUOTA_USER_HEADER", "")
+    monkeypatch.delenv("QUOTA_USER_HEADER")
+    (tmp_path / ".env").write_text("QUOTA_USER_HEADER=X-Auth-User\n")
+    # tools.quota is already imported, as it is when app.py loads .env.
+    load_dotenv(tmp_path / ".env")
+    assert quota.account_for({"X-Auth-User": "dana"}) == "dana"
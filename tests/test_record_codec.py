@@ -0,0 +1,63 @@
+import pytest
+
+from tools import record_codec
+from tools.record_codec import RecordCodec, decode_record, encode_record, train_codec
+
+RECORD = {
+    "raw_prompt": "write a cold email to investors",
+    "target_llm": "Claude",
+    "components": {"role": None, "task": "write a cold email", "examples": ["a", 1, 2.5, True]},
+    "enhanced_prompt": "<task>\nWrite a cold email to investors about our seed round.\n</task>" * 3,
+}
+
+
+def _records(n):
+    return [{**RECORD, "raw_prompt": f"{RECORD['raw_prompt']} #{i}", "id": i} for i in range(n)]
+
+
+@pytest.fixture
+def dict_path(monkeypatch, tmp_path):
+    path = str(tmp_path / "record_codec.dict")
+    monkeypatch.setenv("RECORD_CODEC_DICT", path)
+    return path
+
+
+@pytest.mark.parametrize("kind", ["zlib"] + (["zstd"] if record_codec.zstandard else []))
+def test_round_trip(kind):
+    codec = train_codec(_records(200), 8 * 1024, kind)
+    for record in _records(5) + [RECORD, [], {}, "", None, -(2**70), 1e-300]:
+        assert codec.decode(codec.encode(record)) == record
+
+
+def test_save_and_load(tmp_path):
+    codec = train_codec(_records(100), 8 * 1024, "zlib")
+    path = str(tmp_path / "c.dict")
+    codec.save(path)
+    loaded = RecordCodec.load(path)
+    assert loaded.dict_id == codec.dict_id
+    assert loaded.decode(codec.encode(RECORD)) == RECORD
+
+
+def test_wrong_dictionary_raises():
+    a = train_codec(_records(100), 8 * 1024, "zlib")
+    b = RecordCodec(kind="zlib")
+    with pytest.raises(ValueError):
+        b.decode(a.encode(RECORD))
+
+
+def test_blobs_survive_retraining(dict_path):
+    untrained_blob = encode_record(RECORD)
+    train_codec(_records(100), 8 * 1024, "zlib").save(dict_path)
+    first_blob = encode_record(RECORD)
+    retrained = train_codec(_records(300)[150:], 4 * 1024, "zlib")
+    retrained.save(dict_path)
+    assert record_codec.codec().dict_id == retrained.dict_id
+    assert decode_record(untrained_blob) == RECORD
+    assert decode_record(first_blob) == RECORD
+    assert decode_record(encode_record(RECORD)) == RECORD
+
+
+def test_missing_archived_dictionary_raises(dict_path, tmp_path):
+    other = train_codec(_records(50), 4 * 1024, "zlib")
+    with pytest.raises(ValueError):
+        decode_record(other.encode(RECORD))
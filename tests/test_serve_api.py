@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+import pytest
+
+from tools import serve_api
+
+
+class _Request:
+    """The part of a Starlette request the endpoints read before any upstream call."""
+
+    def __init__(self, body):
+        self._body = body
+        self.headers = {}
+
+    async def json(self):
+        return json.loads(json.dumps(self._body))
+
+
+def _post(handler, body, answers=False):
+    async def fail(*args):
+        raise AssertionError("the handler ran")
+
+    fail.__name__ = handler
+    response = asyncio.run(serve_api._endpoint(fail, answers=answers)(_Request(body)))
+    return response.status_code, json.loads(response.body)
+
+
+def _body(**fields):
+    return {"raw_prompt": "write a cold email to investors", "target_llm": "Claude", **fields}
+
+
+def test_valid_body_gets_defaults():
+    body = asyncio.run(serve_api._read_body(_Request(_body(components={"role": "copywriter", "task": None}))))
+    assert body["max_questions"] == 4
+    assert body["answers"] == {}
+
+
+@pytest.mark.parametrize("max_questions", [True, 0, 9, 2.5, "3"])
+def test_max_questions_is_rejected_before_upstream(max_questions):
+    status, body = _post("_questions", _body(max_questions=max_questions))
+    assert status == 400
+    assert "max_questions" in body["error"]
+
+
+@pytest.mark.parametrize("components, message", [
+    (["role"], "must be an object"),
+    ({"not_a_component": "x"}, "Unknown component"),
+    ({"role": 42}, "must be text or null"),
+    ({"role": "x" * 1001}, "too long"),
+])
+def test_components_are_validated(components, message):
+    status, body = _post("_enhance", _body(components=components), answers=True)
+    assert status == 400
+    assert message in body["error"]
+
+
+def test_answers_are_validated():
+    status, body = _post("_enhance", _body(answers={"role": "x" * 1001}), answers=True)
+    assert status == 400
+    assert "too long" in body["error"]
+
+
+def test_flow_deadline_is_read_when_used(monkeypatch):
+    monkeypatch.setenv("FLOW_DEADLINE_SECONDS", "10")
+    status, body = _post("_analyze", _body(deadline_seconds=20))
+    assert status == 400
+    assert "from 1 to 10" in body["error"]
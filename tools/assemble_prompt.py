@@ -0,0 +1,101 @@
+"""Deterministic local assembly of per-component sections into a profile's structure."""
+
+import re
+
+from tools.enhance_prompt import LLM_PROFILES
+
+# Short section titles — component_labels carry UI hints in parentheses,
+# which do not belong in the prompt itself.
+_SECTION_TITLES = {
+    "output_format": "Output Format",
+    "chain_of_thought": "Chain of Thought",
+    "research_question": "Research Question",
+    "time_scope": "Time Scope",
+    "source_types": "Source Types",
+}
+
+# Leading phrase for each Perplexity directive line (the question stands alone).
+_DIRECTIVE_LEADS = {
+    "time_scope": "Time scope",
+    "source_types": "Sources",
+    "inclusions": "Include",
+    "exclusions": "Exclude",
+    "output_format": "Format",
+}
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def section_title(component: str) -> str:
+    return _SECTION_TITLES.get(component, component.replace("_", " ").title())
+
+
+def _xml_tags(ordered: list) -> str:
+    return "\n\n".join(f"<{c}>\n{text}\n</{c}>" for c, text in ordered)
+
+
+def _bold_headers(ordered: list) -> str:
+    return "\n\n".join(f"**{section_title(c)}**\n{text}" for c, text in ordered)
+
+
+def _markdown_headers(ordered: list) -> str:
+    return "\n\n".join(f"## {section_title(c)}\n{text}" for c, text in ordered)
+
+
+def _research_directive(ordered: list) -> str:
+    question = [text for c, text in ordered if c == "research_question"]
+    lines = [f"{_DIRECTIVE_LEADS.get(c, section_title(c))}: {text}" for c, text in ordered if c != "research_question"]
+    parts = question + (["\n".join(lines)] if lines else [])
+    return "\n\n".join(parts)
+
+
+_ASSEMBLERS = {
+    "xml_tags": _xml_tags,
+    "bold_headers": _bold_headers,
+    "markdown_headers": _markdown_headers,
+    "research_directive": _research_directive,
+}
+
+
+def anchor_directive(text: str, anchor: str) -> str:
+    """End the directive with 'anchor <directive>.' unless it already has one."""
+    if anchor.lower() in text.lower():
+        return text
+    first = _SENTENCE_END.split(text.strip(), maxsplit=1)[0].strip().rstrip(".!?")
+    if not first:
+        return text
+    return f"{text}\n\n{anchor} {first[0].lower()}{first[1:]}."
+
+
+def assemble_prompt(target_llm: str, sections: dict) -> str:
+    """
+    Join section bodies into one prompt using the profile's structure.
+    sections maps component name -> body text; empty or missing components are
+    omitted, and the profile's component order always wins over dict order.
+
+    Profile placement rules are applied here rather than trusted to the model:
+    the directive_component moves last and ends with the anchor_phrase
+    (Gemini), and cot_trailer profiles always end with cot_phrase (ChatGPT).
+    """
+    profile = LLM_PROFILES[target_llm]
+    ordered = [
+        (c, sections[c].strip())
+        for c in profile["components"]
+        if sections.get(c) and sections[c].strip()
+    ]
+
+    directive = profile["directive_component"]
+    if directive:
+        body = [(c, t) for c, t in ordered if c != directive]
+        last = [(c, t) for c, t in ordered if c == directive]
+        if last and profile["anchor_phrase"]:
+            last = [(directive, anchor_directive(last[0][1], profile["anchor_phrase"]))]
+        ordered = body + last
+
+    prompt = _ASSEMBLERS[profile["structure"]](ordered)
+
+    cot = profile["cot_phrase"]
+    if profile["cot_trailer"] and cot and prompt and not prompt.rstrip().endswith(cot):
+        prompt = f"{prompt.rstrip()}\n\n{cot}"
+    return prompt
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark the record codec against plain JSON on our own records.
+
+    python -m tools.benchmark_record_codec [--input records.jsonl] [--limit 20000]
+
+Records come from --input (one JSON record per line) or else the enhancement
+history and gallery. The newest fifth is held out: the dictionary is trained
+on the rest and every measurement below uses only the held-out records.
+
+- ratio: JSON bytes / stored bytes, for the bare binary encoding, the codec
+  without a dictionary and the trained codec;
+- throughput: records and JSON-equivalent MB per second, encode and decode,
+  next to json.dumps / json.loads;
+- memory: traced Python heap for --memory-records records held as dicts,
+  as JSON text and as blobs (reported per 100k records).
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+from tools.record_codec import RecordCodec, train_codec, training_records
+
+_MIN_RECORDS = 50
+_MIN_SECONDS = 0.5   # each throughput loop runs at least this long
+
+
+def _load_input(path: str, limit: int) -> list:
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+            if len(records) >= limit:
+                break
+    return records
+
+
+def _throughput(fn, items: list, json_bytes: int) -> dict:
+    rounds, started = 0, time.perf_counter()
+    while True:
+        for item in items:
+            fn(item)
+        rounds += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= _MIN_SECONDS:
+            break
+    return {
+        "records_per_s": round(rounds * len(items) / elapsed),
+        "mb_per_s": round(rounds * json_bytes / elapsed / 1e6, 1),
+    }
+
+
+def _heap_mb(build, count: int) -> float:
+    """Traced heap (MB per 100k) of the list build() returns."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return round((after - before) / 1e6 * 100_000 / count, 1)
+
+
+def run_benchmark(records: list, memory_records: int = 100_000, size: int = 64 * 1024, kind: str | None = None) -> dict:
+    held_out = max(len(records) // 5, 1)
+    test, train = records[:held_out], records[held_out:] or records
+    trained = train_codec(train, size, kind)
+    untrained = RecordCodec(kind="zlib")
+
+    texts = [json.dumps(r, separators=(",", ":")) for r in test]
+    json_bytes = sum(len(t.encode()) for t in texts)
+    packed = sum(len(trained.pack(r)) for r in test)
+    plain = sum(len(untrained.encode(r)) for r in test)
+    blobs = [trained.encode(r) for r in test]
+    stored = sum(len(b) for b in blobs)
+    if any(trained.decode(b) != r for b, r in zip(blobs, test)):
+        raise ValueError("Codec round trip changed a record")
+
+    cycled = list(itertools.islice(itertools.cycle(range(len(test))), memory_records))
+    return {
+        "records": {"train": len(train), "test": len(test)},
+        "codec": {"kind": trained.kind, "interned": len(trained.interned), "dictionary_bytes": len(trained.dictionary)},
+        "bytes_per_record": {
+            "json": round(json_bytes / len(test)),
+            "binary": round(packed / len(test)),
+            "no_dictionary": round(plain / len(test)),
+            "trained": round(stored / len(test)),
+        },
+        "ratio": {
+            "binary": round(json_bytes / packed, 2),
+            "no_dictionary": round(json_bytes / plain, 2),
+            "trained": round(json_bytes / stored, 2),
+        },
+        "throughput": {
+            "encode": _throughput(trained.encode, test, json_bytes),
+            "decode": _throughput(trained.decode, blobs, json_bytes),
+            "json_dumps": _throughput(lambda r: json.dumps(r, separators=(",", ":")), test, json_bytes),
+            "json_loads": _throughput(json.loads, texts, json_bytes),
+        },
+        "memory_mb_per_100k": {
+            # Each record is its own object, as in a cache filled from storage.
+            "dicts": _heap_mb(lambda: [json.loads(texts[i]) for i in cycled], memory_records),
+            "json_text": _heap_mb(lambda: ["".join((texts[i], " "))[:-1] for i in cycled], memory_records),
+            "blobs": _heap_mb(lambda: [bytes(bytearray(blobs[i])) for i in cycled], memory_records),
+        },
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default=None, help="JSONL file of records (default: history and gallery)")
+    parser.add_argument("--limit", type=int, default=20_000, help="Records to read (default: 20000)")
+    parser.add_argument("--memory-records", type=int, default=100_000, help="Records held for the memory test (default: 100000)")
+    parser.add_argument("--size", type=int, default=64 * 1024, help="Dictionary bytes (default: 65536)")
+    parser.add_argument("--kind", choices=("zlib", "zstd"), default=None, help="Default: zstd when installed")
+    args = parser.parse_args()
+
+    try:
+        records = _load_input(args.input, args.limit) if args.input else training_records(args.limit)
+        if len(records) < _MIN_RECORDS:
+            raise ValueError(
+                f"Need at least {_MIN_RECORDS} records to benchmark, found {len(records)}. "
+                "Pass --input or build up the enhancement history first."
+            )
+        result = run_benchmark(records, args.memory_records, args.size, args.kind)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
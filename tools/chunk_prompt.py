@@ -0,0 +1,141 @@
+"""Split long documents on structural boundaries and merge per-chunk analyses."""
+
+import re
+
+# Target size of one chunk — each chunk is one ordinary-sized analysis call.
+CHUNK_CHARS = 4000
+
+# Merged component text is capped so downstream stages stay small.
+_MAX_MERGED_CHARS = 600
+_EXCERPT_CHARS = 1500
+_OUTLINE_LINES = 30
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# Markdown headings, XML-style tags, bold labels, numbered headings and short
+# "Title:" lines — a new section of the document starts here.
+_HEADING = re.compile(
+    r"^(#{1,6}\s+\S.*|</?[A-Za-z_][\w-]*>|\*\*[^*]+\*\*:?|\d+(\.\d+)*[.)]?\s+[A-Z].{0,80}|[A-Z][^.!?]{0,60}:)$"
+)
+# Progressively finer fallbacks for a block that is still too long.
+_FINER_SPLITS = (re.compile(r"\n"), re.compile(r"(?<=[.!?])\s+"), re.compile(r"\s+"))
+_NORMALIZE = re.compile(r"\W+")
+
+
+def _is_heading(line: str) -> bool:
+    return bool(_HEADING.match(line.strip()))
+
+
+def _blocks(text: str) -> list:
+    """Paragraphs, with every heading line starting a block of its own."""
+    blocks = []
+    for para in _PARAGRAPH_BREAK.split(text.strip()):
+        current = []
+        for line in para.split("\n"):
+            if current and _is_heading(line):
+                blocks.append("\n".join(current))
+                current = []
+            current.append(line)
+        if current:
+            blocks.append("\n".join(current))
+    return [b.strip() for b in blocks if b.strip()]
+
+
+def _pieces(block: str, max_chars: int, level: int = 0) -> list:
+    """Cut an oversized block at lines, then sentences, then words, then hard."""
+    if len(block) <= max_chars:
+        return [block]
+    for depth in range(level, len(_FINER_SPLITS)):
+        parts = [p for p in _FINER_SPLITS[depth].split(block) if p.strip()]
+        if len(parts) > 1:
+            joiner = "\n" if depth == 0 else " "
+            pieces, current = [], ""
+            for part in parts:
+                for sub in _pieces(part, max_chars, depth + 1):
+                    if current and len(current) + len(joiner) + len(sub) > max_chars:
+                        pieces.append(current)
+                        current = sub
+                    else:
+                        current = f"{current}{joiner}{sub}" if current else sub
+            if current:
+                pieces.append(current)
+            return pieces
+    return [block[i:i + max_chars] for i in range(0, len(block), max_chars)]
+
+
+def split_document(text: str, max_chars: int = CHUNK_CHARS) -> list:
+    """
+    Split text into chunks of at most max_chars, preferring to cut at section
+    headings, then paragraph breaks, then lines and sentences. Identical
+    chunks (repeated boilerplate) are returned once.
+    """
+    chunks, current = [], ""
+    for block in _blocks(text):
+        for piece in _pieces(block, max_chars):
+            # A new section starts a new chunk once the current one is half full.
+            section_break = _is_heading(piece.split("\n", 1)[0]) and len(current) > max_chars // 2
+            if current and (section_break or len(current) + 2 + len(piece) > max_chars):
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return list(dict.fromkeys(chunks))
+
+
+def _truncate(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut.rstrip(" ,;:") + "…"
+
+
+def merge_components(names: list, chunk_results: list) -> dict:
+    """
+    Merge per-chunk component maps into one: values found in several chunks
+    are joined with "; " in document order, skipping any value that repeats
+    (or is contained in) one already kept. Components never found stay None.
+    """
+    merged = {}
+    for name in names:
+        kept, keys = [], []
+        for result in chunk_results:
+            value = result.get(name)
+            if not value:
+                continue
+            value = str(value).strip()
+            key = _NORMALIZE.sub(" ", value.lower()).strip()
+            if not key or any(key in k for k in keys):
+                continue
+            # A fuller version of something already kept replaces it.
+            superseded = [i for i, k in enumerate(keys) if k in key]
+            for i in reversed(superseded):
+                del kept[i], keys[i]
+            kept.append(value)
+            keys.append(key)
+        merged[name] = _truncate("; ".join(kept), _MAX_MERGED_CHARS) if kept else None
+    return merged
+
+
+def compact_context(text: str, components: dict | None = None) -> str:
+    """
+    A bounded stand-in for a long document in the stages after analysis: its
+    outline (heading lines), the opening excerpt, and — when given — the
+    merged components found across the whole document.
+    """
+    outline = list(dict.fromkeys(
+        line.strip() for line in text.split("\n") if line.strip() and _is_heading(line)
+    ))
+    lines = [f"[Long document of {len(text):,} characters — condensed]"]
+    if outline:
+        lines.append("Outline:")
+        lines.extend(f"- {h}" for h in outline[:_OUTLINE_LINES])
+        if len(outline) > _OUTLINE_LINES:
+            lines.append(f"- … {len(outline) - _OUTLINE_LINES} more sections")
+    lines.append("Opening excerpt:")
+    lines.append(_truncate(text.strip(), _EXCERPT_CHARS))
+    found = {k: v for k, v in (components or {}).items() if v}
+    if found:
+        lines.append("Found across the full document:")
+        lines.extend(f"- {k}: {v}" for k, v in found.items())
+    return "\n".join(lines)
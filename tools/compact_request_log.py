@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Columnar compaction of the request log, and aggregate queries over it.
+
+    python -m tools.compact_request_log compact
+    python -m tools.compact_request_log query runs duration_ms --agg p95 --by profile,day
+    python -m tools.compact_request_log query stages input_tokens --agg sum --by stage
+
+compact turns each JSONL segment written by tools/request_log.py into two
+column files under <REQUEST_LOG_DIR>/columns/ — one row per run ("runs") and
+one per stage of a run ("stages") — and recompacts a segment only when it has
+grown since. A column file holds every column as one contiguous block:
+numbers as float64 (NaN when missing) and strings as uint32 codes into a
+small dictionary. A query memory-maps the files and reads only the columns it
+groups and aggregates by, so it never parses JSON or loads whole files.
+"""
+
+import argparse
+import glob
+import json
+import math
+import mmap
+import os
+import sys
+from array import array
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from tools.request_log import SEGMENT_PREFIX, log_dir
+
+_MAGIC = b"RLCOL1\n"
+_ALIGN = 8
+
+# Column name -> type ("f64" or "str") per table.
+TABLES = {
+    "runs": {
+        "ts": "f64",
+        "day": "str",
+        "flow": "str",
+        "kind": "str",
+        "profile": "str",
+        "outcome": "str",
+        "duration_ms": "f64",
+        "input_tokens": "f64",
+        "output_tokens": "f64",
+        "cache_read_tokens": "f64",
+        "analysis_reuse": "str",
+        "backend": "str",
+    },
+    "stages": {
+        "ts": "f64",
+        "day": "str",
+        "flow": "str",
+        "kind": "str",
+        "profile": "str",
+        "stage": "str",
+        "latency_ms": "f64",
+        "input_tokens": "f64",
+        "output_tokens": "f64",
+        "deadline": "str",
+    },
+}
+
+AGGREGATES = ("count", "sum", "mean", "max", "p50", "p95", "p99")
+
+
+def _rows(record: dict):
+    """(run row, [stage rows]) for one log record."""
+    day = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d")
+    tokens = record.get("tokens") or {}
+    common = {
+        "ts": record["ts"],
+        "day": day,
+        "flow": record.get("flow"),
+        "kind": record.get("kind"),
+        "profile": record.get("profile"),
+    }
+    run = {
+        **common,
+        "outcome": record.get("outcome"),
+        "duration_ms": record.get("duration_ms"),
+        "input_tokens": sum(t["input"] for t in tokens.values()),
+        "output_tokens": sum(t["output"] for t in tokens.values()),
+        "cache_read_tokens": (record.get("cache") or {}).get("cache_read_tokens", 0),
+        "analysis_reuse": (record.get("cache") or {}).get("analysis_reuse"),
+        "backend": ",".join(record.get("backends") or ()),
+    }
+    stage_names = dict.fromkeys([*(record.get("stages") or {}), *tokens, *(record.get("deadline") or {})])
+    stages = [
+        {
+            **common,
+            "stage": stage,
+            "latency_ms": (record.get("stages") or {}).get(stage),
+            "input_tokens": tokens.get(stage, {}).get("input"),
+            "output_tokens": tokens.get(stage, {}).get("output"),
+            "deadline": (record.get("deadline") or {}).get(stage),
+        }
+        for stage in stage_names
+    ]
+    return run, stages
+
+
+# ---------------------------------------------------------------------------
+# Column files
+# ---------------------------------------------------------------------------
+
+
+def _write_columns(path: str, schema: dict, rows: list):
+    header = {"rows": len(rows), "columns": {}}
+    blocks = []
+    offset = 0
+    for name, kind in schema.items():
+        if kind == "f64":
+            block = array("d", (math.nan if r.get(name) is None else float(r[name]) for r in rows))
+            header["columns"][name] = {"type": kind, "offset": offset}
+        else:
+            codes = {}
+            block = array("I", (codes.setdefault("" if r.get(name) is None else str(r[name]), len(codes)) for r in rows))
+            header["columns"][name] = {"type": kind, "offset": offset, "values": list(codes)}
+        data = block.tobytes()
+        data += b"\0" * (-len(data) % _ALIGN)
+        blocks.append(data)
+        offset += len(data)
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-(len(_MAGIC) + 8 + len(header_bytes)) % _ALIGN)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_MAGIC)
+        f.write(len(header_bytes).to_bytes(8, "little"))
+        f.write(header_bytes)
+        for data in blocks:
+            f.write(data)
+    os.replace(tmp, path)
+
+
+class ColumnFile:
+    """One memory-mapped column file; column(name) is a zero-copy view."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"Not a request-log column file: {path}")
+        size = int.from_bytes(self._mmap[len(_MAGIC):len(_MAGIC) + 8], "little")
+        start = len(_MAGIC) + 8
+        header = json.loads(self._mmap[start:start + size])
+        self.rows = header["rows"]
+        self.columns = header["columns"]
+        self._data = start + size
+
+    def column(self, name: str):
+        """(view, values): float64 numbers and values=None, or uint32 codes and their strings."""
+        info = self.columns[name]
+        start = self._data + info["offset"]
+        fmt, width = ("d", 8) if info["type"] == "f64" else ("I", 4)
+        view = memoryview(self._mmap)[start:start + self.rows * width].cast(fmt)
+        return view, info.get("values")
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # a view is still referenced; the map is closed when it is freed
+
+
+def _columns_dir(directory: str) -> str:
+    return os.path.join(directory, "columns")
+
+
+def compact(directory: str | None = None) -> dict:
+    """Compact every segment that is new or has grown. Returns {"segments", "runs", "stages"}."""
+    directory = directory or log_dir()
+    out_dir = _columns_dir(directory)
+    os.makedirs(out_dir, exist_ok=True)
+    done = {"segments": 0, "runs": 0, "stages": 0}
+    for segment in sorted(glob.glob(os.path.join(directory, f"{SEGMENT_PREFIX}*.jsonl"))):
+        stem = os.path.splitext(os.path.basename(segment))[0]
+        targets = {table: os.path.join(out_dir, f"{stem}.{table}.col") for table in TABLES}
+        mtime = os.path.getmtime(segment)
+        if all(os.path.exists(p) and os.path.getmtime(p) >= mtime for p in targets.values()):
+            continue
+        runs, stages = [], []
+        with open(segment, "rb") as f:
+            for line in f:
+                try:
+                    run, run_stages = _rows(json.loads(line))
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue  # a torn last line of a segment still being written
+                runs.append(run)
+                stages.extend(run_stages)
+        _write_columns(targets["runs"], TABLES["runs"], runs)
+        _write_columns(targets["stages"], TABLES["stages"], stages)
+        done["segments"] += 1
+        done["runs"] += len(runs)
+        done["stages"] += len(stages)
+    return done
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+
+
+def _percentile(values: list, pct: float) -> float:
+    values.sort()
+    return values[min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+def aggregate(
+    table: str,
+    value: str,
+    agg: str = "count",
+    by: tuple = (),
+    where: dict | None = None,
+    directory: str | None = None,
+) -> dict:
+    """
+    Aggregate one column of table, grouped by the string columns in by and
+    filtered by where ({column: value} equality on string columns). Rows
+    where value is missing (NaN) are skipped. Returns {group tuple: result}.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}. Choose one of: {', '.join(TABLES)}.")
+    schema = TABLES[table]
+    if schema.get(value) != "f64":
+        raise ValueError(f"'{value}' is not a numeric column of {table}.")
+    if agg not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate: {agg}. Choose one of: {', '.join(AGGREGATES)}.")
+    for column in (*by, *(where or {})):
+        if schema.get(column) != "str":
+            raise ValueError(f"'{column}' is not a text column of {table}.")
+
+    collect = agg.startswith("p")
+    groups = {}
+    pattern = os.path.join(_columns_dir(directory or log_dir()), f"*.{table}.col")
+    for path in sorted(glob.glob(pattern)):
+        col = ColumnFile(path)
+        values = keys = filters = codes = None
+        try:
+            values, _ = col.column(value)
+            keys = [col.column(c) for c in by]
+            filters = []
+            for column, wanted in (where or {}).items():
+                codes, names = col.column(column)
+                if wanted not in names:
+                    break
+                filters.append((codes, names.index(wanted)))
+            else:
+                for i in range(col.rows):
+                    v = values[i]
+                    if v != v or any(codes[i] != code for codes, code in filters):
+                        continue
+                    key = tuple(names[codes[i]] for codes, names in keys)
+                    if collect:
+                        groups.setdefault(key, []).append(v)
+                    else:
+                        acc = groups.setdefault(key, [0, 0.0, -math.inf])
+                        acc[0] += 1
+                        acc[1] += v
+                        acc[2] = max(acc[2], v)
+        finally:
+            # Views into the map must be gone before it can close.
+            values = keys = filters = codes = None
+            col.close()
+
+    if collect:
+        pct = float(agg[1:])
+        return {key: _percentile(vals, pct) for key, vals in sorted(groups.items())}
+    pick = {
+        "count": lambda acc: acc[0],
+        "sum": lambda acc: acc[1],
+        "mean": lambda acc: acc[1] / acc[0],
+        "max": lambda acc: acc[2],
+    }[agg]
+    return {key: pick(acc) for key, acc in sorted(groups.items())}
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=None, help="Log directory (default: REQUEST_LOG_DIR or .tmp/logs)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("compact", help="Compact new or grown segments into column files")
+    query = commands.add_parser("query", help="Aggregate one numeric column")
+    query.add_argument("table", choices=list(TABLES))
+    query.add_argument("value", help="Numeric column, e.g. duration_ms, latency_ms, input_tokens")
+    query.add_argument("--agg", default="count", choices=AGGREGATES)
+    query.add_argument("--by", default="", help="Comma-separated text columns, e.g. profile,day")
+    query.add_argument("--where", action="append", default=[], metavar="COLUMN=VALUE")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        print(json.dumps(compact(args.dir), indent=2))
+        return
+    try:
+        result = aggregate(
+            args.table,
+            args.value,
+            args.agg,
+            tuple(c for c in args.by.split(",") if c),
+            dict(w.split("=", 1) for w in args.where),
+            args.dir,
+        )
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(2)
+    by = [c for c in args.by.split(",") if c]
+    print("\t".join([*by, f"{args.agg}({args.value})"]))
+    for key, v in result.items():
+        print("\t".join([*key, f"{v:.1f}" if isinstance(v, float) else str(v)]))
+
+
+if __name__ == "__main__":
+    main()
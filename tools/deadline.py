@@ -0,0 +1,118 @@
+"""
+Deadlines for one enhancement flow, with a time budget per pipeline stage.
+
+A Deadline is created when a flow starts (an API request, or a job when it is
+queued) and passed down to every stage. Each API call gets the smaller of its
+stage budget and the time left on the flow as its SDK timeout; a stage that
+cannot start or finish in time raises DeadlineExceeded and the caller degrades
+(skip questions, render locally, or keep a partial stream). Every stage
+outcome is counted in tools/metrics as deadline.outcome{stage,outcome}.
+"""
+
+import os
+import time
+
+from tools import metrics
+
+# Per-stage budgets in seconds — the most a single stage may use of the flow:
+# (environment variable or None, default).
+STAGE_BUDGETS = {
+    "analysis": ("ANALYSIS_BUDGET_SECONDS", 15.0),
+    "questions": ("QUESTIONS_BUDGET_SECONDS", 15.0),
+    "questions_lazy": ("QUESTIONS_BUDGET_SECONDS", 15.0),
+    "example": (None, 8.0),
+    "enhance": ("ENHANCE_BUDGET_SECONDS", 30.0),
+    "section": (None, 10.0),
+    "refine": ("REFINE_BUDGET_SECONDS", 20.0),
+    "lint_fix": (None, 5.0),
+}
+_DEFAULT_BUDGET = 15.0
+
+
+# Settings are read when used, not at import: this module is imported before
+# enhance_prompt loads .env.
+def flow_deadline_seconds() -> float:
+    """Whole-flow ceiling for one API request (analysis + questions / enhance)."""
+    return float(os.getenv("FLOW_DEADLINE_SECONDS", "45"))
+
+
+def stage_budget(stage: str) -> float:
+    """Seconds stage may use of a flow."""
+    name, default = STAGE_BUDGETS.get(stage, (None, _DEFAULT_BUDGET))
+    return float(os.getenv(name, default)) if name else default
+
+OUTCOMES = ("ok", "timeout", "skipped", "partial", "fallback")
+
+# Below this, a call is not worth starting: it would only time out.
+_MIN_CALL_SECONDS = 1.0
+
+
+class DeadlineExceeded(TimeoutError):
+    """A stage ran out of time; the message is safe to show to users."""
+
+    def __init__(self, stage: str):
+        super().__init__("The AI service took too long to respond.")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Absolute wall-clock expiry for one flow. Wall-clock (not monotonic) so a
+    job's deadline survives being stored in its JSON payload.
+    """
+
+    def __init__(self, expires_at: float):
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.time() + seconds)
+
+    @classmethod
+    def for_stage(cls, stage: str) -> "Deadline":
+        """A deadline covering one stage on its own (e.g. a background job)."""
+        return cls.after(stage_budget(stage))
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.time(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, stage: str) -> float:
+        """Seconds the next call of stage may take: its budget, capped by the flow."""
+        return min(stage_budget(stage), self.remaining())
+
+    def can_afford(self, stage: str, reserve: str | None = None) -> bool:
+        """
+        Whether stage can still run, leaving the reserve stage (e.g. "enhance"
+        after "questions") enough time to run after it.
+        """
+        needed = _MIN_CALL_SECONDS
+        if reserve is not None:
+            needed += stage_budget(reserve)
+        return self.remaining() >= needed
+
+    def check(self, stage: str) -> float:
+        """The timeout for the next call of stage, or DeadlineExceeded if too little is left."""
+        timeout = self.timeout(stage)
+        if timeout < _MIN_CALL_SECONDS:
+            record_outcome(stage, "skipped")
+            raise DeadlineExceeded(stage)
+        return timeout
+
+
+def record_outcome(stage: str, outcome: str):
+    """Count one stage outcome (one of OUTCOMES)."""
+    metrics.increment("deadline.outcome", stage=stage, outcome=outcome)
+
+
+def outcome_rates() -> dict:
+    """Per stage with any outcome: the share of each outcome, e.g. for SLO checks."""
+    rates = {}
+    for stage in STAGE_BUDGETS:
+        counts = {o: metrics.counter("deadline.outcome", stage=stage, outcome=o) for o in OUTCOMES}
+        total = sum(counts.values())
+        if total:
+            rates[stage] = {o: n / total for o, n in counts.items() if n}
+    return rates
@@ -0,0 +1,79 @@
+"""Local component detection: a cheap, zero-API preview of the analysis.
+
+Each component has a few phrasing cues ("act as", "e.g.", "in a table",
+"since 2023", ...). A component counts as present when one of its cues occurs
+in the prompt, and its value is the sentence the cue was found in. This is
+much rougher than analyze_prompt_components() — it sees wording, not meaning —
+so it only drives the live preview on the input page, never the enhancement.
+"""
+
+import re
+from functools import lru_cache
+
+from tools.enhance_prompt import LLM_PROFILES, MAX_PROMPT_CHARS
+
+_CUES = {
+    "role": r"you are|you're an?|act as|acting as|pretend to be|as an? (?:expert|senior|professional|experienced)|role of",
+    "task": (
+        r"write|create|draft|generate|summari[sz]e|explain|analy[sz]e|compare|list|plan|design|build|translate|"
+        r"review|rewrite|outline|suggest|give me|tell me|describe|help me|make (?:a|an|me)|find|research"
+    ),
+    "context": (
+        r"because|background|context|i am|i'm|we are|we're|my (?:company|team|boss|client|audience)|"
+        r"our (?:company|team|product|customers)|currently|audience|for (?:my|our) "
+    ),
+    "examples": r"for example|for instance|e\.g\.|such as|example:|like this|here is an example|sample",
+    "output": (
+        r"format|bullet|table|json|markdown|csv|headings?|paragraphs?|in \d+ (?:words|sentences|bullets|points)|"
+        r"(?:under|about|around|max(?:imum)?) \d+ words|one page|tl;?dr"
+    ),
+    "constraints": (
+        r"must|should not|shouldn't|don't|do not|avoid|no more than|at most|at least|limit(?:ed)? to|"
+        r"only use|never|keep it"
+    ),
+    "instructions": r"make sure|ensure|remember to|be sure to|focus on|prioriti[sz]e|use a .* tone|tone",
+    "steps": r"step[- ]by[- ]step|steps|first,|then,|finally,|\d+\. ",
+    "chain_of_thought": r"think (?:through|step)|reason(?:ing)?|walk (?:me )?through|show your work|explain why",
+    "time_scope": (
+        r"since (?:19|20)\d\d|after (?:19|20)\d\d|before (?:19|20)\d\d|(?:19|20)\d\d|last (?:\d+ )?(?:year|month|week)s?|"
+        r"past (?:\d+ )?(?:year|month|week)s?|recent(?:ly)?|latest|this (?:year|month)"
+    ),
+    "source_types": (
+        r"academic|papers?|journals?|peer[- ]reviewed|studies|reddit|youtube|news|forums?|wolfram|"
+        r"official (?:docs|documentation|sources)"
+    ),
+    "inclusions": r"include|including|cite|citations?|with sources|mention|cover|statistics|data on",
+    "exclusions": r"exclude|excluding|except|not including|ignore|omit|skip|leave out",
+}
+# Components that go by another name in some profiles.
+_ALIASES = {
+    "persona": "role",
+    "objective": "task",
+    "research_question": "task",
+    "background": "context",
+    "output_format": "output",
+}
+
+_SENTENCE = re.compile(r"[^.!?\n]+[.!?]?")
+_MAX_VALUE_CHARS = 160
+
+
+@lru_cache(maxsize=None)
+def _pattern(component: str):
+    cue = _CUES.get(_ALIASES.get(component, component))
+    return re.compile(rf"\b(?:{cue})", re.IGNORECASE) if cue else None
+
+
+def detect_components(raw_prompt: str, target_llm: str) -> dict:
+    """
+    {component: sentence or None} for every component of target_llm's
+    profile — the same shape as analyze_prompt_components(). Only the first
+    MAX_PROMPT_CHARS of a long document are scanned.
+    """
+    sentences = [s.strip() for s in _SENTENCE.findall(raw_prompt[:MAX_PROMPT_CHARS]) if s.strip()]
+    found = {}
+    for component in LLM_PROFILES[target_llm]["components"]:
+        pattern = _pattern(component)
+        match = next((s for s in sentences if pattern and pattern.search(s)), None)
+        found[component] = match[:_MAX_VALUE_CHARS] if match else None
+    return found
@@ -1,17 +1,33 @@
 """Core prompt enhancement logic: LLM profiles + 3 API functions."""
 
+import contextvars
 import json
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 
 import anthropic
 from dotenv import load_dotenv
 
+from tools import metrics, profiling, quota
+from tools.chunk_prompt import compact_context, merge_components, split_document
+from tools.deadline import Deadline, DeadlineExceeded, record_outcome
+from tools.llm_backends import ANTHROPIC, backend_for, backend_named, configured_backends
+from tools.near_duplicates import remember_components, reusable_components
+from tools.token_budget import TokenLedger, estimate_tokens
+
 load_dotenv()
 
 # ---------------------------------------------------------------------------
 # LLM Profiles
 # Each profile defines how to structure and frame a prompt for that model,
 # based on official documentation from each provider.
+# directive_component / anchor_phrase / cot_trailer are enforced locally when
+# a prompt is assembled from sections (see tools/assemble_prompt.py).
 # ---------------------------------------------------------------------------
 
 LLM_PROFILES = {
@@ -23,6 +39,9 @@ LLM_PROFILES = {
         "components": ["role", "task", "context", "examples", "output", "constraints", "instructions"],
         "cot_phrase": "Think through this carefully before responding.",
         "avoid": ["be thorough", "do not be lazy", "carefully"],
+        "directive_component": None,
+        "anchor_phrase": None,
+        "cot_trailer": False,
         "special": (
             "Use XML tags for every section. Explain the reasoning BEHIND each constraint "
             "(e.g. 'Avoid jargon because the audience is non-technical'), not just the constraint itself. "
@@ -47,6 +66,9 @@ LLM_PROFILES = {
         "components": ["persona", "objective", "context", "steps", "examples", "output_format", "chain_of_thought"],
         "cot_phrase": "Think step by step.",
         "avoid": ["vague adjectives", "ambiguous phrasing"],
+        "directive_component": None,
+        "anchor_phrase": None,
+        "cot_trailer": True,
         "special": (
             "Start with 'Act as [expert persona].' "
             "Use bold **Headers** to separate sections. "
@@ -73,6 +95,9 @@ LLM_PROFILES = {
         "components": ["role", "background", "task", "examples", "output_format"],
         "cot_phrase": None,
         "avoid": ["please", "carefully", "I need you to", "could you"],
+        "directive_component": "task",
+        "anchor_phrase": "Based on the information above,",
+        "cot_trailer": False,
         "special": (
             "Use ## Markdown headers for each section. "
             "Place the actual directive LAST, after all context — Gemini reasons better this way. "
@@ -97,6 +122,9 @@ LLM_PROFILES = {
         "components": ["research_question", "time_scope", "source_types", "inclusions", "exclusions", "output_format"],
         "cot_phrase": None,
         "avoid": ["few-shot examples", "URL requests", "role personas", "multi-topic queries"],
+        "directive_component": None,
+        "anchor_phrase": None,
+        "cot_trailer": False,
         "special": (
             "Perplexity is a search-augmented model — NOT a chat model. Rules: "
             "(1) ONE focused topic per query — multi-topic queries confuse the search engine. "
@@ -143,7 +171,7 @@ weak pieces of information.
 Important rules for {llm}:
 {special}
 
-Avoid asking about components: {present_components}
+Avoid asking about components listed as already present.
 
 === INTENT DETECTION — READ BEFORE GENERATING QUESTIONS ===
 First, identify the user's core intent from the raw prompt:
@@ -192,6 +220,57 @@ Return ONLY valid JSON — no markdown, no explanation. Schema:
 Return no more than {max_q} questions. Prioritize by impact for {llm}."""
 
 
+# Lazy mode: questions + placeholders only, in one small call. Each question's
+# inferred_example is generated on demand with _EXAMPLE_SYSTEM when displayed.
+_QUESTIONS_LAZY_SYSTEM = """\
+You are a prompt engineering expert specializing in {llm}.
+
+The user wants to enhance their prompt for {llm}. Based on the analyzed components \
+and {llm}'s specific requirements, identify the {max_q} most impactful missing or \
+weak pieces of information.
+
+Important rules for {llm}:
+{special}
+
+Avoid asking about components listed as already present.
+
+First identify the user's core intent (image generation, text/chat, or search/research) \
+and ask about what matters for THAT intent — e.g. visual style, mood and composition \
+for image generation; never suggest ASCII art or code for an image request.
+
+Return ONLY valid JSON — no markdown, no explanation. Schema:
+[
+  {{
+    "component": "component_name",
+    "question": "The specific question to ask the user",
+    "placeholder": "Short hint for the text input field"
+  }}
+]
+
+Return no more than {max_q} questions. Prioritize by impact for {llm}."""
+
+
+_EXAMPLE_SYSTEM = """\
+You are a prompt engineering expert specializing in {llm}.
+
+The user is answering a clarifying question about their prompt for {llm}. Infer the \
+most likely answer from the raw prompt context — even if it's not stated explicitly. \
+It will be shown as a ready-to-use suggestion they can accept with one click.
+
+Important rules for {llm}:
+{special}
+
+Match the user's ACTUAL intent: for image generation, describe visual parameters \
+(style, mood, lighting, composition) — never ASCII art, text art or code.
+
+The answer MUST be detailed and specific — 5 to 6 lines minimum. Write it as if a \
+domain expert is filling it out. Include specific details, numbers, names or \
+qualifiers drawn from the prompt, concrete scenarios, nuances that matter for {llm}, \
+and any audience, constraint or output preference you can reasonably infer.
+
+Output ONLY the answer text — no preamble, no quotes, no markdown."""
+
+
 _ENHANCE_SYSTEM = """\
 You are a world-class prompt engineer specializing in {llm}.
 
@@ -233,10 +312,121 @@ research-focused framing regardless of LLM.
 5. Output ONLY the final enhanced prompt — no explanation, no preamble, no "Here is your enhanced prompt:".
 6. The output must be ready to paste directly into {llm}."""
 
+
+_SECTION_SYSTEM = """\
+You are a world-class prompt engineer specializing in {llm}.
+
+You are writing ONE section of a larger prompt optimized for {llm}. The other \
+sections are written separately and the whole prompt is assembled automatically.
+
+Section to write: {label}
+
+=== {llm} STRUCTURE & STYLE REQUIREMENTS ===
+{special}
+
+=== RULES ===
+1. Preserve the user's original intent completely — never change what they want.
+2. Use only what the raw prompt, the analyzed component and the user's answer provide.
+3. Write ONLY the body of this section — no header, no XML tag, no label; they are added for you.
+4. Do not repeat content that belongs to other sections ({other_components}).
+5. If there is no information for this section, output exactly NONE.
+6. Output ONLY the section body — no explanation, no preamble."""
+
+# Input limits — shared by the Streamlit app and the HTTP service.
+# Prompts longer than MAX_PROMPT_CHARS (up to MAX_DOCUMENT_CHARS) are analysed
+# in chunks, and later stages see a condensed context instead of the full text.
+MAX_PROMPT_CHARS = 6000
+MAX_DOCUMENT_CHARS = 60_000
+MAX_ANSWER_CHARS = 1000
+
+# Concurrent chunk analyses for one long document
+_ANALYSIS_WORKERS = 8
+
+_MODEL = "claude-haiku-4-5-20251001"
+
+# Hedged requests (HEDGE_REQUESTS=on): if a stage's first token has not arrived
+# by HEDGE_PERCENTILE of its recent first-token latency, a duplicate request is
+# sent, the first to finish (for a stream: to produce text) wins and the other
+# is cancelled. Hedges are capped
+# at HEDGE_BUDGET of all upstream requests made by this process.
+_HEDGE = os.getenv("HEDGE_REQUESTS", "off") == "on"
+_HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "98"))
+_HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+_HEDGE_MIN_SAMPLES = 20   # latency history a stage needs before it is hedged
+
+# Output token ceilings per pipeline stage
+_STAGE_MAX_TOKENS = {
+    "analysis": 512,
+    "questions": 1024,
+    "enhance": 2048,
+    "section": 512,
+    "questions_lazy": 384,
+    "example": 320,
+    "refine": 2048,
+}
+
+# Refinement turns kept verbatim after the first build; past this the
+# conversation collapses to the first turn plus the latest revision.
+_MAX_REFINE_TURNS = 6
+
 # ---------------------------------------------------------------------------
 # Helper
 # ---------------------------------------------------------------------------
 
+# Receives (stage, input_tokens, output_tokens) after every API call made in
+# the current context. Set via usage_listener(); None means usage is dropped.
+_usage_listener = contextvars.ContextVar("usage_listener", default=None)
+
+
+@contextmanager
+def usage_listener(callback):
+    """Report actual token usage of every _call() inside the block to callback."""
+    token = _usage_listener.set(callback)
+    try:
+        yield
+    finally:
+        _usage_listener.reset(token)
+
+
+# Model and per-stage max_tokens overrides for calls made in the current
+# context, so configurations can be compared side by side in one process
+# (tools/evaluate_configs.py). Set via call_settings(); None means defaults.
+_call_settings = contextvars.ContextVar("call_settings", default=None)
+
+
+@contextmanager
+def call_settings(model: str | None = None, max_tokens: dict | None = None):
+    """Run every _call() / _stream_call() inside the block on model, with max_tokens[stage] as ceilings."""
+    token = _call_settings.set({"model": model, "max_tokens": max_tokens or {}})
+    try:
+        yield
+    finally:
+        _call_settings.reset(token)
+
+
+def _model() -> str:
+    settings = _call_settings.get()
+    return (settings and settings["model"]) or _MODEL
+
+
+def _max_tokens(stage: str, max_tokens: int) -> int:
+    settings = _call_settings.get()
+    return settings["max_tokens"].get(stage, max_tokens) if settings else max_tokens
+
+
+def _report_usage(stage: str, input_tokens: int, output_tokens: int):
+    """Hand one call's actual usage to the usage listener and settle its quota reservation."""
+    quota.settle(input_tokens, output_tokens)
+    listener = _usage_listener.get()
+    if listener is not None:
+        listener(stage, input_tokens, output_tokens)
+
+
+def _call_estimate(system: str, user: str, max_tokens: int, history: list | None = None) -> int:
+    """Worst-case tokens of one call: what its quota reservation holds until the usage is known."""
+    turns = "".join(str(turn["content"]) for turn in history or ())
+    return estimate_tokens(system + user + turns) + max_tokens
+
 
 def _get_client() -> anthropic.Anthropic:
     # Check Streamlit secrets first (Streamlit Cloud deployments),
@@ -255,21 +445,426 @@ def _get_client() -> anthropic.Anthropic:
             "Local: add it to your .env file. "
             "Cloud: add it to Streamlit secrets."
         )
+    return _client_for(api_key)
+
+
+@lru_cache(maxsize=4)
+def _client_for(api_key: str) -> anthropic.Anthropic:
+    # One client per key and process: its HTTP connection pool is reused by
+    # every call instead of a new TLS handshake per request.
     return anthropic.Anthropic(api_key=api_key)
 
 
-def _call(system: str, user: str, max_tokens: int = 1024) -> str:
-    """Single API call to claude-haiku-4-5. Returns the text response."""
-    client = _get_client()
-    msg = client.messages.create(
-        model="claude-haiku-4-5-20251001",
-        max_tokens=max_tokens,
-        system=system,
-        messages=[{"role": "user", "content": user}],
+def _system_blocks(system: str) -> list:
+    """System prompt marked for prompt caching (ignored below the model's minimum length)."""
+    return [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+
+
+def _messages(user: str, history: list | None = None) -> list:
+    """
+    The request's messages: earlier turns, then user. The last earlier turn is
+    a prompt-cache breakpoint, so a follow-up only pays full price for user.
+    """
+    if not history:
+        return [{"role": "user", "content": user}]
+    *earlier, last = history
+    return [
+        *earlier,
+        {
+            "role": last["role"],
+            "content": [{"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}],
+        },
+        {"role": "user", "content": user},
+    ]
+
+
+def _input_tokens(usage) -> int:
+    """All input tokens of a call, including prompt-cache writes and reads."""
+    return (
+        usage.input_tokens
+        + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+        + (getattr(usage, "cache_read_input_tokens", 0) or 0)
     )
+
+
+class _Attempt:
+    """
+    One streamed request running on its own thread; cancel() drops its
+    connection. The attempt puts itself on done when it ends and, if given,
+    on started at its first text token (or its end, if none arrives). With
+    chunks, every text chunk is put there too, then None.
+    """
+
+    def __init__(
+        self,
+        client,
+        system: str,
+        user: str,
+        max_tokens: int,
+        done: queue.Queue,
+        history: list | None = None,
+        started: queue.Queue | None = None,
+        chunks: queue.Queue | None = None,
+    ):
+        # Set on the first text token — or when the attempt ends without one.
+        self.first_token = threading.Event()
+        self.first_token_ms = None
+        self.message = None
+        self.error = None
+        self.chunks = chunks
+        self._stream = None
+        self._cancelled = False
+        self._done = done
+        self._started_queue = started
+        self._started = time.perf_counter()
+        metrics.increment("upstream.requests")
+        threading.Thread(
+            target=self._run, args=(client, _model(), system, user, max_tokens, history), daemon=True,
+        ).start()
+
+    def _run(self, client, model: str, system: str, user: str, max_tokens: int, history: list | None):
+        try:
+            with client.messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                system=_system_blocks(system),
+                messages=_messages(user, history),
+            ) as stream:
+                self._stream = stream
+                for event in stream:
+                    if self._cancelled:
+                        return
+                    if event.type != "content_block_delta":
+                        continue
+                    if self.first_token_ms is None:
+                        self.first_token_ms = (time.perf_counter() - self._started) * 1000
+                        self._signal_start()
+                    text = getattr(event.delta, "text", None)
+                    if self.chunks is not None and text:
+                        self.chunks.put(text)
+                self.message = stream.get_final_message()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._signal_start()
+            if self.chunks is not None:
+                self.chunks.put(None)
+            self._done.put(self)
+
+    def _signal_start(self):
+        if not self.first_token.is_set():
+            self.first_token.set()
+            if self._started_queue is not None:
+                self._started_queue.put(self)
+
+    def cancel(self):
+        self._cancelled = True
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            except Exception:
+                pass
+
+    def usage(self):
+        """Tokens billed so far — input is known as soon as the response starts."""
+        if self.message is not None:
+            return self.message.usage
+        try:
+            return self._stream.current_message_snapshot.usage
+        except Exception:
+            return None
+
+
+def _hedge_delay_ms(stage: str) -> float | None:
+    if metrics.count("upstream.first_token_ms", stage=stage) < _HEDGE_MIN_SAMPLES:
+        return None
+    return metrics.percentile("upstream.first_token_ms", _HEDGE_PERCENTILE, stage=stage)
+
+
+def _hedge_allowed() -> bool:
+    return metrics.counter("upstream.hedges") + 1 <= _HEDGE_BUDGET * metrics.counter("upstream.requests")
+
+
+def _start_attempts(stage: str, start) -> list:
+    """[start()], plus a duplicate start() if the first is slow to its first token and the budget allows."""
+    attempts = [start()]
+    delay_ms = _hedge_delay_ms(stage)
+    if delay_ms is not None and not attempts[0].first_token.wait(delay_ms / 1000) and _hedge_allowed():
+        metrics.increment("upstream.hedges")
+        metrics.increment("upstream.hedges", stage=stage)
+        attempts.append(start())
+    return attempts
+
+
+def _cancel_losers(attempts: list, winner, stage: str):
+    """Cancel every attempt but winner and report the tokens they were billed for."""
+    for attempt in attempts:
+        if attempt is not winner:
+            attempt.cancel()
+    for attempt in attempts:
+        usage = attempt.usage()
+        if attempt is not winner and usage is not None:
+            _report_usage(f"{stage}_cancelled", _input_tokens(usage), usage.output_tokens)
+    if winner is not None and winner is not attempts[0]:
+        metrics.increment("upstream.hedge_wins", stage=stage)
+
+
+def _hedged_call(client, system: str, user: str, max_tokens: int, stage: str, deadline: Deadline | None = None):
+    """Run one request, hedging it with a duplicate if it is slow to start. Returns the Message."""
+    done = queue.Queue()
+    attempts = _start_attempts(stage, lambda: _Attempt(client, system, user, max_tokens, done))
+
+    winner, errors = None, []
+    try:
+        for _ in attempts:
+            finished = done.get(timeout=deadline.remaining() if deadline is not None else None)
+            if finished.error is None:
+                winner = finished
+                break
+            errors.append(finished.error)
+    except queue.Empty:
+        errors.insert(0, DeadlineExceeded(stage))
+    _cancel_losers(attempts, winner, stage)
+    if winner is None:
+        raise errors[0]
+    if winner.first_token_ms is not None:
+        metrics.observe("upstream.first_token_ms", winner.first_token_ms, stage=stage)
+    return winner.message
+
+
+def _hedged_stream_start(
+    client, system: str, user: str, max_tokens: int, stage: str, deadline: Deadline | None, history: list | None,
+) -> _Attempt:
+    """
+    Start a streamed request, hedged like _hedged_call(); the first attempt to
+    produce text wins and the other is cancelled. Returns the winner — read
+    its text from winner.chunks.
+    """
+    done, started = queue.Queue(), queue.Queue()
+    attempts = _start_attempts(
+        stage, lambda: _Attempt(client, system, user, max_tokens, done, history, started, queue.Queue()),
+    )
+    winner, errors = None, []
+    try:
+        for _ in attempts:
+            first = started.get(timeout=deadline.remaining() if deadline is not None else None)
+            if first.error is None:
+                winner = first
+                break
+            errors.append(first.error)
+    except queue.Empty:
+        errors.insert(0, DeadlineExceeded(stage))
+    _cancel_losers(attempts, winner, stage)
+    if winner is None:
+        raise errors[0]
+    if winner.first_token_ms is not None:
+        metrics.observe("upstream.first_token_ms", winner.first_token_ms, stage=stage)
+    return winner
+
+
+def _deadline_client(client: anthropic.Anthropic, stage: str, deadline: Deadline | None):
+    """The client with the stage's remaining time as timeout; the deadline replaces SDK retries."""
+    if deadline is None:
+        return client
+    return client.with_options(timeout=deadline.check(stage), max_retries=0)
+
+
+def _call(
+    system: str,
+    user: str,
+    max_tokens: int = 1024,
+    stage: str = "call",
+    deadline: Deadline | None = None,
+) -> str:
+    """
+    Single API call to claude-haiku-4-5 (hedged when enabled). Returns the text response.
+    With a deadline, raises DeadlineExceeded when the stage's time runs out.
+    The stage runs on the backend LLM_BACKEND / LLM_BACKEND_ROUTES route it to.
+    The call is charged to the current quota account, if any (tools/quota.py),
+    and raises QuotaExceeded when its worst case does not fit.
+    """
+    max_tokens = _max_tokens(stage, max_tokens)
+    with quota.metered(lambda: _call_estimate(system, user, max_tokens)):
+        backend = backend_for(stage)
+        if backend is not None:
+            return _backend_call(backend, system, user, max_tokens, stage, deadline)
+        return _anthropic_call(system, user, max_tokens, stage, deadline)
+
+
+def _anthropic_call(system: str, user: str, max_tokens: int, stage: str, deadline: Deadline | None) -> str:
+    """_call() on the Anthropic API."""
+    client = _deadline_client(_get_client(), stage, deadline)
+    started = time.perf_counter()
+    try:
+        with profiling.profile_call(stage):
+            if _HEDGE:
+                msg = _hedged_call(client, system, user, max_tokens, stage, deadline)
+            else:
+                metrics.increment("upstream.requests")
+                msg = client.messages.create(
+                    model=_model(),
+                    max_tokens=max_tokens,
+                    system=_system_blocks(system),
+                    messages=[{"role": "user", "content": user}],
+                )
+    except (anthropic.APITimeoutError, DeadlineExceeded):
+        if deadline is None:
+            raise
+        record_outcome(stage, "timeout")
+        raise DeadlineExceeded(stage) from None
+    if deadline is not None:
+        record_outcome(stage, "ok")
+    metrics.observe("upstream.latency_ms", (time.perf_counter() - started) * 1000, stage=stage)
+    if msg.usage is not None and getattr(msg.usage, "cache_read_input_tokens", 0):
+        metrics.increment("upstream.cache_read_tokens", msg.usage.cache_read_input_tokens, stage=stage)
+    if msg.usage is not None:
+        _report_usage(stage, _input_tokens(msg.usage), msg.usage.output_tokens)
     return msg.content[0].text.strip()
 
 
+def _backend_call(backend, system: str, user: str, max_tokens: int, stage: str, deadline: Deadline | None) -> str:
+    """_call() on a non-Anthropic backend (see tools/llm_backends.py)."""
+    timeout = deadline.check(stage) if deadline is not None else None
+    started = time.perf_counter()
+    metrics.increment("upstream.requests", backend=backend.name)
+    try:
+        with profiling.profile_call(stage):
+            text, input_tokens, output_tokens = backend.complete(system, user, max_tokens, timeout)
+    except TimeoutError:
+        if deadline is None:
+            raise
+        record_outcome(stage, "timeout")
+        raise DeadlineExceeded(stage) from None
+    if deadline is not None:
+        record_outcome(stage, "ok")
+    metrics.observe("upstream.latency_ms", (time.perf_counter() - started) * 1000, stage=stage, backend=backend.name)
+    _report_usage(stage, input_tokens, output_tokens)
+    return text
+
+
+def _backend_stream(
+    backend,
+    system: str,
+    user: str,
+    max_tokens: int,
+    stage: str,
+    deadline: Deadline | None,
+    history: list | None = None,
+):
+    """_stream_call() on a non-Anthropic backend."""
+    timeout = deadline.check(stage) if deadline is not None else None
+    usage = {}
+    outcome = "ok"
+    started = time.perf_counter()
+    metrics.increment("upstream.requests", backend=backend.name)
+    chunks = backend.stream(system, user, max_tokens, timeout, usage=usage, history=history)
+    try:
+        with profiling.section(f"api.{stage}"):
+            for text in chunks:
+                yield text
+                if deadline is not None and deadline.expired():
+                    outcome = "partial"
+                    break
+    except TimeoutError:
+        if deadline is None:
+            raise
+        record_outcome(stage, "timeout")
+        raise DeadlineExceeded(stage) from None
+    finally:
+        chunks.close()
+    if deadline is not None:
+        record_outcome(stage, outcome)
+    metrics.observe("upstream.latency_ms", (time.perf_counter() - started) * 1000, stage=stage, backend=backend.name)
+    if usage:
+        _report_usage(stage, usage["input_tokens"], usage["output_tokens"])
+
+
+def _stream_call(
+    system: str,
+    user: str,
+    max_tokens: int = 1024,
+    stage: str = "call",
+    deadline: Deadline | None = None,
+    history: list | None = None,
+):
+    """
+    Streaming variant of _call(). Yields text chunks as they arrive. With a
+    deadline, the stream stops early once it expires — the chunks already
+    yielded are the (partial) result — and DeadlineExceeded is raised only if
+    no text arrived in time. history holds earlier turns of a conversation
+    (role/content dicts) to continue; it is prompt-cached up to its last turn.
+    Charged to the current quota account like _call().
+    """
+    max_tokens = _max_tokens(stage, max_tokens)
+    with quota.metered(lambda: _call_estimate(system, user, max_tokens, history)):
+        backend = backend_for(stage)
+        if backend is not None:
+            yield from _backend_stream(backend, system, user, max_tokens, stage, deadline, history)
+        else:
+            yield from _anthropic_stream(system, user, max_tokens, stage, deadline, history)
+
+
+def _anthropic_stream(
+    system: str,
+    user: str,
+    max_tokens: int,
+    stage: str,
+    deadline: Deadline | None,
+    history: list | None,
+):
+    """_stream_call() on the Anthropic API (hedged when enabled)."""
+    client = _deadline_client(_get_client(), stage, deadline)
+    outcome = "ok"
+    started = time.perf_counter()
+    try:
+        # Timed as a section of the consuming run only: a generator may be stepped
+        # from several threads, so it does not get a sampled run of its own.
+        with profiling.section(f"api.{stage}"):
+            if _HEDGE:
+                winner = _hedged_stream_start(client, system, user, max_tokens, stage, deadline, history)
+                try:
+                    for text in iter(winner.chunks.get, None):
+                        yield text
+                        if deadline is not None and deadline.expired():
+                            outcome = "partial"
+                            break
+                finally:
+                    if outcome != "ok" or winner.message is None:
+                        winner.cancel()
+                if outcome == "ok" and winner.error is not None:
+                    raise winner.error
+                usage = winner.usage()
+            else:
+                metrics.increment("upstream.requests")
+                with client.messages.stream(
+                    model=_model(),
+                    max_tokens=max_tokens,
+                    system=_system_blocks(system),
+                    messages=_messages(user, history),
+                ) as stream:
+                    for text in stream.text_stream:
+                        yield text
+                        if deadline is not None and deadline.expired():
+                            outcome = "partial"
+                            break
+                    usage = (
+                        stream.get_final_message().usage if outcome == "ok"
+                        else stream.current_message_snapshot.usage
+                    )
+    except (anthropic.APITimeoutError, DeadlineExceeded):
+        if deadline is None:
+            raise
+        record_outcome(stage, "timeout")
+        raise DeadlineExceeded(stage) from None
+    if deadline is not None:
+        record_outcome(stage, outcome)
+    metrics.observe("upstream.latency_ms", (time.perf_counter() - started) * 1000, stage=stage)
+    if usage is not None and getattr(usage, "cache_read_input_tokens", 0):
+        metrics.increment("upstream.cache_read_tokens", usage.cache_read_input_tokens, stage=stage)
+    if usage is not None:
+        _report_usage(stage, _input_tokens(usage), usage.output_tokens)
+
+
 def _parse_json(raw: str, fallback):
     """Strip markdown fences and parse JSON. Returns fallback on failure."""
     text = raw.strip()
@@ -283,16 +878,23 @@ def _parse_json(raw: str, fallback):
     except json.JSONDecodeError:
         return fallback
 
+
+def is_long_prompt(raw_prompt: str) -> bool:
+    return len(raw_prompt) > MAX_PROMPT_CHARS
+
+
+def _prompt_text(raw_prompt: str, components: dict | None = None) -> str:
+    """The prompt as later stages see it — condensed when it is a long document."""
+    return compact_context(raw_prompt, components) if is_long_prompt(raw_prompt) else raw_prompt
+
 # ---------------------------------------------------------------------------
-# Public API
+# Request builders
+# Each returns the (system, user) message pair for one pipeline stage, so the
+# exact same text can be sent to the API or sized up front by the estimator.
 # ---------------------------------------------------------------------------
 
 
-def analyze_prompt_components(raw_prompt: str, target_llm: str) -> dict:
-    """
-    Detect which framework components are present in the raw prompt.
-    Returns a dict keyed by that LLM's component names, each value: str | None.
-    """
+def _analysis_request(raw_prompt: str, target_llm: str, part: str = "") -> tuple:
     profile = LLM_PROFILES[target_llm]
     components = profile["components"]
     labels = profile["component_labels"]
@@ -301,15 +903,222 @@ def analyze_prompt_components(raw_prompt: str, target_llm: str) -> dict:
         f'  "{c}": {labels[c]}' for c in components
     )
 
+    heading = f"Raw prompt to analyze ({part}):" if part else "Raw prompt to analyze:"
     user_msg = (
         f"Target LLM: {target_llm}\n\n"
         f"Component keys to detect:\n{component_descriptions}\n\n"
-        f"Raw prompt to analyze:\n{raw_prompt}"
+        f"{heading}\n{raw_prompt}"
+    )
+    return _ANALYSIS_SYSTEM, user_msg
+
+
+def _analysis_requests(raw_prompt: str, target_llm: str) -> list:
+    """One analysis request, or one per chunk of a long document."""
+    if not is_long_prompt(raw_prompt):
+        return [_analysis_request(raw_prompt, target_llm)]
+    chunks = split_document(raw_prompt)
+    return [
+        _analysis_request(chunk, target_llm, part=f"part {i} of {len(chunks)} of a longer document")
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+
+def _questions_request(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    max_questions: int = 4,
+) -> tuple:
+    profile = LLM_PROFILES[target_llm]
+    present = [k for k, v in components.items() if v]
+    missing = [k for k, v in components.items() if not v]
+
+    # Static per profile (no user data), so its prompt cache entry is shared.
+    system = _QUESTIONS_SYSTEM.format(
+        llm=target_llm,
+        max_q=max_questions,
+        special=profile["special"],
+    )
+
+    user_msg = (
+        f"Raw prompt: {_prompt_text(raw_prompt, components)}\n\n"
+        f"Missing/weak components: {', '.join(missing)}\n\n"
+        f"Already present (do not ask about these): {', '.join(present) if present else 'none'}"
+    )
+    return system, user_msg
+
+
+def _questions_lazy_request(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    max_questions: int = 4,
+) -> tuple:
+    profile = LLM_PROFILES[target_llm]
+    present = [k for k, v in components.items() if v]
+    missing = [k for k, v in components.items() if not v]
+
+    system = _QUESTIONS_LAZY_SYSTEM.format(
+        llm=target_llm,
+        max_q=max_questions,
+        special=profile["special"],
+    )
+    user_msg = (
+        f"Raw prompt: {_prompt_text(raw_prompt, components)}\n\n"
+        f"Missing/weak components: {', '.join(missing)}\n\n"
+        f"Already present (do not ask about these): {', '.join(present) if present else 'none'}"
+    )
+    return system, user_msg
+
+
+def _example_request(raw_prompt: str, target_llm: str, question: dict) -> tuple:
+    system = _EXAMPLE_SYSTEM.format(llm=target_llm, special=LLM_PROFILES[target_llm]["special"])
+    user_msg = (
+        f"Raw prompt: {_prompt_text(raw_prompt)}\n\n"
+        f"Component: {question.get('component', '')}\n"
+        f"Question: {question.get('question', '')}"
+    )
+    return system, user_msg
+
+
+def _enhance_system(target_llm: str) -> str:
+    profile = LLM_PROFILES[target_llm]
+    # System prompt contains ONLY static/internal data — no user input.
+    return _ENHANCE_SYSTEM.format(
+        llm=target_llm,
+        special=profile["special"],
+        components=" → ".join(profile["components"]),
+    )
+
+
+def _refine_message(instruction: str) -> str:
+    return (
+        f"Revise the enhanced prompt above as follows:\n{instruction.strip()}\n\n"
+        "Keep everything else unchanged and keep following the structure and style "
+        "requirements. Return ONLY the full revised prompt, with no commentary."
+    )
+
+
+def _enhance_request(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    user_answers: dict,
+) -> tuple:
+    system = _enhance_system(target_llm)
+
+    # All user-controlled content goes here — in the user turn only.
+    components_json = json.dumps(components, indent=2)
+    answers_json = json.dumps(user_answers, indent=2) if user_answers else "{}"
+    user_msg = (
+        f"Enhance this prompt for {target_llm}.\n\n"
+        f"RAW PROMPT:\n{_prompt_text(raw_prompt)}\n\n"
+        f"ANALYZED COMPONENTS (what was found in the original):\n{components_json}\n\n"
+        f"ADDITIONAL CONTEXT FROM USER ANSWERS:\n{answers_json}"
     )
+    return system, user_msg
 
-    raw = _call(_ANALYSIS_SYSTEM, user_msg, max_tokens=512)
+
+def _section_request(
+    raw_prompt: str,
+    target_llm: str,
+    component: str,
+    found: str | None,
+    answer: str | None,
+) -> tuple:
+    profile = LLM_PROFILES[target_llm]
+
+    # Same split as _enhance_request: static profile data in the system
+    # prompt, everything user-controlled in the user turn.
+    system = _SECTION_SYSTEM.format(
+        llm=target_llm,
+        label=profile["component_labels"][component],
+        special=profile["special"],
+        other_components=", ".join(c for c in profile["components"] if c != component),
+    )
+    user_msg = (
+        f"Write the {component} section for {target_llm}.\n\n"
+        f"RAW PROMPT:\n{_prompt_text(raw_prompt)}\n\n"
+        f"FOUND IN THE ORIGINAL:\n{found or 'nothing'}\n\n"
+        f"USER ANSWER:\n{answer or 'none'}"
+    )
+    return system, user_msg
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+
+def validate_inputs(raw_prompt: str, target_llm: str, user_answers: dict | None = None):
+    """Raise ValueError with a user-facing message if the inputs are not acceptable."""
+    if target_llm not in LLM_PROFILES:
+        raise ValueError(f"Unknown target LLM. Choose one of: {', '.join(LLM_PROFILES)}.")
+    if not isinstance(raw_prompt, str) or not raw_prompt.strip():
+        raise ValueError("Please enter a prompt before continuing.")
+    if len(raw_prompt) > MAX_DOCUMENT_CHARS:
+        raise ValueError(f"Prompt is too long (max {MAX_DOCUMENT_CHARS:,} characters).")
+    for component, answer in (user_answers or {}).items():
+        if not isinstance(answer, str):
+            raise ValueError(f"Answer for '{component}' must be text.")
+        if len(answer) > MAX_ANSWER_CHARS:
+            raise ValueError(f"Answer for '{component}' is too long (max {MAX_ANSWER_CHARS:,} characters).")
+
+
+def safe_error_message(e: Exception) -> str:
+    """Return a user-safe error message that doesn't expose internal details."""
+    if isinstance(e, DeadlineExceeded):
+        return f"{e} Please try again."
+    if isinstance(e, quota.QuotaExceeded):
+        return str(e)
+    msg = str(e)
+    if "api_key" in msg.lower() or "ANTHROPIC_API_KEY" in msg:
+        return "API key not configured. Contact the administrator."
+    if "rate_limit" in msg.lower() or "429" in msg:
+        return "The AI service is busy. Please try again in a few seconds."
+    if "overloaded" in msg.lower() or "529" in msg:
+        return "The AI service is temporarily overloaded. Please try again shortly."
+    return "Something went wrong while processing your request. Please try again."
+
+
+def estimate_stage_tokens(
+    stage: str,
+    raw_prompt: str,
+    target_llm: str,
+    components: dict | None = None,
+    user_answers: dict | None = None,
+    question: dict | None = None,
+) -> int:
+    """
+    Predict the worst-case token cost of one pipeline stage without calling the API:
+    the locally estimated input tokens plus that stage's max_tokens ceiling.
+    stage is one of "analysis", "questions", "questions_lazy", "example"
+    (needs question), "enhance".
+    """
+    if stage == "analysis":
+        # A long document costs one analysis call per chunk.
+        return sum(
+            estimate_tokens(system) + estimate_tokens(user_msg) + _STAGE_MAX_TOKENS["analysis"]
+            for system, user_msg in _analysis_requests(raw_prompt, target_llm)
+        )
+    if stage == "questions":
+        system, user_msg = _questions_request(raw_prompt, target_llm, components or {})
+    elif stage == "questions_lazy":
+        system, user_msg = _questions_lazy_request(raw_prompt, target_llm, components or {})
+    elif stage == "example":
+        system, user_msg = _example_request(raw_prompt, target_llm, question or {})
+    elif stage == "enhance":
+        system, user_msg = _enhance_request(raw_prompt, target_llm, components or {}, user_answers or {})
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+    return estimate_tokens(system) + estimate_tokens(user_msg) + _STAGE_MAX_TOKENS[stage]
+
+
+def _analyze_one(system: str, user_msg: str, components: list, deadline: Deadline | None = None) -> dict:
+    raw = _call(system, user_msg, max_tokens=_STAGE_MAX_TOKENS["analysis"], stage="analysis", deadline=deadline)
     fallback = {c: None for c in components}
     result = _parse_json(raw, fallback)
+    if not isinstance(result, dict):
+        result = fallback
 
     # Ensure all expected keys are present
     for c in components:
@@ -318,39 +1127,84 @@ def analyze_prompt_components(raw_prompt: str, target_llm: str) -> dict:
     return result
 
 
+def analyze_prompt_components(raw_prompt: str, target_llm: str, deadline: Deadline | None = None) -> dict:
+    """
+    Detect which framework components are present in the raw prompt.
+    Returns a dict keyed by that LLM's component names, each value: str | None.
+
+    A long document (over MAX_PROMPT_CHARS) is split on structural boundaries,
+    its chunks are analysed concurrently, and the per-chunk results are merged
+    locally with duplicates removed. Chunks that miss the deadline are left
+    out of the merge; DeadlineExceeded is raised only if every chunk missed it.
+
+    A single-request prompt that is a near-duplicate of one analysed before
+    (see tools/near_duplicates.py) reuses that analysis with no API call.
+    """
+    components = LLM_PROFILES[target_llm]["components"]
+    requests = _analysis_requests(raw_prompt, target_llm)
+    if len(requests) == 1:
+        reused = reusable_components(raw_prompt, target_llm)
+        if reused is not None:
+            return {c: reused.get(c) for c in components}
+        result = _analyze_one(*requests[0], components, deadline)
+        remember_components(raw_prompt, target_llm, result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=min(len(requests), _ANALYSIS_WORKERS)) as pool:
+        # Each worker runs in a copy of this context so usage_listener()
+        # still sees every chunk's usage.
+        futures = [
+            pool.submit(contextvars.copy_context().run, _analyze_one, system, user_msg, components, deadline)
+            for system, user_msg in requests
+        ]
+        results, missed = [], None
+        for f in futures:
+            try:
+                results.append(f.result())
+            except DeadlineExceeded as e:
+                missed = e
+    if not results:
+        raise missed
+    if missed is not None:
+        record_outcome("analysis", "partial")
+    return merge_components(components, results)
+
+
 def generate_clarifying_questions(
     raw_prompt: str,
     target_llm: str,
     components: dict,
     max_questions: int = 4,
+    lazy_examples: bool = False,
+    deadline: Deadline | None = None,
 ) -> list:
     """
     Generate up to max_questions targeted clarifying questions for missing/weak
     components. Each question includes an AI-inferred example answer.
 
+    With lazy_examples=True the call skips the inferred examples (a much
+    smaller, faster response) and every inferred_example is "" — fetch each one
+    on demand with generate_inferred_example() / stream_inferred_example().
+
+    Questions are optional: if the deadline leaves no time for them, none are
+    asked ([]) and the flow goes straight on to the enhance stage.
+
     Returns list of dicts: {component, question, inferred_example, placeholder}
     """
-    profile = LLM_PROFILES[target_llm]
-    present = [k for k, v in components.items() if v]
-    missing = [k for k, v in components.items() if not v]
-
-    if not missing:
+    if not any(not v for v in components.values()):
         return []
 
-    system = _QUESTIONS_SYSTEM.format(
-        llm=target_llm,
-        max_q=max_questions,
-        special=profile["special"],
-        present_components=", ".join(present) if present else "none",
-    )
+    if lazy_examples:
+        system, user_msg = _questions_lazy_request(raw_prompt, target_llm, components, max_questions)
+        stage = "questions_lazy"
+    else:
+        system, user_msg = _questions_request(raw_prompt, target_llm, components, max_questions)
+        stage = "questions"
 
-    user_msg = (
-        f"Raw prompt: {raw_prompt}\n\n"
-        f"Missing/weak components: {', '.join(missing)}\n\n"
-        f"Already present: {', '.join(present) if present else 'none'}"
-    )
-
-    raw = _call(system, user_msg, max_tokens=1024)
+    try:
+        raw = _call(system, user_msg, max_tokens=_STAGE_MAX_TOKENS[stage], stage=stage, deadline=deadline)
+    except DeadlineExceeded:
+        return []
     result = _parse_json(raw, [])
 
     # Validate structure
@@ -366,37 +1220,182 @@ def generate_clarifying_questions(
     return validated[:max_questions]
 
 
+def generate_inferred_example(
+    raw_prompt: str, target_llm: str, question: dict, deadline: Deadline | None = None,
+) -> str:
+    """Infer a ready-to-accept answer for one question from generate_clarifying_questions()."""
+    system, user_msg = _example_request(raw_prompt, target_llm, question)
+    return _call(system, user_msg, max_tokens=_STAGE_MAX_TOKENS["example"], stage="example", deadline=deadline)
+
+
+def stream_inferred_example(raw_prompt: str, target_llm: str, question: dict, deadline: Deadline | None = None):
+    """Same as generate_inferred_example(), but yields the answer in text chunks."""
+    system, user_msg = _example_request(raw_prompt, target_llm, question)
+    yield from _stream_call(
+        system, user_msg, max_tokens=_STAGE_MAX_TOKENS["example"], stage="example", deadline=deadline,
+    )
+
+
 def build_enhanced_prompt(
     raw_prompt: str,
     target_llm: str,
     components: dict,
     user_answers: dict,
+    deadline: Deadline | None = None,
 ) -> str:
     """
     Build the final enhanced prompt optimized for target_llm.
     Merges raw prompt analysis + user answers into the LLM-specific format.
-    Returns only the final prompt string.
+    Returns only the final prompt string. Raises DeadlineExceeded when out of
+    time — callers fall back to render_instant_prompt().
 
     Security note: user-controlled content (raw_prompt, user_answers) is placed
     ONLY in the user message — never in the system prompt — to prevent format
     string injection and system prompt contamination.
     """
-    profile = LLM_PROFILES[target_llm]
+    system, user_msg = _enhance_request(raw_prompt, target_llm, components, user_answers)
+    return _call(system, user_msg, max_tokens=_STAGE_MAX_TOKENS["enhance"], stage="enhance", deadline=deadline)
 
-    # System prompt contains ONLY static/internal data — no user input.
-    system = _ENHANCE_SYSTEM.format(
-        llm=target_llm,
-        special=profile["special"],
-        components=" → ".join(profile["components"]),
+
+def stream_enhanced_prompt(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    user_answers: dict,
+    deadline: Deadline | None = None,
+):
+    """
+    Same as build_enhanced_prompt(), but yields the prompt in text chunks as it
+    is generated. If the deadline expires mid-stream the text so far is the result.
+    """
+    system, user_msg = _enhance_request(raw_prompt, target_llm, components, user_answers)
+    yield from _stream_call(
+        system, user_msg, max_tokens=_STAGE_MAX_TOKENS["enhance"], stage="enhance", deadline=deadline,
     )
 
-    # All user-controlled content goes here — in the user turn only.
-    components_json = json.dumps(components, indent=2)
-    answers_json = json.dumps(user_answers, indent=2) if user_answers else "{}"
-    user_msg = (
-        f"Enhance this prompt for {target_llm}.\n\n"
-        f"RAW PROMPT:\n{raw_prompt}\n\n"
-        f"ANALYZED COMPONENTS (what was found in the original):\n{components_json}\n\n"
-        f"ADDITIONAL CONTEXT FROM USER ANSWERS:\n{answers_json}"
+
+def refine_conversation(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    user_answers: dict,
+    enhanced_prompt: str,
+) -> list:
+    """The enhance exchange that produced enhanced_prompt, as a conversation to refine."""
+    _, user_msg = _enhance_request(raw_prompt, target_llm, components, user_answers)
+    return [
+        {"role": "user", "content": user_msg},
+        {"role": "assistant", "content": enhanced_prompt},
+    ]
+
+
+def stream_refined_prompt(
+    target_llm: str,
+    conversation: list,
+    instruction: str,
+    deadline: Deadline | None = None,
+):
+    """
+    Revise the last prompt in conversation (from refine_conversation()) by a
+    follow-up instruction such as "shorter" or "add examples", yielding the
+    full revised prompt in text chunks. The system prompt and the conversation
+    so far are sent as a cached prefix, so a turn costs the instruction plus
+    cache reads. Add the result with add_refinement() before the next turn.
+    """
+    if not isinstance(instruction, str) or not instruction.strip():
+        raise ValueError("Please describe how to refine the prompt.")
+    if len(instruction) > MAX_ANSWER_CHARS:
+        raise ValueError(f"Instruction is too long (max {MAX_ANSWER_CHARS:,} characters).")
+    yield from _stream_call(
+        _enhance_system(target_llm),
+        _refine_message(instruction),
+        max_tokens=_STAGE_MAX_TOKENS["refine"],
+        stage="refine",
+        deadline=deadline,
+        history=conversation,
+    )
+
+
+def estimate_refine_tokens(target_llm: str, conversation: list, instruction: str) -> int:
+    """Worst-case token cost of one refinement turn (as if nothing were cached yet)."""
+    return (
+        estimate_tokens(_enhance_system(target_llm))
+        + sum(estimate_tokens(turn["content"]) for turn in conversation)
+        + estimate_tokens(_refine_message(instruction))
+        + _STAGE_MAX_TOKENS["refine"]
     )
-    return _call(system, user_msg, max_tokens=2048)
+
+
+def add_refinement(conversation: list, instruction: str, revised_prompt: str) -> list:
+    """conversation continued by one refinement turn (a new list)."""
+    turns = [
+        *conversation,
+        {"role": "user", "content": _refine_message(instruction)},
+        {"role": "assistant", "content": revised_prompt},
+    ]
+    if len(turns) > 2 + 2 * _MAX_REFINE_TURNS:
+        # Keeps the request small; the next turn writes a fresh cache entry.
+        turns = [turns[0], turns[-1]]
+    return turns
+
+
+def warmup() -> dict:
+    """
+    Pay the cold-start costs once per process, before the first user does:
+    create the pooled API client, render every profile's request templates,
+    and open one connection per profile with a free count_tokens call.
+
+    Never raises. Returns {"seconds": float, "errors": [str]}.
+    """
+    started = time.perf_counter()
+    sample = "Write a short announcement for our new product."
+    rendered = {}
+    for llm, profile in LLM_PROFILES.items():
+        components = {c: None for c in profile["components"]}
+        question = {"component": profile["components"][0], "question": "What should it cover?"}
+        rendered[llm] = {
+            "analysis": _analysis_request(sample, llm),
+            "questions": _questions_request(sample, llm, components),
+            "questions_lazy": _questions_lazy_request(sample, llm, components),
+            "example": _example_request(sample, llm, question),
+            "enhance": _enhance_request(sample, llm, components, {}),
+            "section": _section_request(sample, llm, profile["components"][0], None, None),
+        }
+        for system, user_msg in rendered[llm].values():
+            estimate_tokens(system + user_msg)
+
+    errors = []
+    try:
+        backends = configured_backends()
+    except ValueError as e:   # a misspelled LLM_BACKEND / LLM_BACKEND_ROUTES
+        return {"seconds": round(time.perf_counter() - started, 3), "errors": [str(e)]}
+    for name in backends - {ANTHROPIC}:
+        try:
+            backend_named(name).warmup()
+        except Exception as e:
+            errors.append(f"{name} backend: {type(e).__name__}")
+    if ANTHROPIC not in backends:
+        return {"seconds": round(time.perf_counter() - started, 3), "errors": errors}
+
+    try:
+        client = _get_client()
+    except Exception as e:
+        return {"seconds": round(time.perf_counter() - started, 3), "errors": errors + [safe_error_message(e)]}
+
+    def connect(llm: str):
+        system, user_msg = rendered[llm]["enhance"]
+        client.messages.count_tokens(
+            model=_MODEL,
+            system=_system_blocks(system),
+            messages=[{"role": "user", "content": user_msg}],
+        )
+
+    with usage_listener(TokenLedger().record):
+        with ThreadPoolExecutor(max_workers=len(LLM_PROFILES)) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, connect, llm) for llm in LLM_PROFILES]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(safe_error_message(e))
+    return {"seconds": round(time.perf_counter() - started, 3), "errors": list(dict.fromkeys(errors))}
@@ -0,0 +1,167 @@
+"""Sectioned enhancement: one short API call per component, assembled locally.
+
+Each section is stored with a fingerprint of the inputs it was generated from,
+so editing a single answer only regenerates that component's section.
+"""
+
+import contextvars
+import hashlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from tools.assemble_prompt import assemble_prompt
+from tools.enhance_prompt import (
+    LLM_PROFILES,
+    _STAGE_MAX_TOKENS,
+    _call,
+    _section_request,
+)
+from tools.deadline import Deadline, DeadlineExceeded, record_outcome
+from tools.token_budget import estimate_tokens
+
+_NONE_MARKER = "NONE"
+
+# A header or tag the model added despite being told not to, on its own line.
+_WRAPPER_LINE = re.compile(r"^\s*(</?[a-z_]+>|#{1,6} .*|\*\*[^*]+\*\*:?)\s*$")
+
+
+def _fingerprint(raw_prompt: str, target_llm: str, component: str, found, answer) -> str:
+    payload = json.dumps([target_llm, raw_prompt, component, found, answer])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _clean_section(text: str) -> str:
+    """Drop a leading/trailing header or tag line and the NONE marker."""
+    lines = text.strip().splitlines()
+    if lines and _WRAPPER_LINE.match(lines[0]):
+        lines = lines[1:]
+    if lines and _WRAPPER_LINE.match(lines[-1]):
+        lines = lines[:-1]
+    body = "\n".join(lines).strip()
+    return "" if body == _NONE_MARKER else body
+
+
+def _section_inputs(target_llm: str, components: dict, user_answers: dict) -> list:
+    """(component, found, answer) for every component with any information, in profile order."""
+    inputs = []
+    for c in LLM_PROFILES[target_llm]["components"]:
+        found = components.get(c)
+        answer = (user_answers or {}).get(c)
+        if found or answer:
+            inputs.append((c, found, answer))
+    return inputs
+
+
+def stale_sections(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    user_answers: dict,
+    sections: dict | None = None,
+) -> list:
+    """Components whose stored section is missing or was built from different inputs."""
+    sections = sections or {}
+    stale = []
+    for c, found, answer in _section_inputs(target_llm, components, user_answers):
+        stored = sections.get(c)
+        if not stored or stored["fingerprint"] != _fingerprint(raw_prompt, target_llm, c, found, answer):
+            stale.append(c)
+    return stale
+
+
+def estimate_sections_tokens(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    user_answers: dict,
+    sections: dict | None = None,
+) -> int:
+    """Worst-case token cost of bringing sections up to date (stale ones only)."""
+    stale = set(stale_sections(raw_prompt, target_llm, components, user_answers, sections))
+    total = 0
+    for c, found, answer in _section_inputs(target_llm, components, user_answers):
+        if c in stale:
+            system, user_msg = _section_request(raw_prompt, target_llm, c, found, answer)
+            total += estimate_tokens(system) + estimate_tokens(user_msg) + _STAGE_MAX_TOKENS["section"]
+    return total
+
+
+def _generate_section(
+    raw_prompt: str, target_llm: str, component: str, found, answer, deadline: Deadline | None = None,
+) -> str | None:
+    """The section's text, or None if it missed the deadline."""
+    system, user_msg = _section_request(raw_prompt, target_llm, component, found, answer)
+    try:
+        text = _call(system, user_msg, max_tokens=_STAGE_MAX_TOKENS["section"], stage="section", deadline=deadline)
+    except DeadlineExceeded:
+        return None
+    return _clean_section(text)
+
+
+def build_enhanced_prompt_sectioned(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    user_answers: dict,
+    sections: dict | None = None,
+    parallel: bool = False,
+    deadline: Deadline | None = None,
+) -> tuple:
+    """
+    Build the enhanced prompt one component at a time, reusing every stored
+    section whose inputs are unchanged.
+
+    sections is the dict returned by a previous call (or None). With
+    parallel=True every stale section is generated by its own concurrent call,
+    so wall time is that of the slowest section rather than the sum.
+
+    Returns (enhanced_prompt, sections) where sections maps component ->
+    {"fingerprint": str, "text": str}; components that no longer have any
+    information are dropped from it.
+
+    A section that misses the deadline is filled in with its raw inputs
+    (answer, else what the analysis found) and left out of the returned
+    sections, so the next build generates it again.
+    """
+    previous = sections or {}
+    updated = {}
+    todo = []
+    for c, found, answer in _section_inputs(target_llm, components, user_answers):
+        fingerprint = _fingerprint(raw_prompt, target_llm, c, found, answer)
+        stored = previous.get(c)
+        if stored and stored["fingerprint"] == fingerprint:
+            updated[c] = stored
+        else:
+            todo.append((c, found, answer, fingerprint))
+
+    if parallel and len(todo) > 1:
+        with ThreadPoolExecutor(max_workers=len(todo)) as pool:
+            # Each worker runs in a copy of this context so usage_listener()
+            # still sees every section's usage.
+            futures = {
+                c: pool.submit(
+                    contextvars.copy_context().run,
+                    _generate_section, raw_prompt, target_llm, c, found, answer, deadline,
+                )
+                for c, found, answer, _ in todo
+            }
+            texts = {c: f.result() for c, f in futures.items()}
+    else:
+        texts = {
+            c: _generate_section(raw_prompt, target_llm, c, found, answer, deadline)
+            for c, found, answer, _ in todo
+        }
+
+    fallback = {}
+    for c, found, answer, fingerprint in todo:
+        if texts[c] is None:
+            fallback[c] = answer or found
+        else:
+            updated[c] = {"fingerprint": fingerprint, "text": texts[c]}
+    if fallback:
+        record_outcome("section", "fallback")
+
+    bodies = {**{c: s["text"] for c, s in updated.items()}, **fallback}
+    prompt = assemble_prompt(target_llm, bodies)
+    return prompt, updated
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Offline quality-vs-latency evaluation of pipeline configurations.
+
+    python -m tools.evaluate_configs [--configs configs.json] [--corpus prompts.jsonl]
+                                     [--profiles Claude,ChatGPT] [--judge] [--workers 8]
+
+Every configuration runs the full pipeline — analysis, questions (every
+suggestion accepted as the answer), enhancement and lint repair — on every
+prompt of a fixed corpus, for each target profile. All (configuration, prompt)
+runs share one thread pool, so configurations execute concurrently.
+
+A configuration is a JSON object; every key but "name" is optional:
+
+    {"name": "short", "model": "claude-haiku-4-5-20251001",
+     "max_tokens": {"enhance": 1024, "questions": 512},
+     "max_questions": 2, "questions_mode": "lazy", "enhance_mode": "single",
+     "input_usd_per_mtok": 1.0, "output_usd_per_mtok": 5.0}
+
+"model" applies to the Anthropic backend; LLM_BACKEND / LLM_BACKEND_ROUTES
+route stages as usual. Without --configs a built-in set around the production
+defaults is used. The corpus is JSONL of {"raw_prompt", "target_llm"?}; items
+without a target run for every --profiles entry.
+
+Per run it records wall time, tokens and cost, and scores the output:
+
+- rules: share of the profile's lint rules (tools/lint_prompt.py) the model's
+  enhanced prompt passes before repair; "unresolved" counts rules still
+  violated after repair — what the user would have got;
+- judge (--judge): a 1-10 rating of the final prompt from the "judge" stage,
+  normalised to 0-1. Route it with LLM_BACKEND_ROUTES=judge=...; its tokens are
+  reported separately and never count towards a configuration's cost.
+
+quality is the mean of the available scores; a failed run scores 0. Near-
+duplicate analysis reuse is switched off so every run pays for its analysis.
+The report lists each configuration's quality, p50/p95 latency, tokens and
+cost per prompt, marks the Pareto front (no other configuration is at least as
+good on quality, p50 latency and cost and better on one) and recommends the
+cheapest, then fastest, front configuration within --tolerance of the best
+quality. It is written to --output as JSON and Markdown; the table is printed.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from tools.enhance_prompt import (
+    _MODEL,
+    _STAGE_MAX_TOKENS,
+    LLM_PROFILES,
+    _call,
+    _parse_json,
+    analyze_prompt_components,
+    build_enhanced_prompt,
+    call_settings,
+    generate_clarifying_questions,
+    generate_inferred_example,
+    usage_listener,
+)
+from tools.enhance_sections import build_enhanced_prompt_sectioned
+from tools.lint_prompt import _RULES, lint_prompt, repair_prompt
+from tools.quota import usd_per_mtok
+from tools.token_budget import TokenLedger
+
+_DEFAULT_OUTPUT_DIR = os.path.join(".tmp", "eval")
+
+# A fixed corpus: short and long, vague and specific, one per typical use.
+CORPUS = (
+    {"raw_prompt": "write a cold email to investors about our seed round"},
+    {"raw_prompt": "Summarise this quarter's support tickets and tell me what to fix first."},
+    {"raw_prompt": "explain kubernetes to a new backend developer"},
+    {"raw_prompt": "You are a nutritionist. Make me a 7-day vegetarian meal plan under 2000 kcal a day, as a table."},
+    {"raw_prompt": "what are the latest findings on intermittent fasting and longevity since 2022"},
+    {"raw_prompt": "Review my Python function for bugs and suggest a cleaner version. Keep the public signature."},
+    {"raw_prompt": "plan a 3 day team offsite in Lisbon for 12 people, budget 15k EUR"},
+    {"raw_prompt": "Compare PostgreSQL and MongoDB for an analytics workload, e.g. event data at 1M rows/day."},
+)
+
+# Built-in configurations: the production defaults and one step away from them.
+CONFIGS = (
+    {"name": "baseline"},
+    {"name": "lazy_questions", "questions_mode": "lazy"},
+    {"name": "two_questions", "max_questions": 2},
+    {"name": "half_max_tokens", "max_tokens": {s: n // 2 for s, n in _STAGE_MAX_TOKENS.items()}},
+    {"name": "sectioned_parallel", "enhance_mode": "parallel"},
+)
+
+_JUDGE_SYSTEM = """\
+You are an expert prompt engineer grading a rewritten prompt for {llm}.
+
+The user message holds the ORIGINAL prompt and the ENHANCED prompt. Rate the \
+enhanced prompt from 1 to 10: does it keep the original intent, follow {llm}'s \
+prompting guidance ({style}), and make the request clearer and more complete \
+without inventing requirements?
+
+Return ONLY JSON: {{"score": <1-10>, "reason": "<one sentence>"}}"""
+_JUDGE_MAX_TOKENS = 200
+
+
+def _load_jsonl(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _load_configs(path: str | None) -> list:
+    if not path:
+        return [dict(c) for c in CONFIGS]
+    with open(path) as f:
+        configs = json.load(f)
+    names = [c.get("name") for c in configs]
+    if not all(names) or len(set(names)) != len(names):
+        raise ValueError("Every configuration needs a unique \"name\".")
+    return configs
+
+
+def _cases(corpus: list, profiles: list) -> list:
+    cases = []
+    for item in corpus:
+        for llm in [item["target_llm"]] if item.get("target_llm") else profiles:
+            if llm not in LLM_PROFILES:
+                raise ValueError(f"Unknown target LLM: {llm}")
+            cases.append({"raw_prompt": item["raw_prompt"], "target_llm": llm})
+    return cases
+
+
+def _cost(config: dict, input_tokens: int, output_tokens: int) -> float:
+    input_rate, output_rate = usd_per_mtok()
+    return (
+        input_tokens * config.get("input_usd_per_mtok", input_rate)
+        + output_tokens * config.get("output_usd_per_mtok", output_rate)
+    ) / 1e6
+
+
+def _pipeline(config: dict, raw_prompt: str, target_llm: str) -> tuple:
+    """
+    One full enhancement with every suggested answer accepted.
+    Returns (model's prompt before repair, components, answers).
+    """
+    components = analyze_prompt_components(raw_prompt, target_llm)
+    lazy = config.get("questions_mode", "full") == "lazy"
+    questions = generate_clarifying_questions(
+        raw_prompt, target_llm, components, max_questions=config.get("max_questions", 4), lazy_examples=lazy,
+    )
+    answers = {
+        q["component"]: q["inferred_example"] or (generate_inferred_example(raw_prompt, target_llm, q) if lazy else "")
+        for q in questions
+    }
+    answers = {k: v for k, v in answers.items() if v}
+    mode = config.get("enhance_mode", "single")
+    if mode in ("sectioned", "parallel"):
+        enhanced, _ = build_enhanced_prompt_sectioned(
+            raw_prompt, target_llm, components, answers, parallel=mode == "parallel",
+        )
+    else:
+        enhanced = build_enhanced_prompt(raw_prompt, target_llm, components, answers)
+    return enhanced, components, answers
+
+
+def _judge(raw_prompt: str, target_llm: str, enhanced: str, ledger: TokenLedger) -> float | None:
+    system = _JUDGE_SYSTEM.format(llm=target_llm, style=LLM_PROFILES[target_llm]["style_hint"])
+    user_msg = f"ORIGINAL:\n{raw_prompt}\n\nENHANCED:\n{enhanced}"
+    with usage_listener(ledger.record):
+        raw = _call(system, user_msg, max_tokens=_JUDGE_MAX_TOKENS, stage="judge")
+    score = _parse_json(raw, {}).get("score") if raw else None
+    if not isinstance(score, (int, float)):
+        return None
+    return (min(max(float(score), 1.0), 10.0) - 1) / 9
+
+
+def _run_case(config: dict, case: dict, judge: bool) -> dict:
+    """Run and score one (configuration, prompt) pair. Never raises."""
+    raw_prompt, target_llm = case["raw_prompt"], case["target_llm"]
+    ledger, judge_ledger = TokenLedger(), TokenLedger()
+    result = {"config": config["name"], **case}
+    started = time.perf_counter()
+    try:
+        with usage_listener(ledger.record), call_settings(config.get("model"), config.get("max_tokens")):
+            enhanced, components, answers = _pipeline(config, raw_prompt, target_llm)
+            violations = lint_prompt(enhanced, target_llm)
+            final, report = repair_prompt(enhanced, target_llm, components, answers)
+    except Exception as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}", quality=0.0)
+        return result
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    input_tokens = sum(e["input_tokens"] for e in ledger.entries)
+    output_tokens = sum(e["output_tokens"] for e in ledger.entries)
+    scores = {"rules": 1 - len(violations) / max(len(_RULES[target_llm]), 1)}
+    if judge:
+        try:
+            scores["judge"] = _judge(raw_prompt, target_llm, final, judge_ledger)
+        except Exception:
+            scores["judge"] = None
+    available = [s for s in scores.values() if s is not None]
+    result.update(
+        ok=True,
+        latency_ms=round(latency_ms, 1),
+        calls=len(ledger.entries),
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cost_usd=_cost(config, input_tokens, output_tokens),
+        scores=scores,
+        quality=sum(available) / len(available),
+        violations=[v["rule"] for v in violations],
+        unresolved=report["unresolved"],
+        judge_tokens=judge_ledger.total,
+        enhanced_prompt=final,
+    )
+    return result
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(math.ceil(pct / 100 * len(ordered)) - 1, len(ordered) - 1)] if ordered else 0.0
+
+
+def _mean(values: list) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+def summarize(config: dict, runs: list) -> dict:
+    """Per-configuration aggregates over its runs."""
+    ok = [r for r in runs if r["ok"]]
+    latencies = [r["latency_ms"] for r in ok]
+    judged = [r["scores"]["judge"] for r in ok if r["scores"].get("judge") is not None]
+    return {
+        "name": config["name"],
+        "config": config,
+        "runs": len(runs),
+        "errors": len(runs) - len(ok),
+        "quality": round(_mean([r["quality"] for r in runs]), 4),
+        "rules": round(_mean([r["scores"]["rules"] for r in ok]), 4),
+        "judge": round(_mean(judged), 4) if judged else None,
+        "unresolved_per_prompt": round(_mean([len(r["unresolved"]) for r in ok]), 2),
+        "p50_ms": round(_percentile(latencies, 50), 1),
+        "p95_ms": round(_percentile(latencies, 95), 1),
+        "calls_per_prompt": round(_mean([r["calls"] for r in ok]), 2),
+        "input_tokens_per_prompt": round(_mean([r["input_tokens"] for r in ok])),
+        "output_tokens_per_prompt": round(_mean([r["output_tokens"] for r in ok])),
+        "cost_usd_per_prompt": round(_mean([r["cost_usd"] for r in ok]), 6),
+        "judge_tokens": sum(r.get("judge_tokens", 0) for r in ok),
+    }
+
+
+def _dominates(a: dict, b: dict) -> bool:
+    """a is at least as good as b on quality, p50 latency and cost, and better on one."""
+    no_worse = a["quality"] >= b["quality"] and a["p50_ms"] <= b["p50_ms"] and a["cost_usd_per_prompt"] <= b["cost_usd_per_prompt"]
+    better = a["quality"] > b["quality"] or a["p50_ms"] < b["p50_ms"] or a["cost_usd_per_prompt"] < b["cost_usd_per_prompt"]
+    return no_worse and better
+
+
+def pareto_report(summaries: list, tolerance: float = 0.02) -> dict:
+    """Mark the Pareto front and pick a recommended default from it."""
+    for s in summaries:
+        s["pareto"] = s["errors"] < s["runs"] and not any(
+            _dominates(other, s) for other in summaries if other is not s and other["errors"] < other["runs"]
+        )
+    front = [s for s in summaries if s["pareto"]]
+    best = max((s["quality"] for s in front), default=0.0)
+    eligible = [s for s in front if s["quality"] >= best - tolerance]
+    recommended = min(eligible, key=lambda s: (s["cost_usd_per_prompt"], s["p50_ms"]), default=None)
+    return {
+        "configs": sorted(summaries, key=lambda s: (-s["quality"], s["p50_ms"])),
+        "pareto_front": [s["name"] for s in front],
+        "recommended": recommended["name"] if recommended else None,
+        "tolerance": tolerance,
+    }
+
+
+def evaluate(configs: list, cases: list, judge: bool = False, workers: int = 8, tolerance: float = 0.02) -> tuple:
+    """Run every configuration on every case concurrently. Returns (runs, report)."""
+    tasks = [(c, case) for c in configs for case in cases]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        runs = list(pool.map(lambda t: _run_case(*t, judge), tasks))
+    summaries = [summarize(c, [r for r in runs if r["config"] == c["name"]]) for c in configs]
+    return runs, pareto_report(summaries, tolerance)
+
+
+def to_markdown(report: dict) -> str:
+    lines = [
+        "| config | front | quality | rules | judge | unresolved | p50 ms | p95 ms | calls | tokens in/out | $/prompt | errors |",
+        "|---|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for s in report["configs"]:
+        judge = f"{s['judge']:.2f}" if s["judge"] is not None else "–"
+        lines.append(
+            f"| {s['name']}{' ★' if s['name'] == report['recommended'] else ''} | {'✓' if s['pareto'] else ''} "
+            f"| {s['quality']:.3f} | {s['rules']:.3f} | {judge} | {s['unresolved_per_prompt']} "
+            f"| {s['p50_ms']:,.0f} | {s['p95_ms']:,.0f} | {s['calls_per_prompt']} "
+            f"| {s['input_tokens_per_prompt']:,}/{s['output_tokens_per_prompt']:,} "
+            f"| {s['cost_usd_per_prompt']:.5f} | {s['errors']}/{s['runs']} |"
+        )
+    lines.append("")
+    lines.append(
+        f"Recommended default: **{report['recommended']}** — the cheapest, then fastest, Pareto configuration "
+        f"within {report['tolerance']} of the best quality."
+    )
+    return "\n".join(lines)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", default=None, help="JSON list of configurations (default: built-in set)")
+    parser.add_argument("--corpus", default=None, help="JSONL prompt corpus (default: built-in corpus)")
+    parser.add_argument("--profiles", default=",".join(LLM_PROFILES), help="Target LLMs for untargeted prompts")
+    parser.add_argument("--judge", action="store_true", help="Also rate each result with the judge stage")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent runs (default: 8)")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Quality slack for the recommendation")
+    parser.add_argument("--output", default=_DEFAULT_OUTPUT_DIR, help=f"Report directory (default: {_DEFAULT_OUTPUT_DIR})")
+    args = parser.parse_args()
+
+    # Every configuration pays for its own analysis.
+    os.environ["ANALYSIS_REUSE_DIR"] = "off"
+    try:
+        configs = _load_configs(args.configs)
+        corpus = _load_jsonl(args.corpus) if args.corpus else list(CORPUS)
+        cases = _cases(corpus, [p.strip() for p in args.profiles.split(",") if p.strip()])
+        if not cases:
+            raise ValueError("The corpus is empty.")
+        started = time.perf_counter()
+        runs, report = evaluate(configs, cases, args.judge, args.workers, args.tolerance)
+        report.update(wall_s=round(time.perf_counter() - started, 1), default_model=_MODEL, prompts=len(cases))
+
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        os.makedirs(args.output, exist_ok=True)
+        base = os.path.join(args.output, f"eval-{stamp}")
+        with open(f"{base}.json", "w") as f:
+            json.dump({"report": report, "runs": runs}, f, indent=2)
+        markdown = to_markdown(report)
+        with open(f"{base}.md", "w") as f:
+            f.write(markdown + "\n")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(markdown)
+    print(f"\n{len(configs)} configs × {len(cases)} prompts in {report['wall_s']}s — report: {base}.json / .md")
+    if report["recommended"] is None:
+        print("Error: every configuration failed.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""Durable background job queue for the enhancement stages (SQLite + thread pool).
+
+Jobs survive browser refreshes and process restarts: every job and its result
+live in SQLite, workers claim jobs atomically, and jobs orphaned by a dead
+process are picked up again on start.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from tools import metrics
+from tools.enhance_prompt import (
+    analyze_prompt_components,
+    build_enhanced_prompt,
+    generate_clarifying_questions,
+    generate_inferred_example,
+    safe_error_message,
+    usage_listener,
+)
+from tools.deadline import Deadline, DeadlineExceeded, record_outcome
+from tools.enhance_sections import build_enhanced_prompt_sectioned
+from tools.lint_prompt import repair_prompt
+from tools.prompt_history import history_enabled, record_enhancement
+from tools.quota import QuotaExceeded, charged_to
+from tools.render_prompt import render_instant_prompt
+from tools.request_log import RunRecord
+
+_DEFAULT_DB_PATH = os.path.join(".tmp", "jobs.db")
+_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+_KEEP_FINISHED_SECONDS = 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    status      TEXT NOT NULL,          -- queued | running | done | failed | cancelled
+    payload     TEXT NOT NULL,
+    result      TEXT,
+    error       TEXT,
+    usage       TEXT,
+    owner_pid   INTEGER,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+"""
+
+_FINISHED = ("done", "failed", "cancelled")
+
+_start_lock = threading.Lock()
+_pool = None
+# Deadlines of the jobs running in this process, so cancel_job() can stop them.
+_running_lock = threading.Lock()
+_running = {}
+
+
+# ---------------------------------------------------------------------------
+# Stage handlers — plain functions of the job payload, run on worker threads
+# ---------------------------------------------------------------------------
+
+
+def _analysis_job(raw_prompt: str, target_llm: str, deadline: Deadline) -> dict:
+    return {"components": analyze_prompt_components(raw_prompt, target_llm, deadline=deadline)}
+
+
+def _questions_job(
+    raw_prompt: str, target_llm: str, components: dict, deadline: Deadline, lazy_examples: bool = False,
+) -> dict:
+    return {
+        "questions": generate_clarifying_questions(
+            raw_prompt, target_llm, components, lazy_examples=lazy_examples, deadline=deadline,
+        ),
+    }
+
+
+def _example_job(raw_prompt: str, target_llm: str, question: dict, deadline: Deadline) -> dict:
+    return {"inferred_example": generate_inferred_example(raw_prompt, target_llm, question, deadline=deadline)}
+
+
+def _enhance_job(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    answers: dict,
+    deadline: Deadline,
+    mode: str = "single",
+    sections: dict | None = None,
+) -> dict:
+    try:
+        if mode in ("sectioned", "parallel"):
+            enhanced, sections = build_enhanced_prompt_sectioned(
+                raw_prompt, target_llm, components, answers, sections,
+                parallel=mode == "parallel", deadline=deadline,
+            )
+        else:
+            enhanced, sections = build_enhanced_prompt(raw_prompt, target_llm, components, answers, deadline), {}
+    except DeadlineExceeded as e:
+        # Out of time: the locally rendered structure is still a usable result.
+        record_outcome("enhance", "fallback")
+        enhanced = render_instant_prompt(raw_prompt, target_llm, components, answers)
+        return {"enhanced_prompt": enhanced, "sections": sections or {}, "lint": {}, "degraded": str(e)}
+    enhanced, lint = repair_prompt(enhanced, target_llm, components, answers, deadline=deadline)
+    return {"enhanced_prompt": enhanced, "sections": sections, "lint": lint}
+
+
+_HANDLERS = {
+    "analysis": _analysis_job,
+    "questions": _questions_job,
+    "example": _example_job,
+    "enhance": _enhance_job,
+}
+
+# ---------------------------------------------------------------------------
+# Storage
+# ---------------------------------------------------------------------------
+
+
+def _db_path() -> str:
+    return os.getenv("JOB_QUEUE_DB", _DEFAULT_DB_PATH)
+
+
+def _connect() -> sqlite3.Connection:
+    path = _db_path()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _pid_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _start():
+    """Create the schema and worker pool once per process; re-queue orphaned jobs."""
+    global _pool
+    with _start_lock:
+        if _pool is not None:
+            return
+        conn = _connect()
+        try:
+            with conn:
+                conn.executescript(_SCHEMA)
+                conn.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?",
+                    (time.time() - _KEEP_FINISHED_SECONDS,),
+                )
+            orphans = [
+                row["id"]
+                for row in conn.execute("SELECT id, owner_pid FROM jobs WHERE status IN ('queued', 'running')")
+                if not _pid_alive(row["owner_pid"])
+            ]
+            with conn:
+                # A caller's deadline has long passed after a restart: the
+                # re-queued job gets a fresh stage budget when it is claimed.
+                conn.executemany(
+                    "UPDATE jobs SET status = 'queued', owner_pid = ?, "
+                    "payload = json_remove(payload, '$.deadline_at') WHERE id = ?",
+                    [(os.getpid(), job_id) for job_id in orphans],
+                )
+        finally:
+            conn.close()
+        _pool = ThreadPoolExecutor(max_workers=_WORKERS, thread_name_prefix="job")
+    for job_id in orphans:
+        _pool.submit(_run, job_id)
+
+
+def _run(job_id: str):
+    conn = _connect()
+    try:
+        with conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, owner_pid = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (time.time(), os.getpid(), job_id),
+            ).rowcount
+        if not claimed:
+            return
+        row = conn.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        payload = json.loads(row["payload"])
+        # Speculative builds are only worth keeping if the user ends up using them.
+        keep_history = payload.pop("record_history", True)
+        # The stage budget starts now, when a worker takes the job — waiting
+        # behind other jobs or a restart does not use it up. Only a caller's
+        # explicit "deadline_at" (e.g. an HTTP request's own budget) is kept.
+        deadline_at = payload.pop("deadline_at", None)
+        deadline = Deadline(deadline_at) if deadline_at else Deadline.for_stage(row["kind"])
+        # The user the job's API calls are charged to (tools/quota.py).
+        user = payload.pop("user", None)
+        with _running_lock:
+            _running[job_id] = deadline
+
+        run = RunRecord("job", row["kind"], payload.get("target_llm"))
+        ledger = run.ledger
+        started = time.perf_counter()
+        try:
+            with usage_listener(ledger.record), run.capturing(), charged_to(user):
+                result = _HANDLERS[row["kind"]](**payload, deadline=deadline)
+            status, error = "done", None
+            run.outcome = "degraded" if isinstance(result, dict) and result.get("degraded") else "ok"
+        except Exception as e:
+            result, status, error = None, "failed", safe_error_message(e)
+            run.outcome = (
+                "timeout" if isinstance(e, DeadlineExceeded) else "quota" if isinstance(e, QuotaExceeded) else "error"
+            )
+        latency_ms = (time.perf_counter() - started) * 1000
+        with _running_lock:
+            _running.pop(job_id, None)
+
+        with conn:
+            # A cancelled job keeps its status; only its usage is recorded.
+            finished = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, usage = ?, finished_at = ? "
+                "WHERE id = ? AND status = 'running'",
+                (status, json.dumps(result), error, json.dumps(ledger.entries), time.time(), job_id),
+            ).rowcount
+            if not finished:
+                status = "cancelled"
+                run.outcome = "cancelled"
+                conn.execute("UPDATE jobs SET usage = ? WHERE id = ?", (json.dumps(ledger.entries), job_id))
+        run.finish()
+    finally:
+        conn.close()
+
+    if status == "done" and row["kind"] == "enhance" and keep_history and history_enabled():
+        try:
+            record_enhancement(
+                payload["raw_prompt"],
+                payload["target_llm"],
+                payload["components"],
+                payload["answers"],
+                result["enhanced_prompt"],
+                input_tokens=sum(e["input_tokens"] for e in ledger.entries),
+                output_tokens=sum(e["output_tokens"] for e in ledger.entries),
+                latency_ms=latency_ms,
+            )
+        except sqlite3.Error:
+            # The job's result stands; only its history entry is lost.
+            metrics.increment("history.errors")
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+
+def submit_job(kind: str, payload: dict) -> str:
+    """
+    Queue one stage run ("analysis", "questions", "example" or "enhance"). Returns the job id.
+    The job's deadline is the stage budget from when a worker claims it, unless
+    payload sets "deadline_at" (dropped if the job is re-queued after a restart).
+    Its API calls are charged to payload["user"], if set.
+    """
+    if kind not in _HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    _start()
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, owner_pid, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), os.getpid(), time.time()),
+            )
+    finally:
+        conn.close()
+    _pool.submit(_run, job_id)
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    """
+    Current state of a job, or None if unknown. Keys: id, kind, status,
+    payload, result, error, usage (list of ledger entries), created_at,
+    started_at, finished_at.
+    """
+    _start()
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    job = dict(row)
+    for key in ("payload", "result", "usage"):
+        job[key] = json.loads(job[key]) if job[key] else None
+    job["finished"] = job["status"] in _FINISHED
+    return job
+
+
+def cancel_job(job_id: str) -> bool:
+    """
+    Cancel a queued or running job. A queued job never starts; a running one
+    stops at its next deadline check (its spent usage is still recorded).
+    Returns False if the job had already finished or is unknown.
+    """
+    _start()
+    conn = _connect()
+    try:
+        with conn:
+            cancelled = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            ).rowcount
+    finally:
+        conn.close()
+    with _running_lock:
+        deadline = _running.get(job_id)
+    if deadline is not None:
+        deadline.expires_at = time.time()
+    return bool(cancelled)
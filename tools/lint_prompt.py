@@ -0,0 +1,534 @@
+"""
+Local linter and auto-repair for enhanced prompts against each profile's rules.
+
+Rules are compiled once per profile from its structure, role framing, avoid
+list and placement settings. lint_prompt() checks a prompt in microseconds;
+repair_prompt() fixes what it can locally and only asks the model for the
+missing piece of a violation it cannot repair (e.g. a time scope that appears
+nowhere in the inputs).
+"""
+
+import re
+
+from tools import metrics
+from tools.deadline import Deadline
+from tools.assemble_prompt import anchor_directive, section_title
+from tools.enhance_prompt import _STAGE_MAX_TOKENS, LLM_PROFILES, _call
+
+# Avoid-list entries that name a kind of content rather than literal words,
+# mapped to the rule that detects it. Entries in _NOT_CHECKABLE need judgement
+# a regex cannot provide and are left to the model.
+_AVOID_CONCEPTS = {
+    "few-shot examples": "no_examples",
+    "URL requests": "no_url_requests",
+    "role personas": "no_role",
+}
+_NOT_CHECKABLE = {"vague adjectives", "ambiguous phrasing", "multi-topic queries"}
+
+_PREAMBLE = re.compile(
+    r"\A\s*(?:(?:sure|certainly|of course|absolutely)\b[^\n]*\n|here(?:'s| is)\b[^\n]*:[ \t]*\n)\s*",
+    re.IGNORECASE,
+)
+_FENCE = re.compile(r"\A\s*```[\w-]*\n(.*?)\n?```\s*\Z", re.DOTALL)
+_HEADER = re.compile(
+    r"^(?:#{1,6}[ \t]+(?P<md>[^\n#]+?)[ \t]*#*|\*\*(?P<bold>[^*\n]+?)\*\*:?|<(?P<xml>[a-z_]+)>)[ \t]*$",
+    re.MULTILINE,
+)
+_XML_CLOSE_LINE = re.compile(r"^[ \t]*</[a-z_]+>[ \t]*\n?", re.MULTILINE)
+_XML_PAIR = re.compile(r"<([a-z_]+)>.*?</\1>", re.DOTALL)
+_MD_HEADER = re.compile(r"^##[ \t]+\S", re.MULTILINE)
+_BOLD_HEADER = re.compile(r"^\*\*[^*\n]+\*\*:?[ \t]*$", re.MULTILINE)
+_ROLE_SENTENCE = re.compile(r"(?im)(?:^|(?<=[.!?])[ \t]+)(?:you are|act as)\b[^.!?\n]*[.!?]?[ \t]*")
+_EXAMPLE_BLOCK = re.compile(
+    r"(?im)^[ \t]*(?:#+[ \t]*|\*\*)?(?:few-shot[ \t]+)?examples?\b[^\n]*(?:\n(?![ \t]*\n)[^\n]*)*"
+)
+_URL_REQUEST = re.compile(
+    r"(?i)[^.!?\n]*\b(?:include|provide|list|give|add|share|with|cite)\b[^.!?\n]{0,60}?"
+    r"\b(?:urls?|links?|hyperlinks?)\b[^.!?\n]*[.!?]?[ \t]*"
+)
+_EMPTY_LEAD_LINE = re.compile(r"(?m)^[A-Z][\w ]{0,20}:[ \t]*(?:\n|$)")
+# A year, a span ("past 6 months", "this quarter") or a month anchor ("since March");
+# words like "current" or "latest" alone do not bound a search.
+_MONTH = (
+    r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|"
+    r"sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)"
+)
+_TIME_SCOPE = re.compile(
+    r"(?i)\btime scope\b|\b(?:19|20)\d{2}s?\b"
+    r"|\b(?:past|last|previous|recent|next|this|current)[ \t]+(?:\d+[ \t]+|few[ \t]+|several[ \t]+|two[ \t]+|three[ \t]+)?"
+    r"(?:days?|weeks?|months?|quarters?|years?|decades?)\b"
+    rf"|\b(?:since|after|before|from|in|until)[ \t]+{_MONTH}\b"
+)
+_CITE = re.compile(r"(?i)\bcit(?:e|es|ed|ing|ation|ations)\b")
+_BLANK_RUNS = re.compile(r"\n{3,}")
+_DANGLING_CONJUNCTION = re.compile(r"^(?:and|or|but)\b[ \t]*", re.IGNORECASE)
+# A word that leans on the next one: deleting an avoided word after it garbles
+# the sentence ("very carefully and" -> "very and").
+_LEANING_WORD = re.compile(r"(?i)\b(?:very|really|so|too|more|most|less|least|extremely|quite|as|be|and|or|but)[ \t]*$")
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])([ \t]+)")
+_LINE_LEAD = re.compile(r"^[ \t]*(?:[-*•]|\d+[.)])?[ \t]*")
+
+_STRUCTURE_HINTS = {
+    "xml_tags": "an XML tag around every section, e.g. <task>...</task>",
+    "bold_headers": "a bold **Header** line before every section",
+    "markdown_headers": "a ## Markdown header before every section",
+}
+
+_FIX_SYSTEM = """\
+You are a prompt engineering expert specializing in {llm}.
+
+The user message contains a prompt written for {llm} and names ONE piece of text \
+that is missing from it. Write only that piece — no preamble, no quotes, no \
+explanation, nothing else from the prompt unless asked for the complete prompt."""
+
+
+class _Rule:
+    """
+    One profile rule. violated(text) is the fast check; repair(text, ctx)
+    returns fixed text or None. A rule with request=(what, max_tokens, key)
+    can ask the model for ctx[key] when the local repair needs it.
+    """
+
+    def __init__(self, name: str, message: str, violated, repair=None, request=None):
+        self.name = name
+        self.message = message
+        self.violated = violated
+        self.repair = repair
+        self.request = request
+
+
+def _tidy(text: str) -> str:
+    return _BLANK_RUNS.sub("\n\n", text).strip()
+
+
+def _split_sections(text: str) -> tuple:
+    """(text before the first header, [(title, body), ...]) for any header style."""
+    matches = list(_HEADER.finditer(text))
+    if not matches:
+        return text, []
+    sections = []
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        title = m.group("md") or m.group("bold") or m.group("xml")
+        body = _XML_CLOSE_LINE.sub("", text[m.end():end]).strip()
+        sections.append((title.strip(), body))
+    return text[:matches[0].start()].strip(), sections
+
+
+def _component_key(title: str, profile: dict) -> str:
+    wanted = title.strip().lower()
+    for c in profile["components"]:
+        names = (c, section_title(c), profile["component_labels"][c].split(" (")[0])
+        if wanted in (n.lower().replace("_", " ") for n in names) or wanted == c:
+            return c
+    return re.sub(r"\W+", "_", wanted).strip("_") or "section"
+
+
+def _render_sections(lead: str, sections: list, profile: dict) -> str:
+    structure = profile["structure"]
+    parts = [lead] if lead else []
+    for title, body in sections:
+        key = _component_key(title, profile)
+        if structure == "xml_tags":
+            parts.append(f"<{key}>\n{body}\n</{key}>")
+        elif structure == "bold_headers":
+            parts.append(f"**{section_title(key)}**\n{body}")
+        elif structure == "markdown_headers":
+            parts.append(f"## {section_title(key)}\n{body}")
+        else:
+            parts.append(body)
+    return _tidy("\n\n".join(p for p in parts if p))
+
+
+# ---------------------------------------------------------------------------
+# Rule builders
+# ---------------------------------------------------------------------------
+
+
+def _preamble_rule() -> _Rule:
+    def repair(text, ctx):
+        while _PREAMBLE.match(text):
+            text = _PREAMBLE.sub("", text, count=1)
+        return text
+    return _Rule(
+        "preamble", "Starts with chat filler instead of the prompt",
+        lambda text: bool(_PREAMBLE.match(text)), repair,
+    )
+
+
+def _fence_rule() -> _Rule:
+    return _Rule(
+        "code_fence", "Whole prompt wrapped in a code fence",
+        lambda text: bool(_FENCE.match(text)),
+        lambda text, ctx: _FENCE.match(text).group(1).strip(),
+    )
+
+
+def _structure_rule(profile: dict) -> _Rule:
+    structure = profile["structure"]
+    present = {
+        "xml_tags": lambda text: bool(_XML_PAIR.search(text)),
+        "bold_headers": lambda text: bool(_BOLD_HEADER.search(text)),
+        "markdown_headers": lambda text: bool(_MD_HEADER.search(text)),
+    }[structure]
+
+    def repair(text, ctx):
+        # Sections written in another header style are converted locally.
+        lead, sections = _split_sections(text)
+        if sections:
+            return _render_sections(lead, sections, profile)
+        return ctx.get("reformatted")
+
+    hint = _STRUCTURE_HINTS[structure]
+    return _Rule(
+        "structure", f"Sections must use {hint}",
+        lambda text: not present(text), repair,
+        request=(f"the complete prompt, content unchanged, reformatted with {hint}",
+                 _STAGE_MAX_TOKENS["enhance"], "reformatted"),
+    )
+
+
+def _unclosed_tags_rule(profile: dict) -> _Rule:
+    tags = profile["components"]
+
+    def unclosed(text):
+        return [t for t in tags if f"<{t}>" in text and f"</{t}>" not in text]
+
+    def repair(text, ctx):
+        for tag in unclosed(text):
+            start = text.index(f"<{tag}>") + len(tag) + 2
+            nxt = re.search(r"\n<[a-z_]+>", text[start:])
+            cut = start + nxt.start() if nxt else len(text)
+            text = f"{text[:cut].rstrip()}\n</{tag}>{text[cut:]}"
+        return text
+
+    return _Rule("unclosed_tag", "An XML section tag is never closed", lambda text: bool(unclosed(text)), repair)
+
+
+def _flat_structure_rule() -> _Rule:
+    def repair(text, ctx):
+        lead, sections = _split_sections(text)
+        return _tidy("\n\n".join([lead] + [body for _, body in sections]))
+    return _Rule(
+        "structure", "Research directives use plain lines, not headers",
+        lambda text: bool(_HEADER.search(text)), repair,
+    )
+
+
+def _role_framing_rule(profile: dict) -> _Rule:
+    wanted = profile["role_framing"].split(" [")[0]          # "You are" / "Act as"
+    other = "Act as" if wanted == "You are" else "You are"
+    wrong = re.compile(rf"(?im)^([ \t]*(?:<[a-z_]+>[ \t]*\n[ \t]*)?){re.escape(other)}\b")
+    right = re.compile(rf"(?im)^[ \t]*{re.escape(wanted)}\b")
+    return _Rule(
+        "role_framing", f"Role must be framed as '{profile['role_framing']}'",
+        lambda text: bool(wrong.search(text)) and not right.search(text),
+        lambda text, ctx: wrong.sub(lambda m: m.group(1) + wanted, text, count=1),
+    )
+
+
+def _no_role_rule() -> _Rule:
+    return _Rule(
+        "no_role", "No role persona for a search model",
+        lambda text: bool(_ROLE_SENTENCE.search(text)),
+        lambda text, ctx: _tidy(_ROLE_SENTENCE.sub("", text)),
+    )
+
+
+def _no_examples_rule() -> _Rule:
+    return _Rule(
+        "no_examples", "No few-shot examples — they get searched for",
+        lambda text: bool(_EXAMPLE_BLOCK.search(text)),
+        lambda text, ctx: _tidy(_EXAMPLE_BLOCK.sub("", text)),
+    )
+
+
+def _no_url_requests_rule() -> _Rule:
+    def drop(m):
+        # A sentence between two others leaves a space behind, not "end.Next".
+        rest = m.string[m.end():m.end() + 1]
+        return " " if m.group(0)[:1] in " \t" and rest not in ("", "\n") else ""
+
+    def repair(text, ctx):
+        text = re.sub(r"(?m)[ \t]+$", "", _URL_REQUEST.sub(drop, text))
+        return _tidy(_EMPTY_LEAD_LINE.sub("", text))
+
+    return _Rule(
+        "no_url_requests", "Never request URLs — they would be hallucinated",
+        lambda text: bool(_URL_REQUEST.search(text)), repair,
+    )
+
+
+def _avoid_rule(target_llm: str, profile: dict, literal: list) -> _Rule:
+    alternatives = "|".join(re.escape(a) for a in sorted(literal, key=len, reverse=True))
+    pattern = re.compile(rf"\b(?:{alternatives})\b,?[ \t]*", re.IGNORECASE)
+    # The profile's own phrases (e.g. Claude's cot_phrase says "carefully") are exempt.
+    keep = [p for p in (profile["cot_phrase"], profile["anchor_phrase"]) if p]
+
+    def masked(text):
+        for phrase in keep:
+            text = text.replace(phrase, "")
+        return text
+
+    def strip_line(line):
+        """line without the avoided words, or None where deleting one would garble it."""
+        lead = _LINE_LEAD.match(line).group(0)
+        body = line[len(lead):]
+        for phrase in keep:
+            if phrase in body:
+                parts = [strip_line(p) if p.strip() else p for p in body.split(phrase)]
+                return None if None in parts else lead + phrase.join(parts)
+        if any(_LEANING_WORD.search(body[:m.start()]) for m in pattern.finditer(body)):
+            return None
+        parts = _SENTENCE_BREAK.split(body.strip())
+        # Sentences at even positions, the spaces between them at odd ones.
+        kept = [(strip_sentence(part), parts[i + 1] if i + 1 < len(parts) else "")
+                for i, part in enumerate(parts) if i % 2 == 0]
+        cleaned = "".join(sentence + space for sentence, space in kept if sentence).strip()
+        trail = " " if body.endswith(" ") else ""
+        return lead + cleaned + trail
+
+    def strip_sentence(sentence):
+        """sentence without the avoided words; "" if nothing else was in it."""
+        cleaned = pattern.sub("", sentence)
+        cleaned = re.sub(r"[ \t]{2,}", " ", cleaned)
+        cleaned = re.sub(r"\s+([,.;:!?])", r"\1", cleaned)
+        # "Summarize it, please." -> "Summarize it." rather than "Summarize it,."
+        cleaned = re.sub(r",+(?=[.;:!?]|$)", "", cleaned).strip()
+        cleaned = _DANGLING_CONJUNCTION.sub("", cleaned).lstrip(",;: ")
+        if not cleaned.strip(".;:!?"):
+            return ""
+        if sentence[:1].isupper() and cleaned[:1].islower():
+            cleaned = cleaned[0].upper() + cleaned[1:]
+        return cleaned
+
+    def repair(text, ctx):
+        lines = [strip_line(l) if pattern.search(masked(l)) else l for l in text.split("\n")]
+        if None in lines:
+            return ctx.get("rephrased")
+        return "\n".join(lines)
+
+    return _Rule(
+        "avoid", f"Contains phrasing to avoid for {target_llm}: {', '.join(literal)}",
+        lambda text: bool(pattern.search(masked(text))), repair,
+        request=(f"the complete prompt, content unchanged, reworded so it never uses: {', '.join(literal)}",
+                 _STAGE_MAX_TOKENS["enhance"], "rephrased"),
+    )
+
+
+def _time_scope_rule() -> _Rule:
+    def repair(text, ctx):
+        scope = ctx.get("time_scope")
+        if not scope:
+            return None
+        return f"{text.rstrip()}\nTime scope: {scope.strip().rstrip('.')}"
+    return _Rule(
+        "time_scope", "Research prompts always need a time scope",
+        lambda text: not _TIME_SCOPE.search(text), repair,
+        request=("one short time scope for this research query (e.g. 'Published after January 2025')",
+                 60, "time_scope"),
+    )
+
+
+def _evidence_rule() -> _Rule:
+    return _Rule(
+        "evidence", "Use evidence-first framing (cite sources for each claim)",
+        lambda text: not _CITE.search(text),
+        lambda text, ctx: f"{text.rstrip()}\nCite sources for each claim.",
+    )
+
+
+def _directive_last_rule(profile: dict) -> _Rule:
+    title = section_title(profile["directive_component"]).lower()
+
+    def position(text):
+        _, sections = _split_sections(text)
+        titles = [t.lower() for t, _ in sections]
+        return (titles.index(title), len(titles)) if title in titles else (None, len(titles))
+
+    def repair(text, ctx):
+        lead, sections = _split_sections(text)
+        directive = [s for s in sections if s[0].lower() == title]
+        rest = [s for s in sections if s[0].lower() != title]
+        return _render_sections(lead, rest + directive, profile)
+
+    def violated(text):
+        index, count = position(text)
+        return index is not None and index != count - 1
+
+    return _Rule("directive_last", "The directive section must come last", violated, repair)
+
+
+def _anchor_rule(profile: dict) -> _Rule:
+    anchor = profile["anchor_phrase"]
+    title = section_title(profile["directive_component"]).lower()
+
+    def violated(text):
+        return anchor.lower() not in text.rstrip().rsplit("\n\n", 1)[-1].lower()
+
+    def repair(text, ctx):
+        lines = text.rstrip().split("\n")
+        anchored = [l for l in lines if anchor.lower() in l.lower()]
+        if anchored:
+            # Present, but not at the end — move it there.
+            rest = [l for l in lines if anchor.lower() not in l.lower()]
+            return _tidy("\n".join(rest)) + "\n\n" + anchored[-1].strip()
+        _, sections = _split_sections(text)
+        body = next((b for t, b in sections if t.lower() == title and b), None)
+        if body:
+            return f"{text.rstrip()}\n\n{anchor_directive(body, anchor).rsplit(chr(10) * 2, 1)[-1]}"
+        directive = ctx.get("directive")
+        if not directive:
+            return None
+        directive = directive.strip().rstrip(".")
+        return f"{text.rstrip()}\n\n{anchor} {directive[0].lower()}{directive[1:]}."
+
+    return _Rule(
+        "anchor", f"Must end with the anchor phrase '{anchor} …'", violated, repair,
+        request=("the single directive sentence this prompt asks for, starting with a verb", 80, "directive"),
+    )
+
+
+def _cot_trailer_rule(profile: dict) -> _Rule:
+    cot = profile["cot_phrase"]
+    return _Rule(
+        "cot_trailer", f"Must end with '{cot}'",
+        lambda text: not text.rstrip().endswith(cot),
+        lambda text, ctx: f"{text.rstrip()}\n\n{cot}",
+    )
+
+
+def _compile_rules(target_llm: str, profile: dict) -> list:
+    rules = [_preamble_rule(), _fence_rule()]
+    if profile["structure"] == "research_directive":
+        rules.append(_flat_structure_rule())
+    else:
+        rules.append(_structure_rule(profile))
+    if profile["structure"] == "xml_tags":
+        rules.append(_unclosed_tags_rule(profile))
+
+    concepts = {_AVOID_CONCEPTS[a] for a in profile["avoid"] if a in _AVOID_CONCEPTS}
+    if profile["has_role"] and profile["role_framing"]:
+        rules.append(_role_framing_rule(profile))
+    elif not profile["has_role"]:
+        concepts.add("no_role")
+    if "no_role" in concepts:
+        rules.append(_no_role_rule())
+    if "no_examples" in concepts:
+        rules.append(_no_examples_rule())
+    if "no_url_requests" in concepts:
+        rules.append(_no_url_requests_rule())
+
+    literal = [a for a in profile["avoid"] if a not in _AVOID_CONCEPTS and a not in _NOT_CHECKABLE]
+    if literal:
+        rules.append(_avoid_rule(target_llm, profile, literal))
+    if "time_scope" in profile["components"]:
+        rules.append(_time_scope_rule())
+    if "cite sources" in profile["special"].lower():
+        rules.append(_evidence_rule())
+    if profile["directive_component"]:
+        rules.append(_directive_last_rule(profile))
+    if profile["anchor_phrase"] and profile["directive_component"]:
+        rules.append(_anchor_rule(profile))
+    if profile["cot_trailer"] and profile["cot_phrase"]:
+        rules.append(_cot_trailer_rule(profile))
+    return rules
+
+
+# Compiled once per profile — checking a prompt must stay in the microsecond range.
+_RULES = {llm: _compile_rules(llm, p) for llm, p in LLM_PROFILES.items()}
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+
+def lint_prompt(text: str, target_llm: str) -> list:
+    """Rule violations in an enhanced prompt: a list of {rule, message} dicts."""
+    return [
+        {"rule": r.name, "message": r.message}
+        for r in _RULES[target_llm]
+        if r.violated(text)
+    ]
+
+
+def _request_fix(text: str, target_llm: str, what: str, max_tokens: int, deadline: Deadline | None) -> str:
+    system = _FIX_SYSTEM.format(llm=target_llm)
+    user_msg = f"PROMPT:\n{text}\n\nWRITE ONLY: {what}"
+    return _call(system, user_msg, max_tokens=max_tokens, stage="lint_fix", deadline=deadline)
+
+
+def repair_prompt(
+    text: str,
+    target_llm: str,
+    components: dict | None = None,
+    user_answers: dict | None = None,
+    allow_requests: bool = True,
+    deadline: Deadline | None = None,
+) -> tuple:
+    """
+    Lint text and fix violations rule by rule: locally where possible, else
+    (with allow_requests) by asking the model for just the missing piece.
+    Answers and analyzed components supply missing values before any request
+    (e.g. Perplexity's time scope). A request that misses the deadline leaves
+    its rule unresolved.
+
+    Returns (text, report) where report lists rule names under "violations",
+    "repaired", "requested" (model asked) and "unresolved".
+    """
+    ctx = {
+        k: v for k, v in {**(components or {}), **(user_answers or {})}.items()
+        if isinstance(v, str) and v.strip()
+    }
+    report = {"violations": [], "repaired": [], "requested": [], "unresolved": []}
+    metrics.increment("lint.checked", llm=target_llm)
+
+    for rule in _RULES[target_llm]:
+        if not rule.violated(text):
+            continue
+        report["violations"].append(rule.name)
+        metrics.increment("lint.violations", llm=target_llm, rule=rule.name)
+        fixed = rule.repair(text, ctx) if rule.repair else None
+        if fixed is None and allow_requests and rule.request:
+            what, max_tokens, key = rule.request
+            try:
+                ctx[key] = _request_fix(text, target_llm, what, max_tokens, deadline)
+            except Exception:
+                ctx[key] = ""
+            report["requested"].append(rule.name)
+            metrics.increment("lint.requests", llm=target_llm, rule=rule.name)
+            fixed = rule.repair(text, ctx) if ctx[key] else None
+        if fixed is not None and fixed.strip() and not rule.violated(fixed):
+            text = fixed
+            report["repaired"].append(rule.name)
+        else:
+            report["unresolved"].append(rule.name)
+            metrics.increment("lint.unresolved", llm=target_llm, rule=rule.name)
+
+    if report["violations"]:
+        metrics.increment("lint.flagged", llm=target_llm)
+    return text, report
+
+
+def violation_rates() -> dict:
+    """
+    Per profile: prompts checked, share with any violation, and per rule the
+    share of checked prompts that violated it and how many stayed unresolved.
+    """
+    rates = {}
+    for llm, rules in _RULES.items():
+        checked = metrics.counter("lint.checked", llm=llm)
+        if not checked:
+            continue
+        rates[llm] = {
+            "checked": int(checked),
+            "flagged_rate": metrics.counter("lint.flagged", llm=llm) / checked,
+            "rules": {
+                r.name: {
+                    "rate": metrics.counter("lint.violations", llm=llm, rule=r.name) / checked,
+                    "unresolved": int(metrics.counter("lint.unresolved", llm=llm, rule=r.name)),
+                }
+                for r in rules
+            },
+        }
+    return rates
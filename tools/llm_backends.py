@@ -0,0 +1,254 @@
+"""
+LLM backends other than the built-in Anthropic client, and per-stage routing.
+
+LLM_BACKEND picks the backend for every stage ("anthropic" by default);
+LLM_BACKEND_ROUTES overrides it per stage, e.g. "analysis=openai,example=openai"
+to run the high-volume stages on a cheap local model and keep enhancement on
+the hosted one. The Anthropic backend is the client path in enhance_prompt
+(_call / _stream_call, with prompt caching and hedging); the others implement
+complete() and stream() below:
+
+- "openai": any OpenAI-compatible /chat/completions server, e.g. llama.cpp's
+  llama-server or vLLM (OPENAI_COMPAT_BASE_URL, OPENAI_COMPAT_MODEL,
+  OPENAI_COMPAT_API_KEY).
+- "fake": deterministic canned replies in-process — the pipeline runs offline.
+"""
+
+import json
+import os
+import threading
+from functools import lru_cache
+
+import requests
+
+from tools.token_budget import estimate_tokens
+
+ANTHROPIC = "anthropic"
+# Every name _create() (or the Anthropic client path) understands.
+BACKENDS = (ANTHROPIC, "openai", "fake")
+
+
+def _checked(name: str, setting: str) -> str:
+    if name not in BACKENDS:
+        raise ValueError(f"{setting}: unknown LLM backend {name!r} (choose from {', '.join(BACKENDS)})")
+    return name
+
+
+def parse_routes(spec: str) -> dict:
+    """{stage: backend} from "stage=backend,..."; raises ValueError on an unknown backend."""
+    routes = {}
+    for route in spec.split(","):
+        stage, _, name = route.partition("=")
+        stage, name = stage.strip(), name.strip()
+        if stage and name:
+            routes[stage] = _checked(name, "LLM_BACKEND_ROUTES")
+    return routes
+
+
+@lru_cache(maxsize=8)
+def _parsed_routing(default: str, spec: str) -> tuple:
+    return _checked(default.strip(), "LLM_BACKEND"), parse_routes(spec)
+
+
+def _routing() -> tuple:
+    """
+    (default backend, {stage: backend}), read when used — this module is
+    imported before enhance_prompt loads .env. warmup() calls it first, so a
+    typo shows up in the warmup errors before any request.
+    """
+    return _parsed_routing(os.getenv("LLM_BACKEND", ANTHROPIC), os.getenv("LLM_BACKEND_ROUTES", ""))
+
+# Without a deadline, a local server gets this long per request.
+_DEFAULT_TIMEOUT_SECONDS = 120
+
+# Canned replies per pipeline stage, recognised by a phrase in its system prompt.
+CANNED_REPLIES = (
+    ("Analyze the user's raw prompt", '{"role": null, "task": "Summarise the document"}'),
+    ("inferred_example", '[{"component": "context", "question": "Who is the audience?", '
+                         '"inferred_example": "Team leads", "placeholder": "e.g. executives"}]'),
+    ("Short hint for the text input field", '[{"component": "context", "question": "Who is the audience?", '
+                   '"inferred_example": "", "placeholder": "e.g. executives"}]'),
+)
+CANNED_DEFAULT = "<task>\nSummarise the document for team leads.\n</task>"
+
+
+def canned_reply(system) -> str:
+    """The canned reply for a system prompt (a string or a list of blocks)."""
+    text = system if isinstance(system, str) else json.dumps(system)
+    for phrase, reply in CANNED_REPLIES:
+        if phrase in text:
+            return reply
+    return CANNED_DEFAULT
+
+
+class OpenAICompatibleBackend:
+    """Chat completions over HTTP, with one pooled session per process."""
+
+    name = "openai"
+
+    def __init__(self, base_url: str, model: str, api_key: str = ""):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self._session = requests.Session()
+        if api_key:
+            self._session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def _post(
+        self,
+        system: str,
+        user: str,
+        max_tokens: int,
+        timeout: float | None,
+        stream: bool,
+        history: list | None = None,
+    ):
+        body = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                *(history or ()),
+                {"role": "user", "content": user},
+            ],
+            "max_tokens": max_tokens,
+            "temperature": 0,
+            "stream": stream,
+        }
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        try:
+            response = self._session.post(
+                f"{self.base_url}/chat/completions",
+                json=body,
+                timeout=timeout or _DEFAULT_TIMEOUT_SECONDS,
+                stream=stream,
+            )
+        except requests.Timeout:
+            raise TimeoutError(f"{self.name} backend timed out") from None
+        response.raise_for_status()
+        return response
+
+    def complete(self, system: str, user: str, max_tokens: int, timeout: float | None = None) -> tuple:
+        """(text, input_tokens, output_tokens) for one request."""
+        response = self._post(system, user, max_tokens, timeout, stream=False)
+        data = response.json()
+        text = data["choices"][0]["message"]["content"] or ""
+        usage = data.get("usage") or {}
+        return (
+            text.strip(),
+            usage.get("prompt_tokens") or estimate_tokens(system + user),
+            usage.get("completion_tokens") or estimate_tokens(text),
+        )
+
+    def stream(
+        self,
+        system: str,
+        user: str,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: dict | None = None,
+        history: list | None = None,
+    ):
+        """
+        Yield text chunks as they arrive. Fills usage with input_tokens /
+        output_tokens — estimated if the server does not report them or the
+        consumer stops early. history holds earlier turns to continue (servers
+        like llama-server reuse their KV cache for the shared prefix).
+        """
+        usage = usage if usage is not None else {}
+        prefix = "".join(turn["content"] for turn in history or ())
+        usage.update(input_tokens=estimate_tokens(system + prefix + user), output_tokens=0)
+        received = []
+        with self._post(system, user, max_tokens, timeout, stream=True, history=history) as response:
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == "[DONE]":
+                        break
+                    event = json.loads(payload)
+                    if event.get("usage"):
+                        usage["input_tokens"] = event["usage"].get("prompt_tokens") or usage["input_tokens"]
+                        usage["output_tokens"] = event["usage"].get("completion_tokens") or 0
+                    for choice in event.get("choices") or ():
+                        text = (choice.get("delta") or {}).get("content")
+                        if text:
+                            received.append(text)
+                            usage["output_tokens"] = estimate_tokens("".join(received))
+                            yield text
+            except requests.Timeout:
+                raise TimeoutError(f"{self.name} backend timed out") from None
+
+    def warmup(self):
+        """Open the pooled connection (the model list is free on every server of this kind)."""
+        self._session.get(f"{self.base_url}/models", timeout=5).raise_for_status()
+
+
+class FakeBackend:
+    """Deterministic replies, no network — for offline runs, demos and load tests."""
+
+    name = "fake"
+
+    def complete(self, system: str, user: str, max_tokens: int, timeout: float | None = None) -> tuple:
+        text = canned_reply(system)
+        return text, estimate_tokens(system + user), estimate_tokens(text)
+
+    def stream(
+        self,
+        system: str,
+        user: str,
+        max_tokens: int,
+        timeout: float | None = None,
+        usage: dict | None = None,
+        history: list | None = None,
+    ):
+        text, input_tokens, output_tokens = self.complete(system, user, max_tokens)
+        if usage is not None:
+            usage.update(input_tokens=input_tokens, output_tokens=output_tokens)
+        for i in range(0, len(text), 16):
+            yield text[i:i + 16]
+
+    def warmup(self):
+        pass
+
+
+_lock = threading.Lock()
+_instances = {}
+
+
+def _create(name: str):
+    if name == "openai":
+        return OpenAICompatibleBackend(
+            os.getenv("OPENAI_COMPAT_BASE_URL", "http://127.0.0.1:8080/v1"),
+            os.getenv("OPENAI_COMPAT_MODEL", "local"),
+            os.getenv("OPENAI_COMPAT_API_KEY", ""),
+        )
+    if name == "fake":
+        return FakeBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+def backend_name(stage: str) -> str:
+    """The backend configured for a pipeline stage."""
+    default, routes = _routing()
+    return routes.get(stage, default)
+
+
+def backend_named(name: str):
+    """The shared instance of a non-Anthropic backend."""
+    with _lock:
+        if name not in _instances:
+            _instances[name] = _create(name)
+        return _instances[name]
+
+
+def backend_for(stage: str):
+    """The backend instance for stage, or None when it runs on the Anthropic client."""
+    name = backend_name(stage)
+    return None if name == ANTHROPIC else backend_named(name)
+
+
+def configured_backends() -> set:
+    """Names of every backend some stage is routed to."""
+    default, routes = _routing()
+    return {default, *routes.values()}
@@ -0,0 +1,101 @@
+"""In-process counters and timings shared by every session in this process."""
+
+import contextvars
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_observations = defaultdict(list)
+
+# Most recent values kept per timing series — enough for percentiles.
+_MAX_OBSERVATIONS = 2000
+
+# While set (see capture()), every event in this context is also appended here.
+_capture = contextvars.ContextVar("metrics_capture", default=None)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+@contextmanager
+def capture(sink: list):
+    """
+    Also append every increment / observation made in this context (and in
+    contexts copied from it) to sink, as (name, value, labels) — e.g. to
+    attribute stage timings and cache outcomes to one request.
+    """
+    token = _capture.set(sink)
+    try:
+        yield sink
+    finally:
+        _capture.reset(token)
+
+
+def increment(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+    sink = _capture.get()
+    if sink is not None:
+        sink.append((name, value, labels))
+
+
+def observe(name: str, value: float, **labels):
+    """Record one measurement (e.g. a latency in ms) for a series."""
+    with _lock:
+        series = _observations[_key(name, labels)]
+        series.append(value)
+        if len(series) > _MAX_OBSERVATIONS:
+            del series[: len(series) - _MAX_OBSERVATIONS]
+    sink = _capture.get()
+    if sink is not None:
+        sink.append((name, value, labels))
+
+
+def counter(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def count(name: str, **labels) -> int:
+    """Number of observations currently kept for a timing series."""
+    with _lock:
+        return len(_observations.get(_key(name, labels), ()))
+
+
+def percentile(name: str, pct: float, **labels) -> float | None:
+    """pct-th percentile (0–100) of a timing series, or None with no data."""
+    with _lock:
+        series = sorted(_observations.get(_key(name, labels), ()))
+    if not series:
+        return None
+    index = min(int(round(pct / 100 * (len(series) - 1))), len(series) - 1)
+    return series[index]
+
+
+def ratio(numerator: str, denominator: str, **labels) -> float | None:
+    """numerator / denominator counters, or None before the first event."""
+    bottom = counter(denominator, **labels)
+    return counter(numerator, **labels) / bottom if bottom else None
+
+
+def snapshot() -> dict:
+    """All counters plus count/p50/p95 per timing series, keyed 'name{label=value,...}'."""
+    def label(key):
+        name, labels = key
+        return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+
+    with _lock:
+        counters = {label(k): v for k, v in _counters.items()}
+        series = {k: sorted(v) for k, v in _observations.items()}
+    timings = {
+        label(k): {
+            "count": len(v),
+            "p50": v[len(v) // 2],
+            "p95": v[min(int(round(0.95 * (len(v) - 1))), len(v) - 1)],
+        }
+        for k, v in series.items() if v
+    }
+    return {"counters": counters, "timings": timings}
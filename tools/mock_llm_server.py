@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Anthropic Messages API with injectable latency spikes.
+
+Point the app, the HTTP service or a load script at it with
+ANTHROPIC_BASE_URL=http://127.0.0.1:8765 (any ANTHROPIC_API_KEY value works).
+Supports plain and streamed (SSE) POST /v1/messages and /v1/messages/count_tokens.
+
+It also answers as an OpenAI-compatible server (POST /v1/chat/completions,
+GET /v1/models) for the "openai" backend: OPENAI_COMPAT_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tools.llm_backends import canned_reply
+
+
+class _Config:
+    latency_ms = 200.0
+    jitter_ms = 50.0
+    spike_rate = 0.0
+    spike_ms = 3000.0
+
+
+def _delay_seconds() -> float:
+    delay = _Config.latency_ms + random.uniform(-_Config.jitter_ms, _Config.jitter_ms)
+    if random.random() < _Config.spike_rate:
+        delay += _Config.spike_ms
+    return max(delay, 0) / 1000
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/v1/models"):
+            self._json({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        if self.path.startswith("/v1/chat/completions"):
+            self._chat_completion(body)
+            return
+        if not self.path.startswith("/v1/messages"):
+            self.send_error(404)
+            return
+        if self.path.startswith("/v1/messages/count_tokens"):
+            self._json({"input_tokens": len(json.dumps(body)) // 4})
+            return
+        text = canned_reply(body.get("system", ""))
+        usage = {"input_tokens": len(json.dumps(body)) // 4, "output_tokens": len(text) // 4}
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "mock"),
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+        }
+        # The injected delay is time to first byte — what a hedge reacts to.
+        time.sleep(_delay_seconds())
+        if body.get("stream"):
+            self._stream(message, text, usage)
+        else:
+            self._json({**message, "content": [{"type": "text", "text": text}], "usage": usage})
+
+    def _chat_completion(self, body: dict):
+        messages = body.get("messages") or []
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        text = canned_reply(system)
+        usage = {"prompt_tokens": len(json.dumps(messages)) // 4, "completion_tokens": len(text) // 4}
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "model": body.get("model", "mock"), "created": int(time.time())}
+        time.sleep(_delay_seconds())
+        if not body.get("stream"):
+            self._json({
+                **base, "object": "chat.completion", "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            })
+            return
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("connection", "close")
+        self.end_headers()
+        chunks = [
+            {**base, "object": "chat.completion.chunk",
+             "choices": [{"index": 0, "delta": {"content": text[i:i + 16]}, "finish_reason": None}]}
+            for i in range(0, len(text), 16)
+        ]
+        chunks.append({**base, "object": "chat.completion.chunk", "choices": [], "usage": usage})
+        try:
+            for chunk in chunks:
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def _json(self, data: dict):
+        payload = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, message: dict, text: str, usage: dict):
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("connection", "close")
+        self.end_headers()
+        start = {**message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 0}}
+        events = [
+            ("message_start", {"type": "message_start", "message": start}),
+            ("content_block_start", {"type": "content_block_start", "index": 0,
+                                     "content_block": {"type": "text", "text": ""}}),
+        ]
+        events += [
+            ("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                     "delta": {"type": "text_delta", "text": text[i:i + 16]}})
+            for i in range(0, len(text), 16)
+        ]
+        events += [
+            ("content_block_stop", {"type": "content_block_stop", "index": 0}),
+            ("message_delta", {"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                               "usage": {"output_tokens": usage["output_tokens"]}}),
+            ("message_stop", {"type": "message_stop"}),
+        ]
+        try:
+            for name, data in events:
+                self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client cancelled this request (e.g. a losing hedge)
+        self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port to bind (default: 8765)")
+    parser.add_argument("--latency-ms", type=float, default=200, help="Typical time to first byte (default: 200)")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="Uniform +/- jitter (default: 50)")
+    parser.add_argument("--spike-rate", type=float, default=0.0, help="Fraction of requests that spike (default: 0)")
+    parser.add_argument("--spike-ms", type=float, default=3000, help="Extra delay of a spike (default: 3000)")
+    args = parser.parse_args()
+
+    _Config.latency_ms = args.latency_ms
+    _Config.jitter_ms = args.jitter_ms
+    _Config.spike_rate = args.spike_rate
+    _Config.spike_ms = args.spike_ms
+
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    server.daemon_threads = True
+    print(f"Mock Messages API on http://{args.host}:{args.port} "
+          f"({args.latency_ms:.0f}ms ±{args.jitter_ms:.0f}, {args.spike_rate:.0%} spikes of +{args.spike_ms:.0f}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
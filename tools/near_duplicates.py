@@ -0,0 +1,381 @@
+"""
+Near-duplicate reuse of component analyses, via a MinHash LSH index per profile.
+
+A raw prompt is reduced to the set of its normalized words and adjacent word
+pairs, so prompts that differ only in whitespace, casing or a word or two
+share most of that set. A prompt whose set has a Jaccard similarity of at
+least ANALYSIS_REUSE_MIN_SIMILARITY with one analysed before, and whose
+differing words are all function words ("a", "the", "please"...), reuses that
+analysis instead of calling the API. "Write a memo for our CTO" never reuses
+the analysis of "Write a memo for our CFO": a changed content word can change
+a component.
+
+The index is shared by every user of the deployment, so reuse is opt-in: set
+ANALYSIS_REUSE_DIR (default "off") to a directory such as .tmp/analysis_index.
+Storage, per target LLM under that directory:
+
+- <llm>.log — append-only, one "<band hashes>\\t<normalized prompt>\\t<components
+  json>" line per analysis. Shared safely by every process (one append per line).
+- <llm>.idx — an immutable snapshot of the log: line offsets and one sorted
+  array per LSH band. Memory-mapped on open, so startup reads no entries and a
+  lookup is _BANDS binary searches plus an exact similarity check of the few
+  candidates (sub-millisecond at millions of entries). Rebuilt in the
+  background once _REBUILD_AFTER lines have been appended after it; until then
+  the newer lines sit in a small in-memory band table.
+
+The signature is _BANDS bands of _ROWS MinHash values. Two prompts become
+candidates when all rows of any band agree: at a similarity of 0.75 that
+happens with probability 1 - (1 - 0.75^3)^8 ≈ 0.99.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from tools import metrics
+
+_DEFAULT_DIR = "off"
+
+
+_BANDS = 8
+_ROWS = 3
+_MASK64 = (1 << 64) - 1
+_ENTRY_MASK = (1 << 32) - 1
+# One multiply-shift hash function per MinHash row, fixed so every process agrees.
+_COEFFICIENTS = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") | 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big"),
+    )
+    for i in range(_BANDS * _ROWS)
+]
+
+# Lines appended after the snapshot before it is rebuilt.
+_REBUILD_AFTER = 2000
+# Candidates taken per band — a huge bucket means a degenerate prompt ("hi").
+_MAX_BUCKET_SCAN = 64
+
+_MAGIC = 0x3158444E48534D  # "MSHNDX1"
+_HEADER = 4                # magic, entries, indexed log bytes, reserved
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+# Words whose change between two prompts leaves their analysis the same.
+_FUNCTION_WORDS = frozenset(
+    "a an the and or but of to in on for with at by from as is are be this that these those it its "
+    "my our your their me us i we you please can could would will should just also some any".split()
+)
+
+
+def _index_dir() -> str:
+    return os.getenv("ANALYSIS_REUSE_DIR", _DEFAULT_DIR)
+
+
+def reuse_enabled() -> bool:
+    return _index_dir().lower() != "off"
+
+
+def min_similarity() -> float:
+    # Read when used: this module is imported before enhance_prompt loads .env.
+    return float(os.getenv("ANALYSIS_REUSE_MIN_SIMILARITY", "0.75"))
+
+
+def normalize_prompt(text: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of a prompt."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def _features(normalized: str) -> frozenset:
+    words = normalized.split()
+    return frozenset(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+def similarity(a: frozenset, b: frozenset) -> float:
+    """Jaccard similarity of two feature sets."""
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def same_content_words(a: frozenset, b: frozenset) -> bool:
+    """True if the single words two feature sets differ in are all function words."""
+    return all(" " in f or f in _FUNCTION_WORDS for f in a ^ b)
+
+
+def _band_values(features: frozenset) -> list:
+    """The 32-bit hash of each band of the MinHash signature."""
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "big") for f in features]
+    signature = [min(((a * h + b) & _MASK64) >> 32 for h in hashes) for a, b in _COEFFICIENTS]
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                b"".join(v.to_bytes(4, "big") for v in signature[band * _ROWS:(band + 1) * _ROWS]),
+                digest_size=4,
+            ).digest(),
+            "big",
+        )
+        for band in range(_BANDS)
+    ]
+
+
+def _parse_bands(line: bytes) -> list | None:
+    if line[_BANDS * 8:_BANDS * 8 + 1] != b"\t":
+        return None
+    try:
+        return [int(line[i * 8:(i + 1) * 8], 16) for i in range(_BANDS)]
+    except ValueError:
+        return None
+
+
+def _slug(target_llm: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", target_llm.lower()).strip("_")
+
+
+class NearDuplicateIndex:
+    """The MinHash index for one target LLM."""
+
+    def __init__(self, directory: str, target_llm: str):
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, f"{_slug(target_llm)}.log")
+        self.idx_path = os.path.join(directory, f"{_slug(target_llm)}.idx")
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._view = None
+        self._mmap = None
+        with self._lock:
+            self._open_snapshot()
+            self._maybe_rebuild()
+
+    # -- snapshot --------------------------------------------------------------
+
+    def _open_snapshot(self):
+        """Map the current .idx (if any) and load the log lines appended after it."""
+        try:
+            mtime = os.path.getmtime(self.idx_path)
+        except OSError:
+            mtime = None
+        view, mapped, entries, indexed_bytes = None, None, 0, 0
+        if mtime is not None:
+            with open(self.idx_path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped).cast("Q")
+            if view[0] == _MAGIC:
+                entries, indexed_bytes = view[1], view[2]
+            else:
+                view.release()
+                mapped.close()
+                view, mapped = None, None
+        if self._view is not None:
+            self._view.release()
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass  # a reader still holds a slice; the map closes when it is freed
+        self._view, self._mmap = view, mapped
+        self._snapshot_mtime = mtime
+        self._entries = entries
+        self._log_read = indexed_bytes
+        self._recent = {}       # (band, value) -> [(offset, length)]
+        self._recent_count = 0
+        self._catch_up()
+
+    def _offsets(self) -> memoryview:
+        return self._view[_HEADER:_HEADER + self._entries + 1]
+
+    def _band(self, band: int) -> memoryview:
+        start = _HEADER + self._entries + 1 + band * self._entries
+        return self._view[start:start + self._entries]
+
+    def _catch_up(self):
+        """Add log lines appended (by any process) since the last read."""
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            return
+        if size <= self._log_read:
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_read)
+            data = f.read(size - self._log_read)
+        # A concurrent append may be mid-line; leave it for the next read.
+        end = data.rfind(b"\n") + 1
+        offset = self._log_read
+        for line in data[:end].splitlines(keepends=True):
+            values = _parse_bands(line)
+            if values is not None:
+                for band, value in enumerate(values):
+                    self._recent.setdefault((band, value), []).append((offset, len(line)))
+                self._recent_count += 1
+            offset += len(line)
+        self._log_read += end
+
+    def _refresh(self):
+        """Pick up a snapshot rebuilt by another process, and newly appended lines."""
+        try:
+            mtime = os.path.getmtime(self.idx_path)
+        except OSError:
+            mtime = None
+        if mtime != self._snapshot_mtime:
+            self._open_snapshot()
+        else:
+            self._catch_up()
+
+    # -- lookup ----------------------------------------------------------------
+
+    def _candidates(self, values: list) -> set:
+        """(offset, length) of log lines that share at least one band with values."""
+        found = set()
+        if self._entries:
+            offsets = self._offsets()
+            for band, value in enumerate(values):
+                keys = self._band(band)
+                i = bisect_left(keys, value << 32)
+                for key in keys[i:i + _MAX_BUCKET_SCAN]:
+                    if key >> 32 != value:
+                        break
+                    entry = key & _ENTRY_MASK
+                    found.add((offsets[entry], offsets[entry + 1] - offsets[entry]))
+        for band, value in enumerate(values):
+            found.update(self._recent.get((band, value), ())[-_MAX_BUCKET_SCAN:])
+        return found
+
+    def lookup(self, raw_prompt: str, threshold: float | None = None) -> dict | None:
+        """
+        The stored components of the most similar earlier prompt that differs
+        only in function words, or None below threshold (default: min_similarity()).
+        """
+        features = _features(normalize_prompt(raw_prompt))
+        if not features:
+            return None
+        values = _band_values(features)
+        with self._lock:
+            self._refresh()
+            candidates = self._candidates(values)
+        if not candidates:
+            return None
+
+        best, best_similarity = None, min_similarity() if threshold is None else threshold
+        with open(self.log_path, "rb") as f:
+            for offset, length in sorted(candidates):
+                f.seek(offset)
+                # Lines the parser skipped can trail an entry; only its first line counts.
+                parts = f.read(length).split(b"\n", 1)[0].split(b"\t", 2)
+                if len(parts) != 3:
+                    continue
+                stored = _features(parts[1].decode())
+                score = similarity(features, stored)
+                if score >= best_similarity and same_content_words(features, stored):
+                    best, best_similarity = parts[2], score
+                    if score == 1.0:
+                        break
+        if best is None:
+            return None
+        try:
+            return json.loads(best)
+        except ValueError:
+            return None
+
+    # -- updates ---------------------------------------------------------------
+
+    def add(self, raw_prompt: str, components: dict):
+        """Append one analysis; lookups in every process see it right away."""
+        normalized = normalize_prompt(raw_prompt)
+        features = _features(normalized)
+        if not features:
+            return
+        bands = "".join(f"{v:08x}" for v in _band_values(features))
+        line = f"{bands}\t{normalized}\t{json.dumps(components, separators=(',', ':'))}\n"
+        # One write() on an O_APPEND file, so concurrent writers never interleave.
+        fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._catch_up()
+            self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        if self._recent_count >= _REBUILD_AFTER and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, name="near-duplicates", daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except OSError:
+            pass  # the in-memory table keeps serving; the next add retries
+        finally:
+            self._rebuilding = False
+
+    def rebuild(self):
+        """Write a new snapshot of the whole log (atomically) and map it."""
+        offsets = array("Q")
+        bands = [[] for _ in range(_BANDS)]
+        offset = 0
+        with open(self.log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                values = _parse_bands(line)
+                if values is not None:
+                    entry = len(offsets)
+                    offsets.append(offset)
+                    for band, value in enumerate(values):
+                        bands[band].append(value << 32 | entry)
+                offset += len(line)
+        entries = len(offsets)
+        offsets.append(offset)
+
+        tmp = f"{self.idx_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as out:
+            array("Q", [_MAGIC, entries, offset, 0]).tofile(out)
+            offsets.tofile(out)
+            for keys in bands:
+                keys.sort()
+                array("Q", keys).tofile(out)
+        os.replace(tmp, self.idx_path)
+        with self._lock:
+            self._open_snapshot()
+
+    def __len__(self) -> int:
+        return self._entries + self._recent_count
+
+
+_indexes_lock = threading.Lock()
+_indexes = {}
+
+
+def _index_for(target_llm: str) -> NearDuplicateIndex:
+    key = (_index_dir(), target_llm)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = NearDuplicateIndex(*key)
+        return _indexes[key]
+
+
+def reusable_components(raw_prompt: str, target_llm: str) -> dict | None:
+    """The analysis of a near-duplicate earlier prompt, or None (also when disabled or unreadable)."""
+    if not reuse_enabled():
+        return None
+    try:
+        components = _index_for(target_llm).lookup(raw_prompt)
+    except OSError:
+        return None
+    metrics.increment("analysis_reuse", outcome="hit" if components else "miss")
+    return components
+
+
+def remember_components(raw_prompt: str, target_llm: str, components: dict):
+    """Store a fresh analysis for reuse; storage errors never fail the request."""
+    if not reuse_enabled() or not any(components.values()):
+        return
+    try:
+        _index_for(target_llm).add(raw_prompt, components)
+    except OSError:
+        pass
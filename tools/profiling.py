@@ -0,0 +1,182 @@
+"""
+On-demand profiling for Streamlit reruns and API calls.
+
+A sampling profiler reads the profiled thread's stack every few milliseconds
+and writes collapsed stacks (one "frame;frame;frame count" line per unique
+stack — the input format of flamegraph.pl and speedscope) to .tmp/profiles/.
+Per-section timers add a timing breakdown, appended as JSON lines to
+reruns.jsonl / calls.jsonl. Everything is a no-op while profiling is off.
+"""
+
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+_DEFAULT_DIR = os.path.join(".tmp", "profiles")
+_KEEP_FILES = 200          # newest .collapsed files kept in the profile directory
+_RECENT_RUNS = 50          # rerun records kept in memory for the in-app panel
+
+# None until first checked: PROFILE is read then, not at import, because this
+# module is imported before enhance_prompt loads .env.
+_enabled = None
+_recent = deque(maxlen=_RECENT_RUNS)
+_write_lock = threading.Lock()
+_current_run = contextvars.ContextVar("profile_run", default=None)
+
+
+def enabled() -> bool:
+    global _enabled
+    if _enabled is None:
+        _enabled = os.getenv("PROFILE", "off") == "on"
+    return _enabled
+
+
+def set_enabled(on: bool):
+    """Switch profiling on or off for the whole process (e.g. from an admin query param)."""
+    global _enabled
+    _enabled = on
+
+
+def _interval_seconds() -> float:
+    return float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+
+
+def _profile_dir() -> str:
+    return os.getenv("PROFILE_DIR", _DEFAULT_DIR)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _Sampler:
+    """Samples one thread's stack on a background thread until stop()."""
+
+    def __init__(self, thread_id: int):
+        self.stacks = Counter()
+        self._thread_id = thread_id
+        self._stop = threading.Event()
+        self._interval = _interval_seconds()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+class _Run:
+    def __init__(self, kind: str, state=None):
+        self.kind = kind
+        self.sections = {}
+        self.started = time.perf_counter()
+        self.sampler = _Sampler(threading.get_ident())
+        self.state_ids = {k: id(v) for k, v in state.items()} if state is not None else None
+        self.token = _current_run.set(self)
+
+
+def _write(kind: str, label: str, record: dict, stacks: Counter):
+    directory = _profile_dir()
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+    safe_label = "".join(ch if ch.isalnum() else "_" for ch in label) or kind
+    with _write_lock:
+        os.makedirs(directory, exist_ok=True)
+        if stacks:
+            path = os.path.join(directory, f"{kind}-{stamp}-{safe_label}.collapsed")
+            with open(path, "w") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+            record["collapsed"] = os.path.basename(path)
+        with open(os.path.join(directory, f"{kind}s.jsonl"), "a") as f:
+            f.write(json.dumps(record) + "\n")
+        collapsed = sorted(n for n in os.listdir(directory) if n.endswith(".collapsed"))
+        for name in collapsed[:-_KEEP_FILES]:
+            os.remove(os.path.join(directory, name))
+
+
+def start_run(kind: str = "rerun", state=None):
+    """
+    Start profiling the current thread (e.g. one Streamlit script run).
+    Pass the session state mapping to also record which keys get reassigned.
+    Returns a run handle for finish_run(), or None when profiling is off.
+    """
+    return _Run(kind, state) if enabled() else None
+
+
+def finish_run(run, label: str = "", state=None) -> dict | None:
+    """Stop a run from start_run(), write its output and return its timing record."""
+    if run is None:
+        return None
+    stacks = run.sampler.stop()
+    _current_run.reset(run.token)
+    record = {
+        "time": time.time(),
+        "label": label,
+        "total_ms": round((time.perf_counter() - run.started) * 1000, 2),
+        "sections": {k: round(v, 2) for k, v in run.sections.items()},
+        "samples": sum(stacks.values()),
+    }
+    if run.state_ids is not None and state is not None:
+        record["state_keys"] = len(state)
+        record["state_changed"] = sorted(
+            str(k) for k, v in state.items() if run.state_ids.get(k) != id(v)
+        )
+    _write(run.kind, label, record, stacks)
+    if run.kind == "rerun":
+        _recent.append(record)
+    return record
+
+
+@contextmanager
+def section(name: str):
+    """Time a block as one entry in the current run's breakdown (free when not profiling)."""
+    run = _current_run.get()
+    if run is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        run.sections[name] = run.sections.get(name, 0) + (time.perf_counter() - started) * 1000
+
+
+@contextmanager
+def profile_call(stage: str):
+    """
+    Profile one upstream API call: a section of the surrounding run when there
+    is one, otherwise a run of its own (worker threads) written to calls.jsonl.
+    """
+    if not enabled():
+        yield
+        return
+    if _current_run.get() is not None:
+        with section(f"api.{stage}"):
+            yield
+        return
+    run = _Run("call")
+    try:
+        yield
+    finally:
+        finish_run(run, label=stage)
+
+
+def recent_runs(limit: int = 20) -> list:
+    """Timing records of the most recent profiled reruns, newest first."""
+    return list(reversed(_recent))[:limit]
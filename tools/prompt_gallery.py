@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Precomputed enhancements for the most frequent starter prompts.
+
+An offline build (python -m tools.prompt_gallery) mines the enhancement
+history for the top-N normalized raw prompts per target LLM, runs analysis,
+questions and enhancement once for each, and writes a compact read-only
+JSON index (.tmp/gallery.json). The app loads it once per process and serves
+a matching input — exact after normalization, or a close fuzzy match — with
+zero API calls.
+"""
+
+import argparse
+import difflib
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from tools import metrics
+from tools.enhance_prompt import (
+    analyze_prompt_components,
+    build_enhanced_prompt,
+    generate_clarifying_questions,
+    safe_error_message,
+    usage_listener,
+)
+from tools.lint_prompt import repair_prompt
+from tools.near_duplicates import normalize_prompt
+from tools.prompt_history import history_enabled, iter_raw_prompts
+from tools.token_budget import TokenLedger
+
+_DEFAULT_PATH = os.path.join(".tmp", "gallery.json")
+
+# Only short starter prompts are worth precomputing; documents are one-offs.
+MAX_STARTER_CHARS = 300
+
+# Fuzzy match: content-word overlap first, then character similarity.
+_MIN_JACCARD = 0.75
+_MIN_RATIO = 0.85
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from how i in is it me my of on or our "
+    "please so that the this to us we what with you your".split()
+)
+
+
+def _gallery_path() -> str:
+    return os.getenv("PROMPT_GALLERY", _DEFAULT_PATH)
+
+
+def gallery_enabled() -> bool:
+    return _gallery_path().lower() != "off"
+
+
+def _content_words(normalized: str) -> frozenset:
+    return frozenset(w for w in normalized.split() if w not in _STOPWORDS)
+
+
+# ---------------------------------------------------------------------------
+# Lookup
+# ---------------------------------------------------------------------------
+
+
+@lru_cache(maxsize=2)
+def _load(path: str, mtime: float) -> dict:
+    """target_llm -> {"exact": {normalized: entry}, "fuzzy": [(words, normalized, entry)]}."""
+    with open(path) as f:
+        data = json.load(f)
+    index = {}
+    for entry in data["entries"]:
+        by_llm = index.setdefault(entry["target_llm"], {"exact": {}, "fuzzy": []})
+        by_llm["exact"][entry["normalized"]] = entry
+        by_llm["fuzzy"].append((_content_words(entry["normalized"]), entry["normalized"], entry))
+    return index
+
+
+def _index() -> dict:
+    path = _gallery_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    # Keyed on mtime, so a rebuilt gallery is picked up without a restart.
+    try:
+        return _load(path, mtime)
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def load_gallery() -> int:
+    """Load the index now (the app does this at startup); returns the entry count."""
+    return sum(len(by_llm["exact"]) for by_llm in _index().values())
+
+
+def lookup_gallery(raw_prompt: str, target_llm: str) -> dict | None:
+    """
+    The gallery entry for raw_prompt, or None. Entry keys: raw_prompt,
+    normalized, target_llm, count, components, questions, enhanced_prompt,
+    and "match" ("exact" or "fuzzy").
+    """
+    if not gallery_enabled() or not raw_prompt or len(raw_prompt) > MAX_STARTER_CHARS:
+        return None
+    by_llm = _index().get(target_llm)
+    if not by_llm:
+        return None
+    normalized = normalize_prompt(raw_prompt)
+    entry = by_llm["exact"].get(normalized)
+    if entry is not None:
+        metrics.increment("gallery.hit", match="exact")
+        return {**entry, "match": "exact"}
+
+    words = _content_words(normalized)
+    best, best_ratio = None, _MIN_RATIO
+    for entry_words, entry_normalized, entry in by_llm["fuzzy"]:
+        union = len(words | entry_words)
+        if not union or len(words & entry_words) / union < _MIN_JACCARD:
+            continue
+        ratio = difflib.SequenceMatcher(None, normalized, entry_normalized).ratio()
+        if ratio >= best_ratio:
+            best, best_ratio = entry, ratio
+    if best is None:
+        metrics.increment("gallery.miss")
+        return None
+    metrics.increment("gallery.hit", match="fuzzy")
+    return {**best, "match": "fuzzy"}
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+
+def top_prompts(rows, top_n: int, min_count: int = 2) -> dict:
+    """
+    target_llm -> [(normalized, most common original spelling, count)] for the
+    top_n most frequent short prompts seen at least min_count times.
+    rows is an iterable of (raw_prompt, target_llm).
+    """
+    counts, spellings = {}, {}
+    for raw_prompt, target_llm in rows:
+        if len(raw_prompt) > MAX_STARTER_CHARS:
+            continue
+        normalized = normalize_prompt(raw_prompt)
+        if not normalized:
+            continue
+        counts.setdefault(target_llm, Counter())[normalized] += 1
+        spellings.setdefault((target_llm, normalized), Counter())[raw_prompt.strip()] += 1
+    return {
+        llm: [
+            (normalized, spellings[(llm, normalized)].most_common(1)[0][0], n)
+            for normalized, n in counter.most_common(top_n)
+            if n >= min_count
+        ]
+        for llm, counter in counts.items()
+    }
+
+
+def build_gallery(top_n: int = 25, min_count: int = 2, path: str | None = None) -> dict:
+    """
+    Precompute the top prompts from the enhancement history and write the
+    gallery atomically. Returns {"entries", "input_tokens", "output_tokens", "errors"}.
+    """
+    if not history_enabled():
+        raise ValueError("The enhancement history is off; set PROMPT_HISTORY_DB to build the gallery from it.")
+    ledger = TokenLedger()
+    entries, errors = [], []
+    for llm, prompts in top_prompts(iter_raw_prompts(MAX_STARTER_CHARS), top_n, min_count).items():
+        for normalized, raw_prompt, count in prompts:
+            try:
+                with usage_listener(ledger.record):
+                    components = analyze_prompt_components(raw_prompt, llm)
+                    questions = generate_clarifying_questions(raw_prompt, llm, components)
+                    enhanced = build_enhanced_prompt(raw_prompt, llm, components, {})
+                    enhanced, _ = repair_prompt(enhanced, llm, components, {})
+            except Exception as e:
+                errors.append(f"{llm}: {raw_prompt[:40]!r}: {safe_error_message(e)}")
+                continue
+            entries.append({
+                "raw_prompt": raw_prompt,
+                "normalized": normalized,
+                "target_llm": llm,
+                "count": count,
+                "components": components,
+                "questions": questions,
+                "enhanced_prompt": enhanced,
+            })
+
+    path = path or _gallery_path()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"built_at": time.time(), "entries": entries}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+    return {
+        "entries": len(entries),
+        "input_tokens": sum(e["input_tokens"] for e in ledger.entries),
+        "output_tokens": sum(e["output_tokens"] for e in ledger.entries),
+        "errors": errors,
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=25, help="Prompts per target LLM (default: 25)")
+    parser.add_argument("--min-count", type=int, default=2, help="Minimum times a prompt was seen (default: 2)")
+    parser.add_argument("--out", default=None, help=f"Output path (default: PROMPT_GALLERY or {_DEFAULT_PATH})")
+    args = parser.parse_args()
+    try:
+        result = build_gallery(args.top, args.min_count, args.out)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(result, indent=2))
+    sys.exit(1 if result["errors"] and not result["entries"] else 0)
+
+
+if __name__ == "__main__":
+    main()
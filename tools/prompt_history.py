@@ -0,0 +1,196 @@
+"""Append-only enhancement history in SQLite with an FTS5 full-text index.
+
+Opt-in (PROMPT_HISTORY_DB=<path>): the history is one store for the whole
+deployment, so everyone who can open the app can search and reuse every
+recorded prompt and answer. Enable it only where users share a trust boundary.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+_DEFAULT_DB = "off"   # opt-in, e.g. PROMPT_HISTORY_DB=.tmp/history.db
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id              INTEGER PRIMARY KEY,
+    created_at      REAL NOT NULL,
+    raw_prompt      TEXT NOT NULL,
+    target_llm      TEXT NOT NULL,
+    components      TEXT NOT NULL,
+    answers         TEXT NOT NULL,
+    enhanced_prompt TEXT NOT NULL,
+    input_tokens    INTEGER NOT NULL,
+    output_tokens   INTEGER NOT NULL,
+    latency_ms      REAL NOT NULL
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+    raw_prompt, enhanced_prompt,
+    content='history', content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts(rowid, raw_prompt, enhanced_prompt)
+    VALUES (new.id, new.raw_prompt, new.enhanced_prompt);
+END;
+
+CREATE TRIGGER IF NOT EXISTS history_no_update BEFORE UPDATE ON history BEGIN
+    SELECT RAISE(ABORT, 'history is append-only');
+END;
+
+CREATE TRIGGER IF NOT EXISTS history_no_delete BEFORE DELETE ON history BEGIN
+    SELECT RAISE(ABORT, 'history is append-only');
+END;
+"""
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+# Too common to say anything about similarity between two prompts.
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from how i in is it me my of on or our "
+    "so that the this to us we what with you your".split()
+)
+
+_schema_lock = threading.Lock()
+_schema_ready = set()
+
+
+def _db_path() -> str:
+    return os.getenv("PROMPT_HISTORY_DB", _DEFAULT_DB)
+
+
+def history_enabled() -> bool:
+    return _db_path().lower() != "off"
+
+
+def _connect() -> sqlite3.Connection:
+    path = _db_path()
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.row_factory = sqlite3.Row
+    with _schema_lock:
+        if path not in _schema_ready:
+            conn.executescript(_SCHEMA)
+            _schema_ready.add(path)
+    return conn
+
+
+def _row_to_entry(row: sqlite3.Row) -> dict:
+    entry = dict(row)
+    entry["components"] = json.loads(entry["components"])
+    entry["answers"] = json.loads(entry["answers"])
+    return entry
+
+
+def _match_query(text: str, max_terms: int = 32) -> str:
+    """Turn free text into a safe FTS5 OR-query of quoted terms."""
+    terms = list(dict.fromkeys(
+        w for w in (m.lower() for m in _WORD.findall(text))
+        if len(w) > 1 and w not in _STOPWORDS
+    ))
+    return " OR ".join(f'"{t}"' for t in terms[:max_terms])
+
+
+def record_enhancement(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    answers: dict,
+    enhanced_prompt: str,
+    input_tokens: int = 0,
+    output_tokens: int = 0,
+    latency_ms: float = 0.0,
+) -> int:
+    """Append one finished enhancement. Returns its history id."""
+    conn = _connect()
+    try:
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO history (created_at, raw_prompt, target_llm, components, answers, "
+                "enhanced_prompt, input_tokens, output_tokens, latency_ms) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(), raw_prompt, target_llm,
+                    json.dumps(components or {}), json.dumps(answers or {}),
+                    enhanced_prompt, input_tokens, output_tokens, latency_ms,
+                ),
+            )
+        return cur.lastrowid
+    finally:
+        conn.close()
+
+
+def iter_raw_prompts(max_chars: int | None = None):
+    """Yield (raw_prompt, target_llm) for every recorded enhancement, optionally only short ones."""
+    sql = "SELECT raw_prompt, target_llm FROM history"
+    params = ()
+    if max_chars is not None:
+        sql += " WHERE length(raw_prompt) <= ?"
+        params = (max_chars,)
+    conn = _connect()
+    try:
+        yield from ((r["raw_prompt"], r["target_llm"]) for r in conn.execute(sql, params))
+    finally:
+        conn.close()
+
+
+def iter_entries(limit: int | None = None):
+    """Yield recorded enhancements (dicts, newest first), up to limit."""
+    sql = "SELECT * FROM history ORDER BY id DESC"
+    params = ()
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = (limit,)
+    conn = _connect()
+    try:
+        yield from (_row_to_entry(r) for r in conn.execute(sql, params))
+    finally:
+        conn.close()
+
+
+def search_history(query: str, target_llm: str | None = None, limit: int = 10) -> list:
+    """
+    Full-text search over raw and enhanced prompts, best matches first.
+    Returns a list of history entries (dicts) — empty when nothing matches.
+    """
+    match = _match_query(query)
+    if not match:
+        return []
+    sql = (
+        "SELECT h.* FROM history_fts JOIN history h ON h.id = history_fts.rowid "
+        "WHERE history_fts MATCH ?"
+    )
+    params = [match]
+    if target_llm:
+        sql += " AND h.target_llm = ?"
+        params.append(target_llm)
+    sql += " ORDER BY bm25(history_fts) LIMIT ?"
+    params.append(limit)
+
+    conn = _connect()
+    try:
+        return [_row_to_entry(r) for r in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def similar_prompts(raw_prompt: str, target_llm: str, limit: int = 3) -> list:
+    """Past enhancements for target_llm whose raw prompt is closest to raw_prompt."""
+    match = _match_query(raw_prompt)
+    if not match:
+        return []
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT h.* FROM history_fts JOIN history h ON h.id = history_fts.rowid "
+            "WHERE history_fts MATCH ? AND h.target_llm = ? "
+            "ORDER BY bm25(history_fts, 1.0, 0.0) LIMIT ?",
+            (f"raw_prompt : ({match})", target_llm, limit),
+        )
+        return [_row_to_entry(r) for r in rows]
+    finally:
+        conn.close()
@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+"""
+Per-user and per-team daily token quotas and spend, shared by every process.
+
+    python -m tools.quota set-limit user alice 500000
+    python -m tools.quota set-limit team research none
+    python -m tools.quota set-team alice research
+    python -m tools.quota report --scope team --since 2026-10-01
+
+Limits, team membership and per-day usage live in SQLite (WAL) at QUOTA_DB
+(default .tmp/quota.db; "off" disables quotas). Accounts without a limit of
+their own get QUOTA_USER_DAILY_TOKENS / QUOTA_TEAM_DAILY_TOKENS. Only
+requests identified by the QUOTA_USER_HEADER header are metered.
+
+Checks never wait on the database. A process leases a slice of an account's
+remaining quota for the day in one short write transaction, and then reserves
+each call's estimated tokens from that lease in memory (metered()). After the
+call, the reservation is settled with the actual usage (settle()). Settled
+usage is written back by a background thread about once a second, a lease
+that runs low is renewed, and an idle lease is handed back. If a process dies,
+the other processes reclaim its leases once they expire; at most its last
+second of usage is lost. Near the limit, leases shrink to a quarter of what
+is left, so idle leases in other processes strand little of the quota.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+
+from tools import metrics
+
+_DEFAULT_DB_PATH = os.path.join(".tmp", "quota.db")
+
+# Settings below are read when used, not at import: this module is imported
+# before enhance_prompt loads .env.
+_LEASE_SECONDS = 30.0     # other processes reclaim a lease this long after its last write-back
+_LEASE_MARGIN = 5.0       # a lease is renewed rather than used this close to expiring
+_IDLE_SECONDS = 5.0       # an unused lease is handed back after this long
+_FLUSH_SECONDS = 1.0
+_TEAM_CACHE_SECONDS = 60.0
+
+SCOPES = ("user", "team")
+
+_SCHEMA = """
+PRAGMA journal_mode=WAL;
+
+CREATE TABLE IF NOT EXISTS limits (
+    scope        TEXT NOT NULL,
+    name         TEXT NOT NULL,
+    daily_tokens INTEGER,               -- NULL = unlimited
+    PRIMARY KEY (scope, name)
+);
+
+CREATE TABLE IF NOT EXISTS members (
+    user TEXT PRIMARY KEY,
+    team TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS usage (
+    scope         TEXT NOT NULL,
+    name          TEXT NOT NULL,
+    day           TEXT NOT NULL,
+    input_tokens  INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    calls         INTEGER NOT NULL DEFAULT 0,
+    leased        INTEGER NOT NULL DEFAULT 0,   -- granted to live leases, not yet used
+    PRIMARY KEY (scope, name, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS leases (
+    id         TEXT PRIMARY KEY,
+    scope      TEXT NOT NULL,
+    name       TEXT NOT NULL,
+    day        TEXT NOT NULL,
+    pid        INTEGER NOT NULL,
+    granted    INTEGER NOT NULL,
+    settled    INTEGER NOT NULL DEFAULT 0,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS leases_account ON leases(scope, name, day);
+"""
+
+_UPSERT_USAGE = (
+    "INSERT INTO usage (scope, name, day, input_tokens, output_tokens, calls, leased) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (scope, name, day) DO UPDATE SET "
+    "input_tokens = input_tokens + excluded.input_tokens, "
+    "output_tokens = output_tokens + excluded.output_tokens, "
+    "calls = calls + excluded.calls, "
+    "leased = MAX(leased + excluded.leased, 0)"
+)
+
+
+class QuotaExceeded(Exception):
+    """An account's daily token quota cannot cover a call. The message is safe to show."""
+
+    def __init__(self, scope: str, name: str):
+        self.scope = scope
+        self.name = name
+        whose = "Your team's" if scope == "team" else "Your"
+        super().__init__(f"{whose} daily token quota has been reached. It resets at midnight.")
+
+
+def _db_path() -> str:
+    return os.getenv("QUOTA_DB", _DEFAULT_DB_PATH)
+
+
+def _lease_tokens() -> int:
+    """Tokens a process leases at a time (less when the account is nearly used up)."""
+    return int(os.getenv("QUOTA_LEASE_TOKENS", "20000"))
+
+
+def usd_per_mtok() -> tuple:
+    """(input, output) spend in USD per million tokens (claude-haiku-4-5 list prices by default)."""
+    return (
+        float(os.getenv("QUOTA_INPUT_USD_PER_MTOK", "1.0")),
+        float(os.getenv("QUOTA_OUTPUT_USD_PER_MTOK", "5.0")),
+    )
+
+
+def user_header() -> str:
+    """
+    Header with the authenticated user, set by the auth proxy in front of the
+    app/API. Never trust it without one: clients can send any header. Quotas
+    only apply to requests that carry it — a client address is shared by
+    everyone behind a proxy (or on localhost), so it is no account.
+    """
+    return os.getenv("QUOTA_USER_HEADER", "")
+
+
+def quota_enabled() -> bool:
+    return _db_path().lower() != "off"
+
+
+def _parse_limit(value: str) -> int | None:
+    """Daily tokens from a setting or CLI argument: "" / "none" = unlimited, 0 = blocked."""
+    value = value.strip().lower()
+    if value in ("", "none"):
+        return None
+    tokens = int(value)
+    if tokens < 0:
+        raise ValueError("tokens must be 0 or more")
+    return tokens
+
+
+def _default_limit(scope: str) -> int | None:
+    if scope == "user":
+        return _parse_limit(os.getenv("QUOTA_USER_DAILY_TOKENS", "1000000"))
+    return _parse_limit(os.getenv("QUOTA_TEAM_DAILY_TOKENS", "none"))
+
+
+def _cost(input_tokens: int, output_tokens: int) -> float:
+    input_rate, output_rate = usd_per_mtok()
+    return round((input_tokens * input_rate + output_tokens * output_rate) / 1e6, 4)
+
+
+class _Lease:
+    """This process's share of one account's quota for one day."""
+
+    __slots__ = ("id", "granted", "settled", "reserved", "expires_at", "last_used")
+
+    def __init__(self, lease_id: str, granted: int, reserved: int, now: float):
+        self.id = lease_id
+        self.granted = granted
+        self.settled = 0          # usage written back against this lease
+        self.reserved = reserved  # estimates of calls in flight
+        self.expires_at = now + _LEASE_SECONDS
+        self.last_used = now
+
+
+class _Reservation:
+    """The estimated tokens of one call, held until settle() or release()."""
+
+    def __init__(self, engine: "QuotaEngine", keys: list, tokens: int):
+        self._engine = engine
+        self._keys = keys
+        self._tokens = tokens
+        self._done = False
+
+    def settle(self, input_tokens: int, output_tokens: int):
+        """Replace the estimate with the call's actual usage (more calls add usage, e.g. a hedge)."""
+        tokens = 0 if self._done else self._tokens
+        self._done = True
+        self._engine._settle(self._keys, tokens, input_tokens, output_tokens, 1)
+
+    def release(self):
+        """Drop the estimate of a call that reported no usage."""
+        if not self._done:
+            self._done = True
+            self._engine._settle(self._keys, self._tokens, 0, 0, 0)
+
+
+class QuotaEngine:
+    """The leases and unwritten usage of this process for one quota database."""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._leases = {}         # (scope, name, day) -> _Lease
+        self._pending = {}        # (scope, name, day) -> [input, output, calls] not yet written
+        self._renew_locks = {}
+        self._teams = {}          # user -> (team, fetched_at)
+        self._conn().executescript(_SCHEMA)
+        self._stop = threading.Event()
+        threading.Thread(target=self._flush_loop, name="quota", daemon=True).start()
+        atexit.register(self.close)
+
+    # -- storage ---------------------------------------------------------------
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _write_back(self, conn, key: tuple, lease: _Lease | None, pending: list, close: bool, now: float) -> bool:
+        """
+        Add pending usage to the account and charge it to lease (closing the
+        lease returns its unused grant). False if another process has already
+        reclaimed the lease.
+        """
+        used = pending[0] + pending[1]
+        leased_delta, alive = 0, False
+        if lease is not None:
+            row = conn.execute("SELECT granted, settled FROM leases WHERE id = ?", (lease.id,)).fetchone()
+            if row is not None:
+                alive = True
+                granted, settled = row
+                outstanding = max(granted - settled, 0)
+                left = max(outstanding - used, 0)
+                if close:
+                    leased_delta = -outstanding
+                    conn.execute("DELETE FROM leases WHERE id = ?", (lease.id,))
+                else:
+                    leased_delta = left - outstanding
+                    conn.execute(
+                        "UPDATE leases SET settled = settled + ?, expires_at = ? WHERE id = ?",
+                        (used, now + _LEASE_SECONDS, lease.id),
+                    )
+        if used or pending[2] or leased_delta:
+            conn.execute(_UPSERT_USAGE, (*key, pending[0], pending[1], pending[2], leased_delta))
+        return alive
+
+    # -- leases ----------------------------------------------------------------
+
+    def team_of(self, user: str) -> str | None:
+        now = time.monotonic()
+        cached = self._teams.get(user)
+        if cached is not None and now - cached[1] < _TEAM_CACHE_SECONDS:
+            return cached[0]
+        row = self._conn().execute("SELECT team FROM members WHERE user = ?", (user,)).fetchone()
+        team = row[0] if row else None
+        self._teams[user] = (team, now)
+        return team
+
+    def _keys(self, user: str) -> list:
+        day = date.today().isoformat()
+        keys = [("user", user, day)]
+        team = self.team_of(user)
+        if team:
+            keys.append(("team", team, day))
+        return keys
+
+    def _renew(self, key: tuple, tokens: int):
+        """Swap this process's lease on key for a new one that covers tokens more."""
+        with self._renew_locks.setdefault(key, threading.Lock()):
+            now = time.time()
+            with self._lock:
+                lease = self._leases.get(key)
+                if lease is not None and lease.expires_at - _LEASE_MARGIN > now and self._available(key, lease) >= tokens:
+                    return  # another thread renewed it meanwhile
+                self._leases.pop(key, None)
+                pending = self._pending.pop(key, None) or [0, 0, 0]
+                in_flight = lease.reserved if lease is not None else 0
+            try:
+                with self._transaction() as conn:
+                    self._write_back(conn, key, lease, pending, close=True, now=now)
+                    self._reclaim_expired(conn, key, now)
+                    # Calls in flight on the old lease move to the new one, even
+                    # when the account cannot cover anything more.
+                    grant = self._grant(conn, key, tokens + in_flight) or in_flight
+                    new = None
+                    if grant:
+                        new = _Lease(uuid.uuid4().hex, grant, in_flight, now)
+                        conn.execute(
+                            "INSERT INTO leases (id, scope, name, day, pid, granted, expires_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (new.id, *key, os.getpid(), grant, new.expires_at),
+                        )
+                        conn.execute(_UPSERT_USAGE, (*key, 0, 0, 0, grant))
+            except sqlite3.Error:
+                self._restore(key, pending)
+                raise
+            metrics.increment("quota.leases", scope=key[0])
+            if new is not None:
+                with self._lock:
+                    self._leases[key] = new
+
+    def _reclaim_expired(self, conn, key: tuple, now: float):
+        """Return the unused grants of leases whose process stopped writing back."""
+        expired = conn.execute(
+            "SELECT id, granted, settled FROM leases WHERE scope = ? AND name = ? AND day = ? AND expires_at < ?",
+            (*key, now),
+        ).fetchall()
+        if expired:
+            conn.executemany("DELETE FROM leases WHERE id = ?", [(row[0],) for row in expired])
+            unused = sum(max(granted - settled, 0) for _, granted, settled in expired)
+            conn.execute(_UPSERT_USAGE, (*key, 0, 0, 0, -unused))
+
+    def _grant(self, conn, key: tuple, tokens: int) -> int:
+        """Tokens to lease: 0 when the account cannot cover tokens."""
+        row = conn.execute(
+            "SELECT daily_tokens FROM limits WHERE scope = ? AND name = ?", key[:2]
+        ).fetchone()
+        limit = row[0] if row is not None else _default_limit(key[0])
+        if limit is None:
+            return max(tokens, _lease_tokens())
+        row = conn.execute(
+            "SELECT input_tokens + output_tokens, leased FROM usage WHERE scope = ? AND name = ? AND day = ?", key
+        ).fetchone()
+        available = limit - sum(row) if row else limit
+        grant = min(available, max(tokens, min(_lease_tokens(), available // 4)))
+        return grant if grant >= tokens else 0
+
+    def _available(self, key: tuple, lease: _Lease) -> int:
+        pending = self._pending.get(key)
+        used = pending[0] + pending[1] if pending else 0
+        return lease.granted - lease.settled - used - lease.reserved
+
+    def _restore(self, key: tuple, pending: list):
+        with self._lock:
+            current = self._pending.setdefault(key, [0, 0, 0])
+            for i in range(3):
+                current[i] += pending[i]
+
+    # -- calls -----------------------------------------------------------------
+
+    def _take(self, key: tuple, tokens: int) -> bool:
+        for attempt in range(2):
+            now = time.time()
+            with self._lock:
+                lease = self._leases.get(key)
+                if (
+                    lease is not None
+                    and lease.expires_at - _LEASE_MARGIN > now
+                    and self._available(key, lease) >= tokens
+                ):
+                    lease.reserved += tokens
+                    lease.last_used = now
+                    return True
+            if attempt == 0:
+                self._renew(key, tokens)
+        return False
+
+    def reserve(self, user: str, tokens: int) -> _Reservation:
+        """
+        Debit tokens from user's (and their team's) quota. Raises QuotaExceeded
+        when either cannot cover them; settle or release the reservation after the call.
+        """
+        keys = self._keys(user)
+        taken = []
+        for key in keys:
+            if not self._take(key, tokens):
+                self._settle(taken, tokens, 0, 0, 0)
+                metrics.increment("quota.exceeded", scope=key[0])
+                raise QuotaExceeded(key[0], key[1])
+            taken.append(key)
+        return _Reservation(self, taken, tokens)
+
+    def _settle(self, keys: list, tokens: int, input_tokens: int, output_tokens: int, calls: int):
+        with self._lock:
+            for key in keys:
+                lease = self._leases.get(key)
+                if lease is not None:
+                    lease.reserved = max(lease.reserved - tokens, 0)
+                if calls:
+                    pending = self._pending.setdefault(key, [0, 0, 0])
+                    pending[0] += input_tokens
+                    pending[1] += output_tokens
+                    pending[2] += calls
+
+    # -- write-back ------------------------------------------------------------
+
+    def flush(self, close_all: bool = False):
+        """Write back pending usage, keep busy leases alive and hand back idle ones."""
+        now = time.time()
+        today = date.today().isoformat()
+        work = []
+        with self._lock:
+            for key in set(self._pending) | set(self._leases):
+                lease = self._leases.get(key)
+                pending = self._pending.pop(key, None) or [0, 0, 0]
+                close = lease is not None and lease.reserved == 0 and (
+                    close_all or key[2] != today or now - lease.last_used > _IDLE_SECONDS
+                )
+                if close:
+                    del self._leases[key]
+                    if key[2] != today:
+                        self._renew_locks.pop(key, None)
+                keep_alive = lease is not None and lease.expires_at - now < _LEASE_SECONDS / 2
+                if any(pending) or close or keep_alive:
+                    if lease is not None and not close:
+                        lease.settled += pending[0] + pending[1]
+                    work.append((key, lease, pending, close))
+        if not work:
+            return
+        try:
+            with self._transaction() as conn:
+                alive = [self._write_back(conn, *item, now=now) for item in work]
+        except sqlite3.Error:
+            metrics.increment("quota.errors")
+            for key, lease, pending, close in work:
+                if lease is not None and not close:
+                    lease.settled -= pending[0] + pending[1]
+                self._restore(key, pending)
+            return
+        with self._lock:
+            for (key, lease, pending, close), lease_alive in zip(work, alive):
+                if lease is not None and not close:
+                    # A reclaimed lease is no longer ours to spend; the next call renews.
+                    lease.expires_at = now + _LEASE_SECONDS if lease_alive else 0
+
+    def _flush_loop(self):
+        while not self._stop.wait(_FLUSH_SECONDS):
+            try:
+                self.flush()
+            except sqlite3.Error:
+                metrics.increment("quota.errors")
+
+    def close(self):
+        """Write everything back and return every lease (at exit)."""
+        self._stop.set()
+        try:
+            self.flush(close_all=True)
+        except sqlite3.Error:
+            pass
+
+    # -- reporting -------------------------------------------------------------
+
+    def remaining(self, user: str) -> int | None:
+        """Tokens user can still spend today (the lower of user and team), None if unlimited."""
+        result = None
+        conn = self._conn()
+        for key in self._keys(user):
+            row = conn.execute(
+                "SELECT daily_tokens FROM limits WHERE scope = ? AND name = ?", key[:2]
+            ).fetchone()
+            limit = row[0] if row is not None else _default_limit(key[0])
+            if limit is None:
+                continue
+            row = conn.execute(
+                "SELECT input_tokens + output_tokens, leased FROM usage WHERE scope = ? AND name = ? AND day = ?", key
+            ).fetchone()
+            used, leased = row or (0, 0)
+            with self._lock:
+                # This process's own lease is counted as its local usage instead.
+                lease = self._leases.get(key)
+                pending = self._pending.get(key) or [0, 0, 0]
+                own = max(lease.granted - lease.settled, 0) if lease is not None else 0
+                in_flight = lease.reserved if lease is not None else 0
+            left = max(limit - used - (leased - own) - pending[0] - pending[1] - in_flight, 0)
+            result = left if result is None else min(result, left)
+        return result
+
+    def report(self, scope: str = "user", since: str | None = None, until: str | None = None, name: str | None = None) -> list:
+        """
+        Usage per account of scope from since to until (ISO days, both
+        inclusive; default today), most tokens first. Each row: name,
+        input_tokens, output_tokens, tokens, calls, cost_usd, daily_limit
+        (None = unlimited) and remaining_today.
+        """
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown scope: {scope}. Choose one of: {', '.join(SCOPES)}.")
+        self.flush()
+        today = date.today().isoformat()
+        sql = (
+            "SELECT name, SUM(input_tokens), SUM(output_tokens), SUM(calls), "
+            "SUM(CASE WHEN day = ? THEN input_tokens + output_tokens + leased ELSE 0 END) "
+            "FROM usage WHERE scope = ? AND day BETWEEN ? AND ?"
+        )
+        params = [today, scope, since or today, until or today]
+        if name is not None:
+            sql += " AND name = ?"
+            params.append(name)
+        sql += " GROUP BY name ORDER BY SUM(input_tokens) + SUM(output_tokens) DESC"
+        conn = self._conn()
+        limits = dict(conn.execute("SELECT name, daily_tokens FROM limits WHERE scope = ?", (scope,)).fetchall())
+        rows = []
+        for account, input_tokens, output_tokens, calls, committed_today in conn.execute(sql, params):
+            limit = limits[account] if account in limits else _default_limit(scope)
+            rows.append({
+                "name": account,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "tokens": input_tokens + output_tokens,
+                "calls": calls,
+                "cost_usd": _cost(input_tokens, output_tokens),
+                "daily_limit": limit,
+                "remaining_today": None if limit is None else max(limit - committed_today, 0),
+            })
+        return rows
+
+    # -- administration --------------------------------------------------------
+
+    def set_limit(self, scope: str, name: str, daily_tokens: int | None):
+        """Set an account's daily limit (None = unlimited); leases already granted stand."""
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown scope: {scope}. Choose one of: {', '.join(SCOPES)}.")
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO limits (scope, name, daily_tokens) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, name) DO UPDATE SET daily_tokens = excluded.daily_tokens",
+                (scope, name, daily_tokens),
+            )
+
+    def clear_limit(self, scope: str, name: str):
+        """Return an account to the default limit of its scope."""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM limits WHERE scope = ? AND name = ?", (scope, name))
+
+    def set_team(self, user: str, team: str | None):
+        """Put user in team (None removes them from their team). Other processes see it within a minute."""
+        with self._transaction() as conn:
+            if team:
+                conn.execute(
+                    "INSERT INTO members (user, team) VALUES (?, ?) "
+                    "ON CONFLICT (user) DO UPDATE SET team = excluded.team",
+                    (user, team),
+                )
+            else:
+                conn.execute("DELETE FROM members WHERE user = ?", (user,))
+        self._teams.pop(user, None)
+
+
+# ---------------------------------------------------------------------------
+# Per-call metering
+# ---------------------------------------------------------------------------
+
+_engines_lock = threading.Lock()
+_engines = {}
+
+# The user API calls in the current context are charged to (charged_to()),
+# and the reservation of the call in progress (metered()).
+_account = ContextVar("quota_account", default=None)
+_reservation = ContextVar("quota_reservation", default=None)
+
+
+def engine() -> QuotaEngine:
+    path = _db_path()
+    with _engines_lock:
+        if path not in _engines:
+            _engines[path] = QuotaEngine(path)
+        return _engines[path]
+
+
+def account_for(headers) -> str | None:
+    """The user to charge a request to: the auth proxy's user_header(), else None (not metered)."""
+    header = user_header()
+    user = headers.get(header) if header else None
+    if isinstance(user, str) and user.strip():
+        return user.strip()[:200]
+    return None
+
+
+@contextmanager
+def charged_to(user: str | None):
+    """Charge every API call inside the block to user (no-op for None)."""
+    token = _account.set(user)
+    try:
+        yield
+    finally:
+        _account.reset(token)
+
+
+@contextmanager
+def metered(estimate):
+    """
+    Reserve one call's worst-case tokens (estimate() is only evaluated when
+    quotas apply) for the current account before the call; raises
+    QuotaExceeded. Report the actual usage with settle() inside the block.
+    """
+    user = _account.get()
+    if user is None or not quota_enabled():
+        yield
+        return
+    try:
+        reservation = engine().reserve(user, estimate())
+    except sqlite3.Error:
+        # The quota store is unavailable: fail open rather than fail every call.
+        metrics.increment("quota.errors")
+        yield
+        return
+    token = _reservation.set(reservation)
+    try:
+        yield
+    finally:
+        _reservation.reset(token)
+        reservation.release()
+
+
+def settle(input_tokens: int, output_tokens: int):
+    """Charge the actual usage of the call in progress (see metered())."""
+    reservation = _reservation.get()
+    if reservation is not None:
+        reservation.settle(input_tokens, output_tokens)
+
+
+def remaining_tokens(user: str | None) -> int | None:
+    """Tokens user can still spend today, None if unlimited (or quotas are off, or no user)."""
+    if user is None or not quota_enabled():
+        return None
+    try:
+        return engine().remaining(user)
+    except sqlite3.Error:
+        metrics.increment("quota.errors")
+        return None
+
+
+def usage_report(scope: str = "user", since: str | None = None, until: str | None = None, name: str | None = None) -> list:
+    """See QuotaEngine.report()."""
+    return engine().report(scope, since, until, name)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    limit = sub.add_parser("set-limit", help="Set a user's or team's daily token limit")
+    limit.add_argument("scope", choices=SCOPES)
+    limit.add_argument("name")
+    limit.add_argument("tokens", help="Tokens per day (0 blocks), 'none' for unlimited or 'default'")
+    team = sub.add_parser("set-team", help="Put a user in a team ('none' removes them)")
+    team.add_argument("user")
+    team.add_argument("team")
+    report = sub.add_parser("report", help="Usage and spend per account")
+    report.add_argument("--scope", choices=SCOPES, default="user")
+    report.add_argument("--since", default=None, help="First day, YYYY-MM-DD (default: today)")
+    report.add_argument("--until", default=None, help="Last day, YYYY-MM-DD (default: today)")
+    report.add_argument("--days", type=int, default=None, help="Instead of --since: the last N days")
+    report.add_argument("--name", default=None, help="Only this user or team")
+    args = parser.parse_args()
+
+    if not quota_enabled():
+        print("Error: quotas are disabled (QUOTA_DB=off).", file=sys.stderr)
+        sys.exit(1)
+    try:
+        quotas = engine()
+        if args.command == "set-limit":
+            if args.tokens == "default":
+                quotas.clear_limit(args.scope, args.name)
+                shown = "default"
+            else:
+                tokens = _parse_limit(args.tokens)
+                quotas.set_limit(args.scope, args.name, tokens)
+                shown = "unlimited" if tokens is None else f"{tokens:,}"
+            print(f"{args.scope} {args.name}: daily limit {shown}")
+        elif args.command == "set-team":
+            quotas.set_team(args.user, None if args.team == "none" else args.team)
+            print(f"{args.user}: team {args.team}")
+        else:
+            since = args.since
+            if args.days:
+                since = (date.today() - timedelta(days=args.days - 1)).isoformat()
+            print(json.dumps(quotas.report(args.scope, since, args.until, args.name), indent=2))
+    except (sqlite3.Error, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Compact serialization for stored enhancement records.
+
+    python -m tools.record_codec train [--limit 20000] [--size 65536]
+
+Raw prompts, component JSON, enhanced prompts and inferred examples repeat
+heavily across users and profiles. This module encodes them as compact
+blobs (no store uses it yet; history and the gallery still keep JSON):
+
+- a tagged binary encoding of the JSON value, in which dict keys and common
+  short values (profile names, component names, record fields) are one-byte
+  references into an interned table — decoded records share those string
+  objects instead of holding a copy each;
+- then zstd with a dictionary trained on our own history (when the optional
+  zstandard package is installed), or else zlib with a preset dictionary
+  built from the phrases most records share.
+
+train writes the table and dictionary to RECORD_CODEC_DICT (default
+.tmp/record_codec.dict), plus a copy named after its id (<path>.<dict_id>).
+Every blob carries the id of the dictionary it was written with:
+encode_record() writes with the newest dictionary, and decode_record() reads
+a blob with the one it names, so retraining never strands stored blobs.
+Keep the <path>.<dict_id> files for as long as blobs written with them are
+stored.
+tools/benchmark_record_codec.py measures ratio, throughput and memory.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+from tools.enhance_prompt import LLM_PROFILES
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib with a preset dictionary is the fallback
+    zstandard = None
+
+_DEFAULT_PATH = os.path.join(".tmp", "record_codec.dict")
+_MAGIC = b"RCODEC1\n"
+
+# Blob kinds (first byte of every blob).
+_RAW, _ZLIB, _ZSTD = 0, 1, 2
+_KIND_NAMES = {"zlib": _ZLIB, "zstd": _ZSTD}
+
+_ZLIB_LEVEL = 6
+_ZSTD_LEVEL = 9
+_ZLIB_MAX_DICT = 32 * 1024   # zlib only looks back 32 KB
+# Payloads this small are stored uncompressed; a frame would not pay for itself.
+_MIN_COMPRESS = 64
+
+# Interned table: short values seen in at least this share of training records.
+_MAX_INTERNED_VALUE = 40
+_MIN_VALUE_SHARE = 0.01
+_MAX_INTERNED = 1024
+
+# Value tags of the binary encoding.
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT, _INTERNED = range(9)
+
+_RECORD_FIELDS = (
+    "raw_prompt", "target_llm", "components", "answers", "enhanced_prompt",
+    "questions", "component", "question", "inferred_example", "placeholder",
+    "normalized", "count", "created_at", "input_tokens", "output_tokens", "latency_ms",
+)
+
+# Phrase boundaries for the zlib dictionary: after a newline, sentence end or tag.
+_PHRASE_END = re.compile(rb"(?<=[\n.!?>:])")
+
+
+def _dict_path() -> str:
+    return os.getenv("RECORD_CODEC_DICT", _DEFAULT_PATH)
+
+
+def _default_interned() -> list:
+    names = set(_RECORD_FIELDS) | set(LLM_PROFILES)
+    for profile in LLM_PROFILES.values():
+        names.update(profile["components"])
+    return sorted(names)
+
+
+# ---------------------------------------------------------------------------
+# Binary encoding
+# ---------------------------------------------------------------------------
+
+
+def _put_varint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data: bytes, pos: int) -> tuple:
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _pack(value, out: bytearray, ids: dict):
+    if isinstance(value, str):
+        ref = ids.get(value)
+        if ref is not None:
+            out.append(_INTERNED)
+            _put_varint(out, ref)
+        else:
+            data = value.encode("utf-8")
+            out.append(_STR)
+            _put_varint(out, len(data))
+            out += data
+    elif value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _put_varint(out, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += struct.pack("<d", value)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _put_varint(out, len(value))
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError(f"Record keys must be str, not {type(key).__name__}")
+            # A key is its table index, or len(table) + byte length followed by the text.
+            ref = ids.get(key)
+            if ref is not None:
+                _put_varint(out, ref)
+            else:
+                data = key.encode("utf-8")
+                _put_varint(out, len(ids) + len(data))
+                out += data
+            _pack(item, out, ids)
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _put_varint(out, len(value))
+        for item in value:
+            _pack(item, out, ids)
+    else:
+        raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def _unpack(data: bytes, pos: int, table: list) -> tuple:
+    tag = data[pos]
+    pos += 1
+    if tag == _INTERNED:
+        ref, pos = _get_varint(data, pos)
+        return table[ref], pos
+    if tag == _STR:
+        size, pos = _get_varint(data, pos)
+        return data[pos:pos + size].decode("utf-8"), pos + size
+    if tag == _DICT:
+        size, pos = _get_varint(data, pos)
+        result = {}
+        n = len(table)
+        for _ in range(size):
+            ref, pos = _get_varint(data, pos)
+            if ref < n:
+                key = table[ref]
+            else:
+                key = data[pos:pos + ref - n].decode("utf-8")
+                pos += ref - n
+            result[key], pos = _unpack(data, pos, table)
+        return result, pos
+    if tag == _LIST:
+        size, pos = _get_varint(data, pos)
+        result = []
+        for _ in range(size):
+            item, pos = _unpack(data, pos, table)
+            result.append(item)
+        return result, pos
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        n, pos = _get_varint(data, pos)
+        return (n >> 1) ^ -(n & 1), pos
+    if tag == _FLOAT:
+        return struct.unpack_from("<d", data, pos)[0], pos + 8
+    raise ValueError(f"Corrupt record: unknown tag {tag}")
+
+
+# ---------------------------------------------------------------------------
+# Codec
+# ---------------------------------------------------------------------------
+
+
+class RecordCodec:
+    """Encodes JSON-like records to compact blobs and back, with one interned table and dictionary."""
+
+    def __init__(self, interned: list | None = None, kind: str = "zlib", dictionary: bytes = b""):
+        if kind not in _KIND_NAMES:
+            raise ValueError(f"Unknown codec kind: {kind}. Choose one of: {', '.join(_KIND_NAMES)}.")
+        if kind == "zstd" and zstandard is None:
+            raise ValueError("This codec dictionary needs zstd: pip install zstandard")
+        # sys.intern: decoded keys are the same objects as everywhere else they occur.
+        self.interned = [sys.intern(s) for s in (interned if interned is not None else _default_interned())]
+        self.kind = kind
+        self.dictionary = dictionary
+        self._ids = {s: i for i, s in enumerate(self.interned)}
+        self._kind = _KIND_NAMES[kind]
+        digest = hashlib.blake2b(json.dumps([kind, self.interned]).encode() + dictionary, digest_size=4)
+        self.dict_id = digest.digest()
+        self._local = threading.local()   # zstd (de)compressors are not thread-safe
+        self._zstd_dict = (
+            zstandard.ZstdCompressionDict(dictionary) if kind == "zstd" and dictionary else None
+        )
+
+    # -- compression -----------------------------------------------------------
+
+    def _zstd(self):
+        local = self._local
+        if not hasattr(local, "compressor"):
+            options = {"dict_data": self._zstd_dict} if self._zstd_dict is not None else {}
+            local.compressor = zstandard.ZstdCompressor(
+                level=_ZSTD_LEVEL, write_checksum=False, write_dict_id=False, **options
+            )
+            local.decompressor = zstandard.ZstdDecompressor(**options)
+        return local
+
+    def _compress(self, payload: bytes) -> bytes:
+        if self._kind == _ZSTD:
+            return self._zstd().compressor.compress(payload)
+        compressor = (
+            zlib.compressobj(_ZLIB_LEVEL, zlib.DEFLATED, -15, zdict=self.dictionary)
+            if self.dictionary else zlib.compressobj(_ZLIB_LEVEL, zlib.DEFLATED, -15)
+        )
+        return compressor.compress(payload) + compressor.flush()
+
+    def _decompress(self, kind: int, data: bytes) -> bytes:
+        if kind == _ZSTD:
+            return self._zstd().decompressor.decompress(data)
+        decompressor = (
+            zlib.decompressobj(-15, zdict=self.dictionary)
+            if self.dictionary else zlib.decompressobj(-15)
+        )
+        return decompressor.decompress(data) + decompressor.flush()
+
+    # -- records ---------------------------------------------------------------
+
+    def pack(self, record) -> bytes:
+        """The uncompressed binary encoding of record."""
+        out = bytearray()
+        _pack(record, out, self._ids)
+        return bytes(out)
+
+    def unpack(self, payload: bytes):
+        value, _ = _unpack(payload, 0, self.interned)
+        return value
+
+    def encode(self, record) -> bytes:
+        """record (dicts, lists, str, int, float, bool, None) as a blob."""
+        payload = self.pack(record)
+        if len(payload) >= _MIN_COMPRESS:
+            compressed = self._compress(payload)
+            if len(compressed) < len(payload):
+                return bytes((self._kind,)) + self.dict_id + compressed
+        return bytes((_RAW,)) + self.dict_id + payload
+
+    def decode(self, blob: bytes):
+        """The record encoded in blob. Raises ValueError for a blob from another dictionary."""
+        if len(blob) < 5 or blob[0] not in (_RAW, _ZLIB, _ZSTD):
+            raise ValueError("Not a record blob")
+        if blob[1:5] != self.dict_id:
+            raise ValueError(
+                f"Record was encoded with codec dictionary {blob[1:5].hex()}, "
+                f"not the current one ({self.dict_id.hex()})"
+            )
+        kind, data = blob[0], blob[5:]
+        try:
+            payload = data if kind == _RAW else self._decompress(kind, data)
+            return self.unpack(payload)
+        except (zlib.error, IndexError, UnicodeDecodeError, struct.error) as e:
+            raise ValueError(f"Corrupt record: {e}") from e
+        except Exception as e:
+            if zstandard is not None and isinstance(e, zstandard.ZstdError):
+                raise ValueError(f"Corrupt record: {e}") from e
+            raise
+
+    # -- persistence -----------------------------------------------------------
+
+    def save(self, path: str, records: int = 0):
+        """Write the table and dictionary atomically, to path and to its archive copy (see archive_path())."""
+        header = json.dumps(
+            {"kind": self.kind, "interned": self.interned, "records": records, "built_at": time.time()},
+            separators=(",", ":"),
+        ).encode()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The archive copy first: blobs may be written with path as soon as it is replaced.
+        for target in (archive_path(path, self.dict_id), path):
+            tmp = f"{target}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(_MAGIC + len(header).to_bytes(4, "little") + header + self.dictionary)
+            os.replace(tmp, target)
+
+    @classmethod
+    def load(cls, path: str) -> "RecordCodec":
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(_MAGIC):
+            raise ValueError(f"{path} is not a record codec dictionary")
+        start = len(_MAGIC) + 4
+        size = int.from_bytes(data[len(_MAGIC):start], "little")
+        header = json.loads(data[start:start + size])
+        return cls(header["interned"], header["kind"], data[start + size:])
+
+
+# ---------------------------------------------------------------------------
+# Training
+# ---------------------------------------------------------------------------
+
+
+def _walk(value, keys: Counter, values: Counter):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            keys[key] += 1
+            _walk(item, keys, values)
+    elif isinstance(value, list):
+        for item in value:
+            _walk(item, keys, values)
+    elif isinstance(value, str) and len(value) <= _MAX_INTERNED_VALUE:
+        values[value] += 1
+
+
+def _interned_table(records: list) -> list:
+    """The default table plus every key, and every short value common enough to share."""
+    keys, values = Counter(), Counter()
+    for record in records:
+        _walk(record, keys, values)
+    min_count = max(2, int(len(records) * _MIN_VALUE_SHARE))
+    frequent = [k for k, _ in keys.most_common()]
+    frequent += [v for v, n in values.most_common() if n >= min_count]
+    # Most frequent first, so the common names get one-byte references.
+    table = list(dict.fromkeys(frequent + _default_interned()))
+    return table[:_MAX_INTERNED]
+
+
+def _zlib_dictionary(samples: list, size: int) -> bytes:
+    """
+    The phrases shared by the most samples (weighted by length), up to size
+    bytes. zlib prefers matches near the end of the dictionary, so the most
+    valuable phrases go last.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update({p.strip() for p in _PHRASE_END.split(sample) if 8 <= len(p.strip()) <= 256})
+    chosen, total = [], 0
+    for phrase, n in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if n < 2 or total + len(phrase) + 1 > size:
+            continue
+        chosen.append(phrase)
+        total += len(phrase) + 1
+    return b"\n".join(reversed(chosen))
+
+
+def train_codec(records: list, size: int = 64 * 1024, kind: str | None = None) -> RecordCodec:
+    """
+    A codec whose table and dictionary are fitted to records (a few thousand
+    is plenty). kind is "zstd" or "zlib"; the default is zstd when installed.
+    """
+    if not records:
+        raise ValueError("No records to train the codec dictionary on")
+    kind = kind or ("zstd" if zstandard is not None else "zlib")
+    table = _interned_table(records)
+    untrained = RecordCodec(table, kind)
+    samples = [untrained.pack(r) for r in records]
+    if kind == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd dictionaries need the zstandard package: pip install zstandard")
+        try:
+            dictionary = zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Too few or too small records to train a zstd dictionary: {e}") from e
+    else:
+        dictionary = _zlib_dictionary(samples, min(size, _ZLIB_MAX_DICT))
+    return RecordCodec(table, kind, dictionary)
+
+
+def training_records(limit: int = 20_000) -> list:
+    """Recent history entries and gallery entries — the corpus the dictionary is trained on."""
+    from tools.prompt_gallery import _gallery_path
+    from tools.prompt_history import history_enabled, iter_entries
+
+    records = []
+    if history_enabled():
+        records.extend(iter_entries(limit))
+    try:
+        with open(_gallery_path()) as f:
+            records.extend(json.load(f)["entries"])
+    except (OSError, ValueError, KeyError):
+        pass
+    return records[:limit]
+
+
+# ---------------------------------------------------------------------------
+# Shared codec
+# ---------------------------------------------------------------------------
+
+
+def archive_path(path: str, dict_id: bytes) -> str:
+    """Where the dictionary with dict_id is kept for decoding, next to path."""
+    return f"{path}.{dict_id.hex()}"
+
+
+@lru_cache(maxsize=2)
+def _load(path: str, mtime: float | None) -> RecordCodec:
+    return RecordCodec.load(path) if mtime is not None else _untrained()
+
+
+@lru_cache(maxsize=1)
+def _untrained() -> RecordCodec:
+    return RecordCodec()
+
+
+@lru_cache(maxsize=16)
+def _archived(path: str, dict_id: bytes) -> RecordCodec:
+    try:
+        return RecordCodec.load(archive_path(path, dict_id))
+    except OSError:
+        raise ValueError(
+            f"Record was encoded with codec dictionary {dict_id.hex()}, "
+            f"which is not in {archive_path(path, dict_id)}"
+        ) from None
+
+
+def codec() -> RecordCodec:
+    """The trained codec from RECORD_CODEC_DICT, or the untrained default when there is none yet."""
+    path = _dict_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+    # Keyed on mtime, so a retrained dictionary is picked up without a restart.
+    return _load(path, mtime)
+
+
+def encode_record(record) -> bytes:
+    return codec().encode(record)
+
+
+def decode_record(blob: bytes):
+    """Decode blob with the dictionary it was written with: the current one, the untrained default or an archived one."""
+    current = codec()
+    dict_id = bytes(blob[1:5])
+    if len(blob) < 5 or dict_id == current.dict_id:
+        return current.decode(blob)
+    if dict_id == _untrained().dict_id:
+        return _untrained().decode(blob)
+    return _archived(_dict_path(), dict_id).decode(blob)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="Train the dictionary on the enhancement history")
+    train.add_argument("--limit", type=int, default=20_000, help="Newest records to train on (default: 20000)")
+    train.add_argument("--size", type=int, default=64 * 1024, help="Dictionary bytes (default: 65536; zlib caps at 32768)")
+    train.add_argument("--kind", choices=sorted(_KIND_NAMES), default=None, help="Default: zstd when installed")
+    train.add_argument("--out", default=None, help=f"Output path (default: RECORD_CODEC_DICT or {_DEFAULT_PATH})")
+    args = parser.parse_args()
+
+    try:
+        records = training_records(args.limit)
+        trained = train_codec(records, args.size, args.kind)
+        trained.save(args.out or _dict_path(), len(records))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps({
+        "records": len(records),
+        "kind": trained.kind,
+        "dict_id": trained.dict_id.hex(),
+        "interned": len(trained.interned),
+        "dictionary_bytes": len(trained.dictionary),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Instant mode: render a structured prompt locally, with zero API calls.
+
+Takes the analyzed component map plus user answers and formats them with the
+profile's structure, role_framing and cot_phrase, stripping the profile's
+banned filler words. Also the degraded fallback when the API is unavailable.
+"""
+
+import re
+
+from tools.assemble_prompt import assemble_prompt
+from tools.enhance_prompt import LLM_PROFILES
+
+# Components that carry the user's actual directive, in order of preference.
+# The raw prompt lands here when the analysis found nothing usable.
+_PRIMARY_COMPONENTS = ("task", "objective", "research_question")
+
+# Components that hold the expert persona and take the profile's role_framing.
+_ROLE_COMPONENTS = ("role", "persona")
+
+_ROLE_PREFIX = re.compile(r"^\s*(you are|act as|as)\s+", re.IGNORECASE)
+_SPACE_BEFORE_PUNCT = re.compile(r"\s+([,.;:!?])")
+_DANGLING_COMMA = re.compile(r",+([.;:!?])|,+$", re.MULTILINE)
+_SENTENCE_START = re.compile(r"(^|[.!?]\s+)([a-z])")
+
+
+def _compile_avoid(avoid: list):
+    if not avoid:
+        return None
+    alternatives = "|".join(re.escape(a) for a in sorted(avoid, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternatives})\b,?[ \t]*", re.IGNORECASE)
+
+
+# Compiled once per profile — rendering must stay in the millisecond range.
+_AVOID_PATTERNS = {llm: _compile_avoid(p["avoid"]) for llm, p in LLM_PROFILES.items()}
+
+
+def strip_avoided(text: str, target_llm: str) -> str:
+    """Remove the profile's banned filler words/phrases and tidy the result."""
+    pattern = _AVOID_PATTERNS[target_llm]
+    if pattern is None or not text:
+        return text
+    cleaned = pattern.sub("", text)
+    cleaned = re.sub(r"[ \t]{2,}", " ", cleaned).strip()
+    cleaned = _SPACE_BEFORE_PUNCT.sub(r"\1", cleaned)
+    cleaned = _DANGLING_COMMA.sub(r"\1", cleaned)
+    return _SENTENCE_START.sub(lambda m: m.group(1) + m.group(2).upper(), cleaned)
+
+
+def _frame_role(text: str, role_framing: str) -> str:
+    expert = _ROLE_PREFIX.sub("", text.strip()).rstrip(".")
+    return role_framing.replace("[expert]", expert)
+
+
+def render_instant_prompt(
+    raw_prompt: str,
+    target_llm: str,
+    components: dict,
+    user_answers: dict,
+) -> str:
+    """
+    Deterministically format the prompt for target_llm without calling the API.
+    Found component text and user answers are merged per component; when no
+    directive component has content the raw prompt is used as the directive.
+    """
+    profile = LLM_PROFILES[target_llm]
+    answers = user_answers or {}
+
+    sections = {}
+    for c in profile["components"]:
+        # Only text counts — a malformed analysis can hold lists or numbers.
+        parts = [p.strip() for p in (components.get(c), answers.get(c)) if isinstance(p, str) and p.strip()]
+        if parts:
+            sections[c] = "\n".join(dict.fromkeys(parts))
+
+    primary = next((c for c in _PRIMARY_COMPONENTS if c in profile["components"]), None)
+    if primary and not sections.get(primary):
+        sections[primary] = raw_prompt.strip()
+
+    for c in _ROLE_COMPONENTS:
+        if not sections.get(c):
+            continue
+        if profile["has_role"] and profile["role_framing"]:
+            sections[c] = _frame_role(sections[c], profile["role_framing"])
+        else:
+            del sections[c]
+
+    sections = {c: strip_avoided(text, target_llm) for c, text in sections.items()}
+
+    # Profiles with a CoT trailer get it during assembly; otherwise the
+    # phrase closes the last component (e.g. Claude's instructions).
+    if profile["cot_phrase"] and not profile["cot_trailer"]:
+        last = profile["components"][-1]
+        existing = sections.get(last, "")
+        if profile["cot_phrase"] not in existing:
+            sections[last] = f"{existing}\n{profile['cot_phrase']}".strip()
+
+    return assemble_prompt(target_llm, sections)
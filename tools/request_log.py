@@ -0,0 +1,206 @@
+"""
+Append-only structured log of pipeline runs, written off the request path.
+
+Every background job, API request and in-page streamed stage is one JSON
+line: flow ("job" / "api" / "app"), kind, profile, outcome, wall time,
+per-stage upstream latency and tokens, cache outcomes (near-duplicate analysis
+reuse, prompt-cache reads) and per-stage deadline outcomes. log_record() only puts the record on a queue; a
+single writer thread per process batches the queue into rotating segments
+
+    <REQUEST_LOG_DIR>/requests-<YYYYMMDD>-<HHMMSS>-<pid>.jsonl
+
+(default .tmp/logs, "off" disables it). A segment is closed at
+REQUEST_LOG_SEGMENT_MB or midnight, whichever comes first, and is never
+rewritten. tools/compact_request_log.py compacts segments into columns for queries.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from tools import metrics
+from tools.token_budget import TokenLedger
+
+_DEFAULT_DIR = os.path.join(".tmp", "logs")
+SEGMENT_PREFIX = "requests-"
+
+# Records wait at most this long for a batch to fill before they are written.
+_FLUSH_SECONDS = 1.0
+_BATCH_SIZE = 256
+# Beyond this many unwritten records, new ones are dropped (and counted) —
+# logging never slows down or blocks a request.
+_MAX_PENDING = 10_000
+
+OUTCOMES = ("ok", "degraded", "partial", "timeout", "quota", "cancelled", "error")
+
+
+def log_dir() -> str:
+    return os.getenv("REQUEST_LOG_DIR", _DEFAULT_DIR)
+
+
+def request_log_enabled() -> bool:
+    return log_dir().lower() != "off"
+
+
+def _segment_bytes() -> int:
+    return int(float(os.getenv("REQUEST_LOG_SEGMENT_MB", "16")) * 1024 * 1024)
+
+
+class RunRecord:
+    """
+    Collects one pipeline run: pass ledger.record to usage_listener() and run
+    the stages inside capturing(), then call finish() once with the outcome.
+    """
+
+    def __init__(self, flow: str, kind: str, target_llm: str | None):
+        self.flow = flow
+        self.kind = kind
+        self.target_llm = target_llm
+        self.outcome = "ok"
+        self.ledger = TokenLedger()
+        self.events = []
+        self._started_at = time.time()
+        self._started = time.perf_counter()
+        self._finished = False
+
+    def capturing(self):
+        """Attribute the metrics recorded in this block (and its worker threads) to the run."""
+        return metrics.capture(self.events)
+
+    def record(self) -> dict:
+        stages, tokens, deadline, cache, backends = {}, {}, {}, {}, set()
+        for name, value, labels in list(self.events):
+            stage = labels.get("stage")
+            if name == "upstream.latency_ms" and stage:
+                stages[stage] = round(stages.get(stage, 0) + value, 1)
+                backends.add(labels.get("backend", "anthropic"))
+            elif name == "deadline.outcome":
+                deadline[stage] = labels["outcome"]
+            elif name == "analysis_reuse":
+                cache["analysis_reuse"] = labels["outcome"]
+            elif name == "upstream.cache_read_tokens":
+                cache["cache_read_tokens"] = cache.get("cache_read_tokens", 0) + int(value)
+        for entry in self.ledger.entries:
+            stage_tokens = tokens.setdefault(entry["stage"], {"input": 0, "output": 0})
+            stage_tokens["input"] += entry["input_tokens"]
+            stage_tokens["output"] += entry["output_tokens"]
+        return {
+            "ts": round(self._started_at, 3),
+            "flow": self.flow,
+            "kind": self.kind,
+            "profile": self.target_llm,
+            "outcome": self.outcome,
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 1),
+            "stages": stages,
+            "tokens": tokens,
+            "cache": cache,
+            "deadline": deadline,
+            "backends": sorted(backends),
+        }
+
+    def finish(self, outcome: str | None = None):
+        """Queue the run's record (once; later calls are ignored)."""
+        if self._finished:
+            return
+        self._finished = True
+        if outcome is not None:
+            self.outcome = outcome
+        log_record(self.record())
+
+
+class _Writer:
+    """The background thread that owns this process's current segment."""
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=_MAX_PENDING)
+        self._file = None
+        self._day = None
+        threading.Thread(target=self._run, name="request-log", daemon=True).start()
+
+    def put(self, record: dict) -> bool:
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            return False
+
+    def flush(self, timeout: float = 5.0):
+        """Block until every record queued so far is on disk (or timeout)."""
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            flush_at = time.monotonic() + _FLUSH_SECONDS
+            while len(batch) < _BATCH_SIZE and not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(self._queue.get(timeout=max(flush_at - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            records = [r for r in batch if isinstance(r, dict)]
+            if records:
+                try:
+                    self._write(records)
+                except (OSError, TypeError, ValueError):
+                    metrics.increment("request_log.dropped", len(records))
+            for marker in batch:
+                if isinstance(marker, threading.Event):
+                    marker.set()
+
+    def _write(self, records: list):
+        data = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode()
+        now = datetime.now()
+        if (
+            self._file is None
+            or self._day != now.date()
+            or self._file.tell() + len(data) > _segment_bytes()
+        ):
+            self._rotate(now)
+        self._file.write(data)
+        self._file.flush()
+        metrics.increment("request_log.written", len(records))
+
+    def _rotate(self, now: datetime):
+        if self._file is not None:
+            self._file.close()
+        directory = log_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = f"{SEGMENT_PREFIX}{now:%Y%m%d-%H%M%S}-{os.getpid()}.jsonl"
+        self._file = open(os.path.join(directory, name), "ab")
+        self._day = now.date()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer() -> _Writer:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _Writer()
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def log_record(record: dict):
+    """Queue one record for the background writer; never blocks."""
+    if not request_log_enabled():
+        return
+    if not _get_writer().put(record):
+        metrics.increment("request_log.dropped")
+
+
+def flush(timeout: float = 5.0):
+    """Wait until the records queued so far are written (e.g. before a query or in tests)."""
+    if _writer is not None:
+        _writer.flush(timeout)
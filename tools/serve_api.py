@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""Serve the prompt enhancer as a headless HTTP API (ASGI, JSON + SSE streaming)."""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from tools.enhance_prompt import (
+    LLM_PROFILES,
+    MAX_ANSWER_CHARS,
+    analyze_prompt_components,
+    build_enhanced_prompt,
+    generate_clarifying_questions,
+    safe_error_message,
+    stream_enhanced_prompt,
+    usage_listener,
+    validate_inputs,
+    warmup,
+)
+from tools.deadline import Deadline, DeadlineExceeded, flow_deadline_seconds, record_outcome
+from tools.lint_prompt import repair_prompt
+from tools.quota import QuotaExceeded, account_for, charged_to
+from tools.render_prompt import render_instant_prompt
+from tools.request_log import RunRecord
+from tools.token_budget import TokenLedger
+
+load_dotenv()
+
+# Upstream-bound requests allowed in flight per worker process; the rest wait
+# up to _QUEUE_TIMEOUT_SECONDS for a slot and are then rejected with 503.
+_MAX_CONCURRENT_REQUESTS = int(os.getenv("API_MAX_CONCURRENT_REQUESTS", "16"))
+_QUEUE_TIMEOUT_SECONDS = float(os.getenv("API_QUEUE_TIMEOUT_SECONDS", "5"))
+
+_slots = None
+_warmup_result = None
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _get_slots() -> asyncio.Semaphore:
+    # Created lazily so it binds to the worker's running event loop.
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(_MAX_CONCURRENT_REQUESTS)
+    return _slots
+
+
+async def _read_body(request: Request, answers: bool = False) -> dict:
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise _BadRequest("Request body must be JSON.")
+    if not isinstance(body, dict):
+        raise _BadRequest("Request body must be a JSON object.")
+    raw_prompt = body.get("raw_prompt", "")
+    target_llm = body.get("target_llm", "")
+    user_answers = body.get("answers") or {}
+    if answers and not isinstance(user_answers, dict):
+        raise _BadRequest("'answers' must be an object of component -> answer.")
+    components = body.get("components")
+    if components is not None and not isinstance(components, dict):
+        raise _BadRequest("'components' must be an object of component -> text.")
+    max_questions = body.get("max_questions", 4)
+    if isinstance(max_questions, bool) or not isinstance(max_questions, int) or not 1 <= max_questions <= 8:
+        raise _BadRequest("'max_questions' must be an integer from 1 to 8.")
+    flow_seconds = flow_deadline_seconds()
+    deadline_seconds = body.get("deadline_seconds", flow_seconds)
+    if (
+        isinstance(deadline_seconds, bool)
+        or not isinstance(deadline_seconds, (int, float))
+        or not 1 <= deadline_seconds <= flow_seconds
+    ):
+        raise _BadRequest(f"'deadline_seconds' must be a number from 1 to {flow_seconds:g}.")
+    try:
+        validate_inputs(raw_prompt, target_llm, user_answers if answers else None)
+    except ValueError as e:
+        raise _BadRequest(str(e))
+    if components is not None:
+        _check_components(components, target_llm)
+    body["raw_prompt"] = raw_prompt.strip()
+    body["answers"] = user_answers
+    body["deadline_seconds"] = deadline_seconds
+    body["max_questions"] = max_questions
+    return body
+
+
+def _check_components(components: dict, target_llm: str):
+    """Supplied components must be the profile's, each text (within the answer limit) or null."""
+    allowed = LLM_PROFILES[target_llm]["components"]
+    for component, value in components.items():
+        if component not in allowed:
+            raise _BadRequest(f"Unknown component '{component}' for {target_llm}.")
+        if value is not None and not isinstance(value, str):
+            raise _BadRequest(f"Component '{component}' must be text or null.")
+        if value and len(value) > MAX_ANSWER_CHARS:
+            raise _BadRequest(f"Component '{component}' is too long (max {MAX_ANSWER_CHARS:,} characters).")
+
+
+def _metered_call(run: RunRecord, fn, *args):
+    with usage_listener(run.ledger.record), run.capturing():
+        return fn(*args)
+
+
+def _build_and_repair(raw_prompt: str, target_llm: str, components: dict, answers: dict, deadline: Deadline) -> tuple:
+    """(enhanced_prompt, lint report, degraded) — rendered locally if the deadline runs out."""
+    try:
+        enhanced = build_enhanced_prompt(raw_prompt, target_llm, components, answers, deadline)
+    except DeadlineExceeded:
+        record_outcome("enhance", "fallback")
+        return render_instant_prompt(raw_prompt, target_llm, components, answers), {}, True
+    enhanced, lint = repair_prompt(enhanced, target_llm, components, answers, deadline=deadline)
+    return enhanced, lint, False
+
+
+def _analyze_or_empty(raw_prompt: str, target_llm: str, deadline: Deadline) -> dict:
+    """Components of raw_prompt; none found if the analysis runs out of time."""
+    try:
+        return analyze_prompt_components(raw_prompt, target_llm, deadline)
+    except DeadlineExceeded:
+        record_outcome("analysis", "fallback")
+        return {c: None for c in LLM_PROFILES[target_llm]["components"]}
+
+
+def _usage(ledger: TokenLedger) -> dict:
+    return {
+        "input_tokens": sum(e["input_tokens"] for e in ledger.entries),
+        "output_tokens": sum(e["output_tokens"] for e in ledger.entries),
+    }
+
+
+def _in_one_context(gen, ctx: contextvars.Context | None = None):
+    """
+    Step a generator inside one fixed Context (a copy of the current one by
+    default), whichever threadpool thread runs each step — otherwise
+    usage_listener() inside it cannot reset its ContextVar.
+    """
+    ctx = ctx or contextvars.copy_context()
+    while True:
+        try:
+            yield ctx.run(next, gen)
+        except StopIteration:
+            return
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _endpoint(handler, answers: bool = False):
+    """Wrap a handler with body validation, the concurrency limit and error mapping."""
+    async def endpoint(request: Request):
+        started = time.time()
+        try:
+            body = await _read_body(request, answers=answers)
+        except _BadRequest as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        slots = _get_slots()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            return JSONResponse({"error": "Server busy. Please retry shortly."}, status_code=503)
+
+        # The flow's deadline starts when the request arrives — queueing counts.
+        deadline = Deadline(started + body["deadline_seconds"])
+        run = RunRecord("api", handler.__name__.lstrip("_"), body["target_llm"])
+        user = account_for(request.headers)
+        try:
+            # A stream copies this context, so its calls are charged to user too.
+            with charged_to(user):
+                response = await handler(body, request, slots, deadline, run)
+        except Exception as e:
+            slots.release()
+            if isinstance(e, QuotaExceeded):
+                run.finish("quota")
+                return JSONResponse({"error": str(e)}, status_code=429)
+            timed_out = isinstance(e, DeadlineExceeded)
+            run.finish("timeout" if timed_out else "error")
+            return JSONResponse({"error": safe_error_message(e)}, status_code=504 if timed_out else 502)
+        # A stream logs its run when it ends.
+        if not isinstance(response, StreamingResponse):
+            run.finish("error" if response.status_code >= 400 else None)
+        return response
+    return endpoint
+
+
+def _release_after(response, slots: asyncio.Semaphore):
+    """Hand the concurrency slot to the response: freed when it finishes sending."""
+    response.background = BackgroundTask(slots.release)
+    return response
+
+
+def _wants_stream(body: dict, request: Request) -> bool:
+    return bool(body.get("stream")) or "text/event-stream" in request.headers.get("accept", "")
+
+
+def _stream_response(run: RunRecord, body: dict, components: dict, slots, deadline: Deadline, prefix_events=()):
+    # The handler's context (with its quota account); the body runs after the handler returns.
+    context = contextvars.copy_context()
+
+    async def events():
+        try:
+            for event in prefix_events:
+                yield event
+            chunks = []
+
+            def produce():
+                with usage_listener(run.ledger.record), run.capturing():
+                    yield from stream_enhanced_prompt(
+                        body["raw_prompt"], body["target_llm"], components, body["answers"], deadline,
+                    )
+
+            try:
+                async for text in iterate_in_threadpool(_in_one_context(produce(), context)):
+                    chunks.append(text)
+                    yield _sse("delta", {"text": text})
+            except DeadlineExceeded:
+                # Nothing arrived in time: send the locally rendered structure instead.
+                record_outcome("enhance", "fallback")
+                run.outcome = "degraded"
+                enhanced = render_instant_prompt(body["raw_prompt"], body["target_llm"], components, body["answers"])
+                yield _sse("done", {"enhanced_prompt": enhanced, "lint": {}, "degraded": True, "usage": _usage(run.ledger)})
+                return
+            # A stream cut short by the deadline is a partial result; repairs then stay local.
+            partial = deadline.expired()
+            if partial:
+                run.outcome = "partial"
+            # Deltas are already out; "done" carries the repaired prompt.
+            enhanced, lint = await run_in_threadpool(
+                context.copy().run, _metered_call, run, repair_prompt,
+                "".join(chunks).strip(), body["target_llm"], components, body["answers"], not partial, deadline,
+            )
+            yield _sse("done", {
+                "enhanced_prompt": enhanced, "lint": lint, "partial": partial, "usage": _usage(run.ledger),
+            })
+        except Exception as e:
+            run.outcome = "quota" if isinstance(e, QuotaExceeded) else "error"
+            yield _sse("error", {"error": safe_error_message(e)})
+        finally:
+            slots.release()
+            run.finish()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _analyze(body: dict, request: Request, slots, deadline: Deadline, run: RunRecord):
+    components = await run_in_threadpool(
+        _metered_call, run, analyze_prompt_components, body["raw_prompt"], body["target_llm"], deadline,
+    )
+    return _release_after(JSONResponse({"components": components, "usage": _usage(run.ledger)}), slots)
+
+
+async def _questions(body: dict, request: Request, slots, deadline: Deadline, run: RunRecord):
+    components = body.get("components")
+    if components is None:
+        components = await run_in_threadpool(
+            _metered_call, run, _analyze_or_empty, body["raw_prompt"], body["target_llm"], deadline,
+        )
+    questions = await run_in_threadpool(
+        _metered_call, run, generate_clarifying_questions,
+        body["raw_prompt"], body["target_llm"], components, body["max_questions"], False, deadline,
+    )
+    return _release_after(
+        JSONResponse({"components": components, "questions": questions, "usage": _usage(run.ledger)}),
+        slots,
+    )
+
+
+async def _enhance(body: dict, request: Request, slots, deadline: Deadline, run: RunRecord):
+    components = body.get("components")
+    if components is None:
+        components = await run_in_threadpool(
+            _metered_call, run, _analyze_or_empty, body["raw_prompt"], body["target_llm"], deadline,
+        )
+    if _wants_stream(body, request):
+        return _stream_response(run, body, components, slots, deadline)
+    enhanced, lint, degraded = await run_in_threadpool(
+        _metered_call, run, _build_and_repair,
+        body["raw_prompt"], body["target_llm"], components, body["answers"], deadline,
+    )
+    if degraded:
+        run.outcome = "degraded"
+    return _release_after(
+        JSONResponse({"enhanced_prompt": enhanced, "lint": lint, "degraded": degraded, "usage": _usage(run.ledger)}),
+        slots,
+    )
+
+
+async def _pipeline(body: dict, request: Request, slots, deadline: Deadline, run: RunRecord):
+    """Analyze + enhance in one request, using any answers supplied up front."""
+    components = await run_in_threadpool(
+        _metered_call, run, _analyze_or_empty, body["raw_prompt"], body["target_llm"], deadline,
+    )
+    if _wants_stream(body, request):
+        return _stream_response(
+            run, body, components, slots, deadline, prefix_events=[_sse("components", components)],
+        )
+    enhanced, lint, degraded = await run_in_threadpool(
+        _metered_call, run, _build_and_repair,
+        body["raw_prompt"], body["target_llm"], components, body["answers"], deadline,
+    )
+    if degraded:
+        run.outcome = "degraded"
+    return _release_after(
+        JSONResponse({
+            "components": components, "enhanced_prompt": enhanced, "lint": lint,
+            "degraded": degraded, "usage": _usage(run.ledger),
+        }),
+        slots,
+    )
+
+
+async def _profiles(request: Request):
+    return JSONResponse({
+        llm: {"style_hint": p["style_hint"], "components": p["components"]}
+        for llm, p in LLM_PROFILES.items()
+    })
+
+
+async def _health(request: Request):
+    return JSONResponse({"status": "ok"})
+
+
+async def _ready(request: Request):
+    """503 until this worker's warmup has finished — point load balancer readiness checks here."""
+    if _warmup_result is None:
+        return JSONResponse({"status": "warming up"}, status_code=503)
+    return JSONResponse({"status": "ready", "warmup": _warmup_result})
+
+
+async def _run_warmup():
+    global _warmup_result
+    _warmup_result = await run_in_threadpool(warmup)
+
+
+@asynccontextmanager
+async def _lifespan(app):
+    # Warm up in the background, so /health answers while the worker warms up.
+    task = asyncio.create_task(_run_warmup())
+    yield
+    task.cancel()
+
+
+app = Starlette(lifespan=_lifespan, routes=[
+    Route("/health", _health, methods=["GET"]),
+    Route("/ready", _ready, methods=["GET"]),
+    Route("/profiles", _profiles, methods=["GET"]),
+    Route("/analyze", _endpoint(_analyze), methods=["POST"]),
+    Route("/questions", _endpoint(_questions), methods=["POST"]),
+    Route("/enhance", _endpoint(_enhance, answers=True), methods=["POST"]),
+    Route("/pipeline", _endpoint(_pipeline, answers=True), methods=["POST"]),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind (default: 8000)")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes (default: 2)")
+    parser.add_argument("--keep-alive", type=int, default=30, help="HTTP keep-alive timeout in seconds (default: 30)")
+    parser.add_argument("--max-connections", type=int, default=256, help="Connections per worker before 503 (default: 256)")
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        print("uvicorn is not installed. Run: pip install -r requirements.txt", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} worker(s)")
+    uvicorn.run(
+        "tools.serve_api:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.max_connections,
+    )
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Local token estimation + token ledger for per-session and per-day budgets."""
+
+import math
+import re
+import threading
+import time
+from datetime import date
+
+# Words, runs of digits, and single punctuation marks — roughly how a BPE
+# tokenizer splits English text. Long words cost about one token per 4 chars.
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+_CHARS_PER_TOKEN = 4
+
+# Process-wide usage for the current calendar day, shared by every session.
+_daily_lock = threading.Lock()
+_daily_usage = {"date": date.today(), "tokens": 0}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate the Claude token count of text without an API call.
+    Runs in microseconds and errs slightly high for English prose.
+    """
+    if not text:
+        return 0
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if piece.isdigit():
+            count += math.ceil(len(piece) / 3)
+        else:
+            count += max(1, math.ceil(len(piece) / _CHARS_PER_TOKEN))
+    return count
+
+
+def daily_tokens_used() -> int:
+    """Tokens consumed by all sessions in this process since midnight."""
+    with _daily_lock:
+        if _daily_usage["date"] != date.today():
+            return 0
+        return _daily_usage["tokens"]
+
+
+def _add_daily_tokens(tokens: int):
+    with _daily_lock:
+        today = date.today()
+        if _daily_usage["date"] != today:
+            _daily_usage["date"] = today
+            _daily_usage["tokens"] = 0
+        _daily_usage["tokens"] += tokens
+
+
+class TokenLedger:
+    """
+    Records the actual token usage reported by the API for one session.
+    Pass ledger.record to usage_listener() to fill it; every entry also
+    counts towards the process-wide daily total.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, input_tokens: int, output_tokens: int):
+        with self._lock:
+            self.entries.append({
+                "time": time.time(),
+                "stage": stage,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+            })
+        _add_daily_tokens(input_tokens + output_tokens)
+
+    def merge(self, entries: list):
+        """Add entries recorded by another ledger (e.g. a background job's); the daily total already has them."""
+        with self._lock:
+            self.entries.extend(entries)
+
+    @property
+    def total(self) -> int:
+        with self._lock:
+            return sum(e["input_tokens"] + e["output_tokens"] for e in self.entries)
+
+    def remaining(self, session_budget: int) -> int:
+        return max(session_budget - self.total, 0)